@@ -0,0 +1,135 @@
+"""Measures how long the Tumult client takes to start and show its window."""
+
+import argparse
+import logging
+import os
+import subprocess
+import sys
+import time
+from argparse import Namespace, ArgumentParser
+from pathlib import Path
+from typing import Any
+
+from src.benchmark.results import summarize, environment, report
+from src.shared.logging import DATETIME_FORMAT, LOG_FORMAT
+
+REPOSITORY_ROOT: Path = Path(__file__).resolve().parents[2]
+UI_SOURCES: tuple[str, ...] = ("generated", "ui-file")
+
+# Runs in a fresh interpreter, printing the seconds from its first line until the window is shown
+STARTUP_SCRIPT: str = """
+import sys
+import time
+
+start_time = time.perf_counter()
+from PyQt6.QtWidgets import QApplication
+
+import src.client.window as window_module
+
+if sys.argv[1] == "generated" and window_module.Ui_main_window is None:
+    sys.exit("The UI module has not been generated from client_window.ui")
+if sys.argv[1] == "ui-file":
+    window_module.Ui_main_window = None
+application = QApplication(sys.argv[:1])
+window = window_module.ClientWindow()
+application.processEvents()
+print(time.perf_counter() - start_time)
+"""
+
+
+def _measure_startup(ui_source: str, qt_platform: str) -> tuple[float, float]:
+    """
+    Starts the client window in a new process, returning the seconds until it was
+    shown both from launching the process and from the process's first line.
+    """
+    launch_time: float = time.perf_counter()
+    completed_process: subprocess.CompletedProcess = subprocess.run(
+        [sys.executable, "-c", STARTUP_SCRIPT, ui_source],
+        cwd=REPOSITORY_ROOT,
+        env={**os.environ, "QT_QPA_PLATFORM": qt_platform},
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    process_time: float = time.perf_counter() - launch_time
+    return process_time, float(completed_process.stdout.strip().splitlines()[-1])
+
+
+def run_benchmark(arguments: Namespace) -> dict[str, Any]:
+    """Starts the client repeatedly with each UI source and returns the startup times."""
+    results: dict[str, Any] = {}
+    for ui_source in UI_SOURCES:
+        logging.info(
+            "Starting the client %i times with the %s UI", arguments.runs, ui_source
+        )
+        # Warm the filesystem cache so the first run is not an outlier
+        _measure_startup(ui_source, arguments.platform)
+        process_times: list[float] = []
+        in_process_times: list[float] = []
+        for _ in range(arguments.runs):
+            process_time, in_process_time = _measure_startup(
+                ui_source, arguments.platform
+            )
+            process_times.append(process_time)
+            in_process_times.append(in_process_time)
+        results[ui_source] = {
+            "process_ms": summarize(process_times),
+            "in_process_ms": summarize(in_process_times),
+        }
+
+    generated_median: float = results["generated"]["process_ms"]["p50"]
+    ui_file_median: float = results["ui-file"]["process_ms"]["p50"]
+    return {
+        "config": vars(arguments),
+        "environment": environment(),
+        "startup": results,
+        "generated_speedup": ui_file_median / generated_median,
+    }
+
+
+def _setup_logging() -> None:
+    """Configures the logging with the formats from the Tumult logging module."""
+    logging.basicConfig(
+        level=logging.INFO,
+        format=LOG_FORMAT,
+        datefmt=DATETIME_FORMAT,
+    )
+
+
+def _parse_arguments() -> Namespace:
+    """Parses the command line arguments for the number of runs and the Qt platform."""
+    parser: ArgumentParser = argparse.ArgumentParser(
+        description="Tumult Client Startup Benchmark"
+    )
+    parser.add_argument(
+        "--runs", type=int, default=10, help="Number of starts measured for each UI"
+    )
+    parser.add_argument(
+        "--platform",
+        type=str,
+        default="offscreen",
+        help="Qt platform plugin the client is started with",
+    )
+    parser.add_argument(
+        "--output",
+        type=str,
+        default=None,
+        help="File the JSON results are written to, printed if unset",
+    )
+    arguments: Namespace = parser.parse_args()
+    if arguments.runs < 1:
+        parser.error("--runs must be at least 1")
+    return arguments
+
+
+def main() -> None:
+    """Runs the benchmark with the configured arguments and reports the results as JSON."""
+    _setup_logging()
+
+    arguments: Namespace = _parse_arguments()
+    results: dict[str, Any] = run_benchmark(arguments)
+    report(results, arguments.output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,423 @@
+"""Headless load generator measuring the throughput and latency of a Tumult server."""
+
+import argparse
+import asyncio
+import logging
+import socket
+import subprocess
+import sys
+import time
+import zlib
+from argparse import Namespace, ArgumentParser
+from pathlib import Path
+from typing import Optional, Any
+
+from src.benchmark.results import summarize, environment, report
+from src.shared.logging import DATETIME_FORMAT, LOG_FORMAT
+from src.shared.protocol import (
+    FrameBuffer,
+    TumultFrame,
+    TumultSocket,
+    RequestType,
+    ENCODING_FORMAT,
+    DEFAULT_IPV4_ADDRESS,
+    RECEIVE_BUFFER_SIZE,
+    LEGACY_PROTOCOL_VERSION,
+    COMPRESSION_DEFLATE,
+    batch_requests,
+    decompress_requests,
+    negotiate_version,
+)
+
+REPOSITORY_ROOT: Path = Path(__file__).resolve().parents[2]
+SERVER_START_TIMEOUT: float = 10.0
+CONNECT_CONCURRENCY: int = 32
+DRAIN_TIMEOUT: float = 10.0
+
+
+def _resident_memory(pid: int) -> Optional[int]:
+    """Returns the resident memory in bytes of a process and its children, if available."""
+    status_path: Path = Path(f"/proc/{pid}/status")
+    if not status_path.exists():
+        return None
+    resident_memory: int = 0
+    for line in status_path.read_text().splitlines():
+        if line.startswith("VmRSS:"):
+            resident_memory = int(line.split()[1]) * 1024
+    for children_path in Path(f"/proc/{pid}/task").glob("*/children"):
+        for child_pid in children_path.read_text().split():
+            resident_memory += _resident_memory(int(child_pid)) or 0
+    return resident_memory
+
+
+def _unused_port(ipv4_address: str) -> int:
+    """Returns a port that is currently free on the provided address."""
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as probe_socket:
+        probe_socket.bind((ipv4_address, 0))
+        return probe_socket.getsockname()[1]
+
+
+class BenchmarkBot:
+    """Headless client that sends timestamped messages and records their delivery."""
+
+    def __init__(self, nickname: str, compression: bool) -> None:
+        self.nickname: str = nickname
+        self.compression: bool = compression
+        self.protocol_version: str = LEGACY_PROTOCOL_VERSION
+        self.frame_buffer: FrameBuffer = FrameBuffer()
+        self.decompressor: Any = zlib.decompressobj()
+        self.reader: Optional[asyncio.StreamReader] = None
+        self.writer: Optional[asyncio.StreamWriter] = None
+        self.joined: asyncio.Event = asyncio.Event()
+        self.history_count: int = 0
+        self.received_count: int = 0
+        self.sent_count: int = 0
+        self.latencies: list[float] = []
+        self.last_received: float = 0.0
+        self.receive_task: Optional[asyncio.Task] = None
+
+    async def connect(self, ipv4_address: str, port: int) -> float:
+        """Connects and completes the handshake, returning the seconds until joined."""
+        connect_time: float = time.perf_counter()
+        self.reader, self.writer = await asyncio.open_connection(ipv4_address, port)
+        self.receive_task = asyncio.create_task(self._receive_requests())
+        await self.joined.wait()
+        return time.perf_counter() - connect_time
+
+    async def send_messages(
+        self, interval: float, stop_time: float, message_size: int
+    ) -> None:
+        """Sends a timestamped message every interval until the stop time."""
+        padding: str = "x" * message_size
+        next_send_time: float = time.perf_counter()
+        while next_send_time < stop_time:
+            await asyncio.sleep(max(next_send_time - time.perf_counter(), 0.0))
+            self.write_message(f"{time.perf_counter():.9f} {padding}")
+            next_send_time += interval
+
+    def write_message(self, message: str) -> None:
+        """Queues a chat message on the connection."""
+        frame: TumultFrame = TumultFrame.message(
+            self.nickname, message, self.protocol_version
+        )
+        self.writer.writelines((frame.header, frame.contents))
+        self.sent_count += 1
+
+    async def close(self) -> None:
+        """Stops receiving and closes the connection."""
+        if self.receive_task is not None:
+            self.receive_task.cancel()
+        if self.writer is not None:
+            self.writer.close()
+            try:
+                await self.writer.wait_closed()
+            except ConnectionError:
+                pass
+
+    async def _receive_requests(self) -> None:
+        """Reads and handles requests until the connection closes."""
+        while data := await self.reader.read(RECEIVE_BUFFER_SIZE):
+            self.frame_buffer.feed(data)
+            for request in self.frame_buffer.requests():
+                self._handle_request(request)
+
+    def _handle_request(self, request: TumultSocket.Request) -> None:
+        """Records a received request, unpacking batches and compressed requests."""
+        match request.header.request_type:
+
+            case RequestType.NICKNAME:
+                options: Optional[dict[str, Any]] = (
+                    {"compression": [COMPRESSION_DEFLATE]} if self.compression else None
+                )
+                frame: TumultFrame = TumultFrame.nickname(
+                    self.nickname, self.protocol_version, options
+                )
+                self.writer.writelines((frame.header, frame.contents))
+                self.protocol_version = negotiate_version(request.header.version)
+
+            case RequestType.MESSAGE:
+                if not self.joined.is_set():
+                    self.history_count += 1
+                    return
+                self.last_received = time.perf_counter()
+                self.received_count += 1
+                sent_time: str = request.contents.decode(ENCODING_FORMAT).split(
+                    " ", maxsplit=1
+                )[0]
+                try:
+                    self.latencies.append(self.last_received - float(sent_time))
+                except ValueError:
+                    pass
+
+            case RequestType.JOIN_MESSAGE:
+                if request.header.nickname == self.nickname:
+                    self.joined.set()
+
+            case RequestType.BATCH:
+                for batched_request in batch_requests(request.contents):
+                    self._handle_request(batched_request)
+
+            case RequestType.COMPRESSED:
+                for compressed_request in decompress_requests(
+                    request.contents, self.decompressor
+                ):
+                    self._handle_request(compressed_request)
+
+
+async def _wait_for_server(ipv4_address: str, port: int) -> None:
+    """Waits until the server accepts connections."""
+    deadline: float = time.perf_counter() + SERVER_START_TIMEOUT
+    while True:
+        try:
+            _reader, writer = await asyncio.open_connection(ipv4_address, port)
+            writer.close()
+            return
+        except OSError:
+            if time.perf_counter() > deadline:
+                raise
+            await asyncio.sleep(0.1)
+
+
+async def _fill_history(arguments: Namespace, port: int) -> None:
+    """Sends the configured number of messages so that joining clients replay them."""
+    if arguments.history <= 0:
+        return
+    logging.info("Filling the message history with %i messages", arguments.history)
+    filler: BenchmarkBot = BenchmarkBot("filler", arguments.compression)
+    await filler.connect(arguments.host, port)
+    padding: str = "x" * arguments.message_size
+    for _ in range(arguments.history):
+        filler.write_message(f"{time.perf_counter():.9f} {padding}")
+        await filler.writer.drain()
+    deadline: float = time.perf_counter() + DRAIN_TIMEOUT
+    while filler.received_count < arguments.history and time.perf_counter() < deadline:
+        await asyncio.sleep(0.05)
+    await filler.close()
+
+
+async def _connect_bots(
+    bots: list[BenchmarkBot], ipv4_address: str, port: int
+) -> list[float]:
+    """Connects every bot a few at a time, returning each one's replay and join time."""
+    semaphore: asyncio.Semaphore = asyncio.Semaphore(CONNECT_CONCURRENCY)
+
+    async def connect_bot(bot: BenchmarkBot) -> float:
+        async with semaphore:
+            return await bot.connect(ipv4_address, port)
+
+    return list(await asyncio.gather(*(connect_bot(bot) for bot in bots)))
+
+
+async def _run_load(arguments: Namespace, port: int, server_pid: int) -> dict:
+    """Connects the bots, sends messages at the target rate and collects the results."""
+    await _wait_for_server(arguments.host, port)
+    await _fill_history(arguments, port)
+
+    baseline_memory: Optional[int] = _resident_memory(server_pid)
+    bots: list[BenchmarkBot] = [
+        BenchmarkBot(f"bot{index}", arguments.compression)
+        for index in range(arguments.clients)
+    ]
+    logging.info("Connecting %i bots", len(bots))
+    join_times: list[float] = await _connect_bots(bots, arguments.host, port)
+    await asyncio.sleep(0.5)
+    connected_memory: Optional[int] = _resident_memory(server_pid)
+    for bot in bots:
+        bot.received_count = 0
+        bot.latencies.clear()
+
+    logging.info(
+        "Sending %.1f messages per second for %.1f seconds",
+        arguments.rate,
+        arguments.duration,
+    )
+    interval: float = len(bots) / arguments.rate
+    start_time: float = time.perf_counter()
+    stop_time: float = start_time + arguments.duration
+
+    async def send_from(bot: BenchmarkBot, index: int) -> None:
+        # Stagger the bots so the total load is spread evenly over each interval
+        await asyncio.sleep(interval * index / len(bots))
+        await bot.send_messages(interval, stop_time, arguments.message_size)
+
+    await asyncio.gather(*(send_from(bot, index) for index, bot in enumerate(bots)))
+
+    sent_count: int = sum(bot.sent_count for bot in bots)
+    expected_count: int = sent_count * len(bots)
+    deadline: float = time.perf_counter() + DRAIN_TIMEOUT
+    while (
+        sum(bot.received_count for bot in bots) < expected_count
+        and time.perf_counter() < deadline
+    ):
+        await asyncio.sleep(0.05)
+
+    received_count: int = sum(bot.received_count for bot in bots)
+    elapsed: float = (
+        max((bot.last_received for bot in bots), default=stop_time) - start_time
+    )
+    latencies: list[float] = [latency for bot in bots for latency in bot.latencies]
+    await asyncio.gather(*(bot.close() for bot in bots))
+
+    memory_per_connection: Optional[float] = (
+        (connected_memory - baseline_memory) / len(bots)
+        if baseline_memory is not None and connected_memory is not None
+        else None
+    )
+    return {
+        "throughput": {
+            "sent_messages": sent_count,
+            "delivered_messages": received_count,
+            "expected_deliveries": expected_count,
+            "delivery_ratio": (
+                received_count / expected_count if expected_count else None
+            ),
+            "sent_per_second": sent_count / arguments.duration,
+            "delivered_per_second": received_count / elapsed if elapsed > 0 else None,
+        },
+        "latency_ms": summarize(latencies),
+        "history_replay": {
+            "messages": min(bot.history_count for bot in bots),
+            "join_ms": summarize(join_times),
+        },
+        "memory": {
+            "server_baseline_bytes": baseline_memory,
+            "server_connected_bytes": connected_memory,
+            "per_connection_bytes": memory_per_connection,
+        },
+    }
+
+
+def run_benchmark(arguments: Namespace) -> dict:
+    """Starts a server, runs the load against it and returns the results."""
+    port: int = arguments.port or _unused_port(arguments.host)
+    server_command: list[str] = [
+        sys.executable,
+        "-m",
+        "src.server.main",
+        "--host",
+        arguments.host,
+        "--port",
+        str(port),
+        "--engine",
+        arguments.engine,
+        "--workers",
+        str(arguments.workers),
+        *arguments.server_arg,
+    ]
+    logging.info("Starting server: %s", " ".join(server_command))
+    server_process: subprocess.Popen = subprocess.Popen(
+        server_command,
+        cwd=REPOSITORY_ROOT,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+    try:
+        results: dict = asyncio.run(_run_load(arguments, port, server_process.pid))
+    finally:
+        server_process.terminate()
+        server_process.wait()
+
+    return {
+        "config": {
+            key: value for key, value in vars(arguments).items() if key != "output"
+        },
+        "environment": environment(),
+        **results,
+    }
+
+
+def _setup_logging() -> None:
+    """Configures the logging with the formats from the Tumult logging module."""
+    logging.basicConfig(
+        level=logging.INFO,
+        format=LOG_FORMAT,
+        datefmt=DATETIME_FORMAT,
+    )
+
+
+def _parse_arguments() -> Namespace:
+    """Parses the command line arguments for the server and load settings."""
+    parser: ArgumentParser = argparse.ArgumentParser(
+        description="Tumult Server Load Benchmark"
+    )
+    parser.add_argument(
+        "--host",
+        type=str,
+        default=DEFAULT_IPV4_ADDRESS,
+        help="Address the benchmarked server listens to",
+    )
+    parser.add_argument(
+        "--port", type=int, default=0, help="Server port, a free port if unset"
+    )
+    parser.add_argument(
+        "--engine",
+        type=str,
+        choices=["threads", "asyncio"],
+        default="threads",
+        help="Connection handling engine of the benchmarked server",
+    )
+    parser.add_argument(
+        "--workers", type=int, default=1, help="Number of server processes"
+    )
+    parser.add_argument(
+        "--server-arg",
+        action="append",
+        default=[],
+        help="Extra argument for the server, e.g. --server-arg=--batch-window=0.005",
+    )
+    parser.add_argument(
+        "--clients", type=int, default=50, help="Number of bot connections"
+    )
+    parser.add_argument(
+        "--rate",
+        type=float,
+        default=200.0,
+        help="Total messages sent per second across every bot",
+    )
+    parser.add_argument(
+        "--duration", type=float, default=10.0, help="Seconds to send messages for"
+    )
+    parser.add_argument(
+        "--message-size",
+        type=int,
+        default=64,
+        help="Number of padding characters in each message",
+    )
+    parser.add_argument(
+        "--history",
+        type=int,
+        default=1000,
+        help="Number of messages in the history before the bots join",
+    )
+    parser.add_argument(
+        "--compression",
+        action="store_true",
+        help="Have the bots accept compression from the server",
+    )
+    parser.add_argument(
+        "--output",
+        type=str,
+        default=None,
+        help="File the JSON results are written to, printed if unset",
+    )
+    arguments: Namespace = parser.parse_args()
+    if arguments.clients < 1:
+        parser.error("--clients must be at least 1")
+    if arguments.rate <= 0:
+        parser.error("--rate must be greater than 0")
+    if arguments.duration <= 0:
+        parser.error("--duration must be greater than 0")
+    return arguments
+
+
+def main() -> None:
+    """Runs the benchmark with the configured arguments and reports the results as JSON."""
+    _setup_logging()
+
+    arguments: Namespace = _parse_arguments()
+    results: dict = run_benchmark(arguments)
+    report(results, arguments.output)
+
+
+if __name__ == "__main__":
+    main()
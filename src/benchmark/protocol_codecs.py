@@ -0,0 +1,456 @@
+"""Micro-benchmarks the Tumult protocol's header codecs, message framing and request parsing."""
+
+import argparse
+import gc
+import itertools
+import json
+import logging
+import math
+import random
+import socket
+import sys
+import time
+import tracemalloc
+from argparse import Namespace, ArgumentParser
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Optional, Any, Callable, Iterator
+
+from src.benchmark.results import environment, report
+from src.shared.logging import DATETIME_FORMAT, LOG_FORMAT
+from src.shared.protocol import (
+    TumultHeader,
+    TumultFrame,
+    TumultSocket,
+    TumultWriter,
+    RequestType,
+    ENCODING_FORMAT,
+    PROTOCOL_VERSION,
+    LEGACY_PROTOCOL_VERSION,
+)
+
+VERSIONS: tuple[str, ...] = (LEGACY_PROTOCOL_VERSION, PROTOCOL_VERSION)
+SAMPLE_SIZE: int = 1024
+# Median and spread of the lognormal chat message lengths, in characters
+MEDIAN_MESSAGE_LENGTH: int = 40
+MESSAGE_LENGTH_SIGMA: float = 1.0
+MAX_MESSAGE_LENGTH: int = 2000
+NON_ASCII_SHARE: float = 0.05
+NON_ASCII_WORDS: tuple[str, ...] = ("café", "naïve", "日本語", "🙂", "привет")
+WORDS: tuple[str, ...] = tuple(
+    "the a to and you is it that lol ok server message tonight anyone here what "
+    "about thanks link".split()
+)
+# Socket reads are measured in bursts that fit in the socketpair's buffer
+READ_BURST_SIZE: int = 32 * 1024
+ALLOCATION_SAMPLES: int = 200
+# Peak allocation growth below this many bytes is noise rather than a regression
+ALLOCATION_SLACK: int = 64
+# JSON headers spell out the current timestamp, whose length varies between runs
+FRAME_SIZE_SLACK: float = 1.0
+
+
+@dataclass
+class Sample:
+    """Realistic chat traffic, with the nickname and text of each message."""
+
+    nicknames: list[str]
+    messages: list[str]
+
+    @classmethod
+    def generate(cls, seed: int, size: int = SAMPLE_SIZE) -> "Sample":
+        """
+        Generates messages with lognormal lengths, mostly short with a long tail,
+        a few of them containing non-ASCII characters.
+        """
+        generator: random.Random = random.Random(seed)
+        nicknames: list[str] = []
+        messages: list[str] = []
+        for _ in range(size):
+            nicknames.append(f"User{generator.randrange(10_000)}")
+            length: int = min(
+                max(
+                    int(
+                        generator.lognormvariate(
+                            math.log(MEDIAN_MESSAGE_LENGTH), MESSAGE_LENGTH_SIGMA
+                        )
+                    ),
+                    1,
+                ),
+                MAX_MESSAGE_LENGTH,
+            )
+            vocabulary: tuple[str, ...] = (
+                WORDS + NON_ASCII_WORDS
+                if generator.random() < NON_ASCII_SHARE
+                else WORDS
+            )
+            words: list[str] = []
+            while sum(len(word) + 1 for word in words) < length:
+                words.append(generator.choice(vocabulary))
+            messages.append(" ".join(words)[:length])
+        return cls(nicknames, messages)
+
+
+class DiscardWriter(TumultWriter):
+    """In-memory connection that only counts the bytes of the frames written to it."""
+
+    def __init__(self, version: str) -> None:
+        self.protocol_version = version
+        self.frame_count: int = 0
+        self.byte_count: int = 0
+
+    def write_frame(self, frame: TumultFrame) -> None:
+        """Counts the frame's bytes and discards it."""
+        self.frame_count += 1
+        self.byte_count += len(frame)
+
+    def close(self) -> None:
+        """Does nothing, as there is no connection."""
+
+    def abort(self) -> None:
+        """Does nothing, as there is no connection."""
+
+
+@dataclass
+class Benchmark:
+    """
+    Named primitive measured by running a number of operations, which returns the
+    nanoseconds those operations took, and the average frame size it works on.
+    """
+
+    name: str
+    run: Callable[[int], int]
+    bytes_per_frame: float
+
+
+def _sample_indexes() -> Iterator[int]:
+    """Returns an endless cycle over the sample's indexes, resumed by every run."""
+    return itertools.cycle(range(SAMPLE_SIZE))
+
+
+def _timed_loop(operation: Callable[[int], Any]) -> Callable[[int], int]:
+    """Returns a runner timing the operation over the next sample indexes."""
+    indexes: Iterator[int] = _sample_indexes()
+
+    def run(operations: int) -> int:
+        start_time: int = time.perf_counter_ns()
+        for index in itertools.islice(indexes, operations):
+            operation(index)
+        return time.perf_counter_ns() - start_time
+
+    return run
+
+
+def _header_benchmarks(sample: Sample, version: str) -> list[Benchmark]:
+    """Returns the benchmarks encoding and decoding the headers of the sample messages."""
+    headers: list[TumultHeader] = [
+        TumultHeader(
+            RequestType.MESSAGE,
+            nickname=nickname,
+            content_length=len(message.encode(ENCODING_FORMAT)),
+        )
+        for nickname, message in zip(sample.nicknames, sample.messages)
+    ]
+    encoded_headers: list[bytes] = [header.encode(version) for header in headers]
+    decode: Callable[[bytes], TumultHeader] = (
+        TumultHeader.from_bytes
+        if version == LEGACY_PROTOCOL_VERSION
+        else TumultHeader.from_binary
+    )
+    header_size: float = sum(map(len, encoded_headers)) / SAMPLE_SIZE
+    return [
+        Benchmark(
+            f"header_encode[{version}]",
+            _timed_loop(lambda index: headers[index].encode(version)),
+            header_size,
+        ),
+        Benchmark(
+            f"header_decode[{version}]",
+            _timed_loop(lambda index: decode(encoded_headers[index])),
+            header_size,
+        ),
+    ]
+
+
+def _write_message_benchmark(sample: Sample, version: str) -> Benchmark:
+    """Returns the benchmark framing the sample messages for an in-memory connection."""
+    writer: DiscardWriter = DiscardWriter(version)
+    for nickname, message in zip(sample.nicknames, sample.messages):
+        writer.write_message(nickname, message)
+    return Benchmark(
+        f"write_message[{version}]",
+        _timed_loop(
+            lambda index: writer.write_message(
+                sample.nicknames[index], sample.messages[index]
+            )
+        ),
+        writer.byte_count / writer.frame_count,
+    )
+
+
+def _socket_benchmarks(
+    sample: Sample, version: str, sockets: list[socket.socket]
+) -> list[Benchmark]:
+    """
+    Returns the benchmarks parsing the sample messages from a socketpair, with the
+    sends left out of the timing, and writing then reading them back one at a time.
+    """
+    writing_socket, reading_socket = socket.socketpair()
+    sockets.extend((writing_socket, reading_socket))
+    writer: TumultSocket = TumultSocket(writing_socket)
+    writer.protocol_version = version
+    reader: TumultSocket = TumultSocket(reading_socket)
+    encoded_frames: list[bytes] = []
+    for nickname, message in zip(sample.nicknames, sample.messages):
+        frame: TumultFrame = TumultFrame.message(nickname, message, version)
+        encoded_frames.append(bytes(frame.header) + bytes(frame.contents))
+    frame_size: float = sum(map(len, encoded_frames)) / SAMPLE_SIZE
+    indexes: Iterator[int] = _sample_indexes()
+
+    def read_requests(operations: int) -> int:
+        elapsed_time: int = 0
+        remaining_operations: int = operations
+        while remaining_operations:
+            burst: list[bytes] = []
+            burst_size: int = 0
+            while len(burst) < remaining_operations and burst_size < READ_BURST_SIZE:
+                burst.append(encoded_frames[next(indexes)])
+                burst_size += len(burst[-1])
+            writing_socket.sendall(b"".join(burst))
+            start_time: int = time.perf_counter_ns()
+            for _ in burst:
+                reader.read_request()
+            elapsed_time += time.perf_counter_ns() - start_time
+            remaining_operations -= len(burst)
+        return elapsed_time
+
+    def round_trip(index: int) -> None:
+        writer.write_message(sample.nicknames[index], sample.messages[index])
+        reader.read_request()
+
+    return [
+        Benchmark(f"read_request[{version}]", read_requests, frame_size),
+        Benchmark(f"round_trip[{version}]", _timed_loop(round_trip), frame_size),
+    ]
+
+
+def _calibrate(benchmark: Benchmark, minimum_time: float) -> int:
+    """Returns the number of operations that takes at least the minimum time."""
+    operations: int = 1
+    while True:
+        if benchmark.run(operations) >= minimum_time * 1e9:
+            return operations
+        operations *= 4
+
+
+def _allocated_bytes_per_op(benchmark: Benchmark) -> float:
+    """
+    Returns the average peak memory allocated while running one operation, as traced
+    by tracemalloc, since CPython does not count individual allocations.
+    """
+    tracemalloc.start()
+    try:
+        allocated_bytes: int = 0
+        for _ in range(ALLOCATION_SAMPLES):
+            current_bytes: int = tracemalloc.get_traced_memory()[0]
+            tracemalloc.reset_peak()
+            benchmark.run(1)
+            allocated_bytes += tracemalloc.get_traced_memory()[1] - current_bytes
+    finally:
+        tracemalloc.stop()
+    return allocated_bytes / ALLOCATION_SAMPLES
+
+
+def measure(benchmark: Benchmark, repeats: int, minimum_time: float) -> dict[str, Any]:
+    """
+    Runs a benchmark with the garbage collector paused and returns the median and
+    fastest nanoseconds per operation, the bytes allocated per operation and the
+    bytes per frame.
+    """
+    operations: int = _calibrate(benchmark, minimum_time)
+    gc_was_enabled: bool = gc.isenabled()
+    gc.disable()
+    try:
+        timings: list[float] = sorted(
+            benchmark.run(operations) / operations for _ in range(repeats)
+        )
+    finally:
+        if gc_was_enabled:
+            gc.enable()
+    logging.info("%s: %.0f ns/op", benchmark.name, timings[len(timings) // 2])
+    return {
+        "ns_per_op": timings[len(timings) // 2],
+        "min_ns_per_op": timings[0],
+        "allocated_bytes_per_op": _allocated_bytes_per_op(benchmark),
+        "bytes_per_frame": benchmark.bytes_per_frame,
+        "operations": operations,
+    }
+
+
+def run_benchmark(arguments: Namespace) -> dict[str, Any]:
+    """Runs every benchmark matching the filter for both protocol versions."""
+    sample: Sample = Sample.generate(arguments.seed)
+    sockets: list[socket.socket] = []
+    try:
+        benchmarks: list[Benchmark] = []
+        for version in VERSIONS:
+            benchmarks.extend(_header_benchmarks(sample, version))
+            benchmarks.append(_write_message_benchmark(sample, version))
+            benchmarks.extend(_socket_benchmarks(sample, version, sockets))
+        results: dict[str, Any] = {
+            benchmark.name: measure(
+                benchmark, arguments.repeats, arguments.minimum_time
+            )
+            for benchmark in benchmarks
+            if arguments.filter is None or arguments.filter in benchmark.name
+        }
+    finally:
+        for open_socket in sockets:
+            open_socket.close()
+    return {
+        "config": vars(arguments),
+        "environment": environment(),
+        "benchmarks": results,
+    }
+
+
+def find_regressions(
+    results: dict[str, Any],
+    baseline: dict[str, Any],
+    tolerance: float,
+    check_time: bool = True,
+) -> list[str]:
+    """
+    Returns a description of each benchmark whose fastest run got slower or that
+    allocates more than the tolerance allows, or that frames messages into more bytes
+    than the baseline. Timings are skipped without check_time, as they only compare
+    between runs on the same machine.
+    """
+    regressions: list[str] = []
+    for name, result in results["benchmarks"].items():
+        baseline_result: Optional[dict[str, Any]] = baseline["benchmarks"].get(name)
+        if baseline_result is None:
+            continue
+        # The fastest run is the least disturbed by the rest of the machine
+        slowest: float = baseline_result["min_ns_per_op"] * (1 + tolerance)
+        if check_time and result["min_ns_per_op"] > slowest:
+            regressions.append(
+                f"{name} takes {result['min_ns_per_op']:.0f} ns/op at best, "
+                f"up from {baseline_result['min_ns_per_op']:.0f} ns/op"
+            )
+        if result["allocated_bytes_per_op"] > (
+            baseline_result["allocated_bytes_per_op"] * (1 + tolerance)
+            + ALLOCATION_SLACK
+        ):
+            regressions.append(
+                f"{name} allocates {result['allocated_bytes_per_op']:.0f} bytes/op, "
+                f"up from {baseline_result['allocated_bytes_per_op']:.0f} bytes/op"
+            )
+        if result["bytes_per_frame"] > (
+            baseline_result["bytes_per_frame"] + FRAME_SIZE_SLACK
+        ):
+            regressions.append(
+                f"{name} frames {result['bytes_per_frame']:.1f} bytes/frame, "
+                f"up from {baseline_result['bytes_per_frame']:.1f} bytes/frame"
+            )
+    return regressions
+
+
+def _setup_logging() -> None:
+    """Configures the logging with the formats from the Tumult logging module."""
+    logging.basicConfig(
+        level=logging.INFO,
+        format=LOG_FORMAT,
+        datefmt=DATETIME_FORMAT,
+    )
+
+
+def _parse_arguments() -> Namespace:
+    """Parses the command line arguments for the measurements and the baseline."""
+    parser: ArgumentParser = argparse.ArgumentParser(
+        description="Tumult Protocol Codec Benchmark"
+    )
+    parser.add_argument(
+        "--repeats",
+        type=int,
+        default=5,
+        help="Number of timed runs of each benchmark, the median is reported",
+    )
+    parser.add_argument(
+        "--minimum-time",
+        type=float,
+        default=0.2,
+        help="Minimum seconds each timed run lasts",
+    )
+    parser.add_argument(
+        "--seed",
+        type=int,
+        default=0,
+        help="Seed of the generated messages, kept equal to compare runs",
+    )
+    parser.add_argument(
+        "--filter",
+        type=str,
+        default=None,
+        help="Only run the benchmarks whose name contains this text",
+    )
+    parser.add_argument(
+        "--baseline",
+        type=str,
+        default=None,
+        help="Results of an earlier run to fail on regressions against",
+    )
+    parser.add_argument(
+        "--tolerance",
+        type=float,
+        default=0.3,
+        help="Fraction a benchmark can get slower or allocate more than the baseline",
+    )
+    parser.add_argument(
+        "--no-time-check",
+        dest="time_check",
+        action="store_false",
+        help="Only fail on allocations and frame sizes, for baselines from elsewhere",
+    )
+    parser.add_argument(
+        "--output",
+        type=str,
+        default=None,
+        help="File the JSON results are written to, printed if unset",
+    )
+    arguments: Namespace = parser.parse_args()
+    if arguments.repeats < 1:
+        parser.error("--repeats must be at least 1")
+    if arguments.minimum_time <= 0:
+        parser.error("--minimum-time must be greater than 0")
+    if arguments.tolerance < 0:
+        parser.error("--tolerance must be at least 0")
+    return arguments
+
+
+def main() -> None:
+    """
+    Runs the benchmarks with the configured arguments, reports the results as JSON
+    and exits with an error if any regressed past the baseline.
+    """
+    _setup_logging()
+
+    arguments: Namespace = _parse_arguments()
+    results: dict[str, Any] = run_benchmark(arguments)
+    report(results, arguments.output)
+    if arguments.baseline is None:
+        return
+
+    baseline: dict[str, Any] = json.loads(Path(arguments.baseline).read_text())
+    regressions: list[str] = find_regressions(
+        results, baseline, arguments.tolerance, arguments.time_check
+    )
+    for regression in regressions:
+        logging.error("Regression: %s", regression)
+    if regressions:
+        sys.exit(1)
+    logging.info("No regressions against %s", arguments.baseline)
+
+
+if __name__ == "__main__":
+    main()
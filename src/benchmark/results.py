@@ -0,0 +1,49 @@
+"""Provides the summary statistics and JSON reporting shared by the Tumult benchmarks."""
+
+import json
+import logging
+import os
+import platform
+from pathlib import Path
+from typing import Optional, Any
+
+PERCENTILES: dict[str, float] = {"p50": 50.0, "p99": 99.0, "p999": 99.9}
+
+
+def percentile(sorted_values: list[float], percentile_rank: float) -> Optional[float]:
+    """Returns the nearest-rank percentile of already sorted values."""
+    if not sorted_values:
+        return None
+    rank: int = max(int(len(sorted_values) * percentile_rank / 100.0 + 0.5) - 1, 0)
+    return sorted_values[min(rank, len(sorted_values) - 1)]
+
+
+def summarize(values: list[float]) -> dict[str, Optional[float]]:
+    """Returns the percentiles, mean and maximum of durations in milliseconds."""
+    sorted_values: list[float] = sorted(value * 1000.0 for value in values)
+    summary: dict[str, Optional[float]] = {
+        name: percentile(sorted_values, percentile_rank)
+        for name, percentile_rank in PERCENTILES.items()
+    }
+    summary["mean"] = sum(sorted_values) / len(sorted_values) if values else None
+    summary["max"] = sorted_values[-1] if values else None
+    return summary
+
+
+def environment() -> dict[str, Any]:
+    """Returns the interpreter and machine the benchmark ran on."""
+    return {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+    }
+
+
+def report(results: dict[str, Any], output: Optional[str]) -> None:
+    """Writes the results as JSON to the output file, or prints them if there is none."""
+    report_json: str = json.dumps(results, indent=2)
+    if output is None:
+        print(report_json)
+    else:
+        Path(output).write_text(report_json + "\n")
+        logging.info("Wrote results to %s", output)
@@ -0,0 +1,134 @@
+"""Provides the Qt-free asyncio client core for Tumult."""
+
+import asyncio
+import logging
+import zlib
+from typing import Optional, AsyncIterator, Callable, BinaryIO
+
+from src.client.client_core import BaseClientCore, ChatEvent, reconnect_delays
+from src.shared.protocol import (
+    FrameBuffer,
+    TumultFrame,
+    TumultWriter,
+    RECEIVE_BUFFER_SIZE,
+    DEFAULT_CHUNK_SIZE,
+)
+
+
+class TumultStreamWriter(TumultWriter):
+    """Writer implementing the Tumult protocol over an asyncio stream."""
+
+    def __init__(self, stream_writer: asyncio.StreamWriter) -> None:
+        self.stream_writer: asyncio.StreamWriter = stream_writer
+
+    def write_frame(self, frame: TumultFrame) -> None:
+        """Queues the frame's buffers on the stream without blocking."""
+        self.stream_writer.writelines((frame.header, frame.contents))
+
+    def close(self) -> None:
+        """Closes the stream once its buffered frames are flushed."""
+        self.stream_writer.close()
+
+    def abort(self) -> None:
+        """Closes the stream immediately, discarding its buffered frames."""
+        self.stream_writer.transport.abort()
+
+
+class AsyncClientCore(BaseClientCore):
+    """Asyncio client core reading server requests on an event loop."""
+
+    def __init__(
+        self, nickname: Optional[str] = None, compression: bool = True
+    ) -> None:
+        super().__init__(nickname, compression)
+        self.reader: Optional[asyncio.StreamReader] = None
+        self.stream_writer: Optional[TumultStreamWriter] = None
+        self.frame_buffer: FrameBuffer = FrameBuffer()
+
+    @property
+    def writer(self) -> TumultWriter:
+        """Returns the stream of the current server connection."""
+        return self.stream_writer
+
+    async def connect(self, ipv4_address: str, port: int) -> None:
+        """Connects to the server at the provided address."""
+        self.reader, stream_writer = await asyncio.open_connection(ipv4_address, port)
+        self.stream_writer = TumultStreamWriter(stream_writer)
+        self.frame_buffer = FrameBuffer()
+        self.decompressor = zlib.decompressobj()
+        self.incoming_transfers.clear()
+
+    async def reconnect(
+        self, ipv4_address: str, port: int, attempts: Optional[int] = None
+    ) -> bool:
+        """
+        Reconnects to the server after the connection was lost, waiting a jittered,
+        exponentially growing delay before each attempt. The handshake then resumes the
+        server's history and every joined room's after the last message received.
+        Returns whether it reconnected before running out of attempts.
+        """
+        for attempt, delay in enumerate(reconnect_delays()):
+            if attempts is not None and attempt >= attempts:
+                return False
+            await asyncio.sleep(delay)
+            try:
+                await self.connect(ipv4_address, port)
+            except OSError as error:
+                logging.info(
+                    "Reconnecting to server %s:%i failed: %s", ipv4_address, port, error
+                )
+                continue
+            logging.info("Reconnected to server %s:%i", ipv4_address, port)
+            return True
+        return False
+
+    async def events(self) -> AsyncIterator[ChatEvent]:
+        """Yields chat events from the server until the connection closes."""
+        while data := await self.reader.read(RECEIVE_BUFFER_SIZE):
+            self.frame_buffer.feed(data)
+            for request in self.frame_buffer.requests():
+                for event in self._handle_request(request):
+                    yield event
+
+    async def run(self, callback: Callable[[ChatEvent], None]) -> None:
+        """Calls the callback with each chat event until the connection closes."""
+        async for event in self.events():
+            callback(event)
+
+    async def send_transfer(
+        self,
+        stream: BinaryIO,
+        name: str,
+        size: Optional[int] = None,
+        room: Optional[str] = None,
+        chunk_size: int = DEFAULT_CHUNK_SIZE,
+    ) -> int:
+        """
+        Sends the contents of a binary stream to the other clients, or to a joined room,
+        one chunk at a time, waiting for each chunk to be handed to the operating system
+        before reading the next. Returns the transfer's id.
+        """
+        transfer_id: int = self._start_transfer(name, size, room)
+        offset: int = 0
+        try:
+            while chunk := stream.read(chunk_size):
+                self.writer.write_transfer_chunk(transfer_id, offset, chunk)
+                offset += len(chunk)
+                await self.drain()
+        except OSError:
+            self.writer.write_transfer_end(self.nickname, transfer_id, aborted=True)
+            raise
+        self.writer.write_transfer_end(self.nickname, transfer_id)
+        return transfer_id
+
+    async def drain(self) -> None:
+        """Waits until the written requests have been handed to the operating system."""
+        await self.stream_writer.stream_writer.drain()
+
+    async def close(self) -> None:
+        """Closes the connection once the written requests are flushed."""
+        self.stream_writer.close()
+        try:
+            await self.stream_writer.stream_writer.wait_closed()
+        except ConnectionError:
+            pass
@@ -0,0 +1,454 @@
+"""Provides the Qt-free blocking client core for Tumult."""
+
+import ipaddress
+import itertools
+import logging
+import random
+import threading
+import zlib
+from abc import ABC, abstractmethod
+from dataclasses import dataclass, field
+from typing import Optional, Any, Iterator, Callable, BinaryIO
+
+from src.shared.protocol import (
+    TumultSocket,
+    TumultWriter,
+    RequestType,
+    ENCODING_FORMAT,
+    COMPRESSION_DEFLATE,
+    HEARTBEAT_OPTION,
+    RESUME_OPTION,
+    EPOCH_OPTION,
+    DEFAULT_CHUNK_SIZE,
+    batch_requests,
+    decode_json_body,
+    encode_json_body,
+    transfer_chunk,
+    decompress_requests,
+    negotiate_version,
+)
+
+DEFAULT_SEARCH_LIMIT: int = 20
+RECONNECT_DELAY: float = 0.5
+MAX_RECONNECT_DELAY: float = 30.0
+SEQUENCED_EVENT_TYPES: frozenset[RequestType] = frozenset(
+    (RequestType.MESSAGE, RequestType.JOIN_MESSAGE, RequestType.LEAVE_MESSAGE)
+)
+
+
+def reconnect_delays(
+    initial: float = RECONNECT_DELAY, maximum: float = MAX_RECONNECT_DELAY
+) -> Iterator[float]:
+    """
+    Yields the delays before each reconnection attempt, drawn at random up to a cap
+    that doubles after every attempt, so clients dropped together do not all
+    reconnect at the same moment.
+    """
+    for attempt in itertools.count():
+        yield random.uniform(0, min(initial * 2**attempt, maximum))
+
+
+@dataclass
+class ServerInfo:
+    """Container for server connection information."""
+
+    ipv4_address: Optional[str] = None
+    port: Optional[int] = None
+    socket: TumultSocket = field(default_factory=TumultSocket)
+
+    def __str__(self) -> str:
+        """Returns a string representation of the socket address in address:port format."""
+        return f"{self.ipv4_address}:{self.port}"
+
+    @property
+    def socket_address(self) -> tuple[Optional[str], Optional[int]]:
+        """Returns the socket address as a tuple."""
+        return self.ipv4_address, self.port
+
+    @socket_address.setter
+    def socket_address(self, socket_address: tuple[str, int]) -> None:
+        """Sets the socket address with a tuple containing the IPv4 address and port."""
+        self.ipv4_address, self.port = socket_address
+
+    @property
+    def address_scope(self) -> str:
+        """Returns the server's IPv4 address scope."""
+        if self.ipv4_address is None:
+            return "unknown"
+        try:
+            if ipaddress.IPv4Address(self.ipv4_address).is_loopback:
+                return "loopback"
+            if ipaddress.IPv4Address(self.ipv4_address).is_private:
+                return "private"
+            if ipaddress.IPv4Address(self.ipv4_address).is_global:
+                return "public"
+            return "reserved"
+        except ValueError:
+            return "unknown"
+
+    def connect(self) -> None:
+        """Initiates a connection using the current socket and socket_address."""
+        self.socket.connect(self.socket_address)
+
+
+@dataclass
+class ChatEvent:
+    """
+    Container for a message, join, leave, history page, search results or part of a
+    transfer received from the server, with the room it belongs to, or None if it
+    belongs to the whole server. Transfer events carry the transfer's id, and chunks
+    carry their bytes. A transfer that lost a chunk on the way ends as aborted, and
+one the server refused ends for its sender under the id the sender chose. A room
+the server refused to let the client join is announced by a LEAVE_ROOM event.
+    Messages, joins and leaves carry their sequence number in the history they
+    belong to.
+    """
+
+    event_type: RequestType
+    nickname: Optional[str]
+    contents: str
+    timestamp: float
+    room: Optional[str] = None
+    transfer_id: Optional[int] = None
+    data: bytes | memoryview = b""
+    sequence: Optional[int] = None
+
+
+class BaseClientCore(ABC):
+    """Connection-independent client logic shared by the blocking and asyncio cores."""
+
+    def __init__(
+        self, nickname: Optional[str] = None, compression: bool = True
+    ) -> None:
+        self.nickname: Optional[str] = nickname
+        self.compression: bool = compression
+        self.decompressor: Any = zlib.decompressobj()
+        self.transfer_ids: Iterator[int] = itertools.count(1)
+        # Transfers being received by id, with the offset their next chunk must start at
+        self.incoming_transfers: dict[int, int] = {}
+        # Joined rooms and the last sequence number received from each history,
+        # kept across reconnections to resume from instead of replaying a page,
+        # with the epoch of each history that the sequence numbers belong to
+        self.rooms: set[str] = set()
+        self.sequences: dict[Optional[str], int] = {}
+        self.epochs: dict[Optional[str], int] = {}
+
+    @property
+    @abstractmethod
+    def writer(self) -> TumultWriter:
+        """Returns the writer of the current server connection."""
+
+    def send_nickname(self) -> None:
+        """
+        Sends the client's nickname to the server, offering to answer its pings
+        and to accept compression, and asking for the messages missed since the last
+        one received if reconnecting.
+        """
+        options: dict[str, Any] = {HEARTBEAT_OPTION: True}
+        if self.compression:
+            options["compression"] = [COMPRESSION_DEFLATE]
+        if None in self.sequences:
+            options[RESUME_OPTION] = self.sequences[None]
+            options[EPOCH_OPTION] = self.epochs.get(None)
+        self.writer.write_nickname(self.nickname, options)
+
+    def send_message(self, message: str, room: Optional[str] = None) -> None:
+        """Sends a chat message with the client's nickname to the server or a joined room."""
+        self.writer.write_message(self.nickname, message, room)
+
+    def request_history(
+        self, before: Optional[int], limit: int, room: Optional[str] = None
+    ) -> None:
+        """
+        Requests a page of at most limit messages before an index in the history
+        of the server or a joined room.
+        """
+        self.writer.write_history_request(before, limit, room)
+
+    def search(
+        self,
+        query: str,
+        limit: int = DEFAULT_SEARCH_LIMIT,
+        before: Optional[int] = None,
+        room: Optional[str] = None,
+    ) -> None:
+        """
+        Searches the history of the server or a joined room for at most limit messages
+        before an index that contain every word of the query, answered newest first.
+        """
+        self.writer.write_search_request(query, limit, before, room)
+
+    def join_room(self, room: str, history_limit: Optional[int] = None) -> None:
+        """
+        Joins a room, which answers with a page of its recent history, or with the
+        messages missed since the last one received when rejoining after a reconnect.
+        """
+        self.rooms.add(room)
+        self.writer.write_join_room(
+            room, history_limit, self.sequences.get(room), self.epochs.get(room)
+        )
+
+    def leave_room(self, room: str) -> None:
+        """Leaves a joined room."""
+        self.rooms.discard(room)
+        self.sequences.pop(room, None)
+        self.epochs.pop(room, None)
+        self.writer.write_leave_room(room)
+
+    def _start_transfer(
+        self, name: str, size: Optional[int] = None, room: Optional[str] = None
+    ) -> int:
+        """Announces a transfer of a named payload and returns its id."""
+        transfer_id: int = next(self.transfer_ids)
+        self.writer.write_transfer_start(self.nickname, transfer_id, name, size, room)
+        return transfer_id
+
+    def _track_epoch(self, request: TumultSocket.Request, room: Optional[str]) -> None:
+        """
+        Records the epoch of the history a page announcement belongs to, forgetting
+        the last sequence number received if it came from another epoch.
+        """
+        epoch: Any = decode_json_body(request.contents).get(EPOCH_OPTION)
+        if isinstance(epoch, int) and epoch != self.epochs.get(room):
+            self.sequences.pop(room, None)
+            self.epochs[room] = epoch
+
+    def _handle_request(
+        self, request: TumultSocket.Request, room: Optional[str] = None
+    ) -> Iterator[ChatEvent]:
+        """
+        Answers the handshake and yields the chat events carried by a server request,
+        which belong to the provided room if the request was carried by a room request.
+        """
+        match request.header.request_type:
+
+            case RequestType.NICKNAME:
+                # Sequence numbers of another history epoch cannot be resumed from
+                epoch: Any = decode_json_body(request.contents).get(EPOCH_OPTION)
+                if epoch != self.epochs.get(None):
+                    self.sequences.pop(None, None)
+                    self.epochs.pop(None, None)
+                self.send_nickname()
+                logging.info("Server asked for nickname, provided %s", self.nickname)
+                self.writer.protocol_version = negotiate_version(request.header.version)
+                for joined_room in sorted(self.rooms):
+                    self.join_room(joined_room)
+
+            case RequestType.PING:
+                self.writer.write_pong()
+
+            case (
+                RequestType.MESSAGE
+                | RequestType.JOIN_MESSAGE
+                | RequestType.LEAVE_MESSAGE
+                | RequestType.HISTORY
+                | RequestType.SEARCH
+            ):
+                if request.header.request_type == RequestType.HISTORY:
+                    self._track_epoch(request, room)
+                sequence: Optional[int] = request.header.sequence
+                if (
+                    sequence is not None
+                    and request.header.request_type in SEQUENCED_EVENT_TYPES
+                    and sequence > self.sequences.get(room, -1)
+                ):
+                    self.sequences[room] = sequence
+                yield ChatEvent(
+                    request.header.request_type,
+                    request.header.nickname,
+                    request.contents.decode(ENCODING_FORMAT),
+                    request.header.timestamp,
+                    room,
+                    sequence=sequence,
+                )
+
+            case RequestType.TRANSFER_START | RequestType.TRANSFER_END:
+                contents: str = request.contents.decode(ENCODING_FORMAT)
+                fields: dict[str, Any] = decode_json_body(request.contents)
+                transfer_id: Any = fields.get("transfer")
+                if not isinstance(transfer_id, int):
+                    return
+                if request.header.request_type == RequestType.TRANSFER_START:
+                    self.incoming_transfers[transfer_id] = 0
+                # A refusal ends one of the client's own transfers, by the id it chose
+                elif "refused" not in fields and (
+                    self.incoming_transfers.pop(transfer_id, None) is None
+                ):
+                    return
+                yield ChatEvent(
+                    request.header.request_type,
+                    request.header.nickname,
+                    contents,
+                    request.header.timestamp,
+                    room,
+                    transfer_id,
+                )
+
+            case RequestType.TRANSFER_CHUNK:
+                transfer_id, offset, data = transfer_chunk(request.contents)
+                expected_offset: Optional[int] = self.incoming_transfers.get(
+                    transfer_id
+                )
+                if expected_offset is None:
+                    return
+                if offset != expected_offset:
+                    # A chunk was dropped on the way, so the payload cannot be assembled
+                    logging.info(
+                        "Transfer %i lost the bytes from offset %i to %i",
+                        transfer_id,
+                        expected_offset,
+                        offset,
+                    )
+                    del self.incoming_transfers[transfer_id]
+                    yield ChatEvent(
+                        RequestType.TRANSFER_END,
+                        request.header.nickname,
+                        encode_json_body(
+                            {"transfer": transfer_id, "aborted": True}
+                        ).decode(ENCODING_FORMAT),
+                        request.header.timestamp,
+                        room,
+                        transfer_id,
+                    )
+                    return
+                self.incoming_transfers[transfer_id] = offset + len(data)
+                yield ChatEvent(
+                    request.header.request_type,
+                    request.header.nickname,
+                    "",
+                    request.header.timestamp,
+                    room,
+                    transfer_id,
+                    data,
+                )
+
+            case RequestType.BATCH:
+                for batched_request in batch_requests(request.contents):
+                    yield from self._handle_request(batched_request, room)
+
+            case RequestType.COMPRESSED:
+                for compressed_request in decompress_requests(
+                    request.contents, self.decompressor
+                ):
+                    yield from self._handle_request(compressed_request, room)
+
+            case RequestType.LEAVE_ROOM:
+                # The server refused to let the client join a room
+                contents = request.contents.decode(ENCODING_FORMAT)
+                refused_room: Any = decode_json_body(request.contents).get("room")
+                if not isinstance(refused_room, str):
+                    return
+                self.rooms.discard(refused_room)
+                self.sequences.pop(refused_room, None)
+                self.epochs.pop(refused_room, None)
+                yield ChatEvent(
+                    request.header.request_type,
+                    None,
+                    contents,
+                    request.header.timestamp,
+                    refused_room,
+                )
+
+            case RequestType.ROOM:
+                for room_request in batch_requests(request.contents):
+                    yield from self._handle_request(
+                        room_request, request.header.nickname
+                    )
+
+
+class ClientCore(BaseClientCore):
+    """Blocking client core reading server requests on the caller's thread."""
+
+    def __init__(
+        self, nickname: Optional[str] = None, compression: bool = True
+    ) -> None:
+        super().__init__(nickname, compression)
+        self.server: ServerInfo = ServerInfo()
+
+    @property
+    def writer(self) -> TumultWriter:
+        """Returns the socket of the current server connection."""
+        return self.server.socket
+
+    def connect(self) -> None:
+        """Connects to the server at the current server socket address."""
+        self.server.connect()
+        self.decompressor = zlib.decompressobj()
+        self.incoming_transfers.clear()
+
+    def reconnect(
+        self, attempts: Optional[int] = None, stop: Optional[threading.Event] = None
+    ) -> bool:
+        """
+        Reconnects to the same server after the connection was lost, waiting a jittered,
+        exponentially growing delay before each attempt. The handshake then resumes the
+        server's history and every joined room's after the last message received.
+        Returns whether it reconnected before running out of attempts or being stopped.
+        """
+        stop = stop if stop is not None else threading.Event()
+        for attempt, delay in enumerate(reconnect_delays()):
+            if attempts is not None and attempt >= attempts:
+                return False
+            if stop.wait(delay):
+                return False
+            self.server.socket.close()
+            self.server.socket = TumultSocket()
+            try:
+                self.connect()
+            except OSError as error:
+                logging.info("Reconnecting to server %s failed: %s", self.server, error)
+                continue
+            logging.info("Reconnected to server %s", self.server)
+            return True
+        return False
+
+    def events(self) -> Iterator[ChatEvent]:
+        """Yields chat events from the server until the connection fails or closes."""
+        while True:
+            request: TumultSocket.Request = self.server.socket.read_request()
+            if not request or not request.header:
+                continue
+            yield from self._handle_request(request)
+
+    def run(self, callback: Callable[[ChatEvent], None]) -> None:
+        """Calls the callback with each chat event until the connection fails or closes."""
+        for event in self.events():
+            callback(event)
+
+    def send_transfer(
+        self,
+        stream: BinaryIO,
+        name: str,
+        size: Optional[int] = None,
+        room: Optional[str] = None,
+        chunk_size: int = DEFAULT_CHUNK_SIZE,
+    ) -> int:
+        """
+        Sends the contents of a binary stream to the other clients, or to a joined room,
+        reading and sending one chunk at a time into the same buffer. Returns the
+        transfer's id.
+        """
+        transfer_id: int = self._start_transfer(name, size, room)
+        buffer: memoryview = memoryview(bytearray(chunk_size))
+        offset: int = 0
+        try:
+            while read_size := stream.readinto(buffer):
+                self.writer.write_transfer_chunk(
+                    transfer_id, offset, buffer[:read_size]
+                )
+                offset += read_size
+        except OSError:
+            self.writer.write_transfer_end(self.nickname, transfer_id, aborted=True)
+            raise
+        self.writer.write_transfer_end(self.nickname, transfer_id)
+        return transfer_id
+
+    def close(self) -> None:
+        """Closes the connection and resets the server information."""
+        self.server.ipv4_address = None
+        self.server.port = None
+        self.rooms.clear()
+        self.sequences.clear()
+        self.epochs.clear()
+        self.server.socket.close()
+        self.server.socket = TumultSocket()
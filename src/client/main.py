@@ -1,11 +1,13 @@
 """Entry point for launching the client application"""
 
+import argparse
 import logging
 import sys
+from argparse import Namespace, ArgumentParser
 
 from PyQt6.QtWidgets import QApplication
 
-from src.client.window import ClientWindow
+from src.client.window import ClientWindow, DEFAULT_SCROLLBACK, DEFAULT_RENDER_RATE
 from src.shared.logging import LOG_FORMAT, DATETIME_FORMAT
 
 
@@ -18,12 +20,36 @@ def _setup_logging() -> None:
     )
 
 
+def _parse_arguments() -> tuple[Namespace, list[str]]:
+    """Parses the chat view settings, leaving the remaining arguments for Qt."""
+    parser: ArgumentParser = argparse.ArgumentParser(description="Tumult Chat Client")
+    parser.add_argument(
+        "--scrollback",
+        type=int,
+        default=DEFAULT_SCROLLBACK,
+        help="Maximum number of lines kept in the chat view",
+    )
+    parser.add_argument(
+        "--render-rate",
+        type=int,
+        default=DEFAULT_RENDER_RATE,
+        help="Maximum number of times per second the chat view is updated",
+    )
+    arguments, qt_arguments = parser.parse_known_args()
+    if arguments.scrollback < 1:
+        parser.error("--scrollback must be at least 1")
+    if arguments.render_rate < 1:
+        parser.error("--render-rate must be at least 1")
+    return arguments, [sys.argv[0], *qt_arguments]
+
+
 def main() -> None:
     """Initializes logging and launches the PyQt window."""
     _setup_logging()
 
-    app: QApplication = QApplication(sys.argv)
-    _window: ClientWindow = ClientWindow()
+    arguments, qt_arguments = _parse_arguments()
+    app: QApplication = QApplication(qt_arguments)
+    _window: ClientWindow = ClientWindow(arguments.scrollback, arguments.render_rate)
     sys.exit(app.exec())
 
 
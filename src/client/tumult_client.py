@@ -1,79 +1,58 @@
-"""Provides the client implementation for Tumult."""
+"""Provides the Qt client implementation for Tumult."""
 
-import ipaddress
 import logging
 import threading
-from dataclasses import dataclass
+from collections import deque
 from typing import Optional
 
 from PyQt6.QtCore import pyqtSignal, QObject
 
-from src.shared.protocol import TumultSocket, RequestType, ENCODING_FORMAT
+from src.client.client_core import ClientCore, ServerInfo, ChatEvent
+from src.shared.protocol import RequestType
 
+DISPLAYED_EVENT_TYPES: frozenset[RequestType] = frozenset(
+    {RequestType.MESSAGE, RequestType.JOIN_MESSAGE, RequestType.LEAVE_MESSAGE}
+)
 
-@dataclass
-class ServerInfo:
-    """Container for server connection information."""
 
-    ipv4_address: Optional[str] = None
-    port: Optional[int] = None
-    socket: TumultSocket = TumultSocket()
-
-    def __str__(self) -> str:
-        """Returns a string representation of the socket address in address:port format."""
-        return f"{self.ipv4_address}:{self.port}"
+class TumultClient(QObject):
+    """
+    Client implementation for Tumult, adapting the client core to Qt. Received chat
+    events are buffered for the window to take in batches instead of being signalled
+    one at a time across threads.
+    """
 
-    @property
-    def socket_address(self) -> tuple[Optional[str], Optional[int]]:
-        """Returns the socket address as a tuple."""
-        return self.ipv4_address, self.port
+    disconnected = pyqtSignal()
 
-    @socket_address.setter
-    def socket_address(self, socket_address: tuple[str, int]) -> None:
-        """Sets the socket address with a tuple containing the IPv4 address and port."""
-        self.ipv4_address, self.port = socket_address
+    def __init__(self, max_pending_events: Optional[int] = None) -> None:
+        super().__init__()
+        self.core: ClientCore = ClientCore()
+        self.pending_events: deque[ChatEvent] = deque(maxlen=max_pending_events)
+        # Set when the user leaves, so a lost connection is not reconnected
+        self.leaving: threading.Event = threading.Event()
 
     @property
-    def address_scope(self) -> str:
-        """Returns the server's IPv4 address scope."""
-        if self.ipv4_address is None:
-            return "unknown"
-        try:
-            if ipaddress.IPv4Address(self.ipv4_address).is_loopback:
-                return "loopback"
-            if ipaddress.IPv4Address(self.ipv4_address).is_private:
-                return "private"
-            if ipaddress.IPv4Address(self.ipv4_address).is_global:
-                return "public"
-            return "reserved"
-        except ValueError:
-            return "unknown"
+    def nickname(self) -> Optional[str]:
+        """Returns the client's nickname."""
+        return self.core.nickname
 
-    def connect(self) -> None:
-        """Initiates a connection using the current socket and socket_address."""
-        self.socket.connect(self.socket_address)
-
-
-class TumultClient(QObject):
-    """Client implementation for Tumult."""
-
-    message_received = pyqtSignal((str, str))
-    join_message_received = pyqtSignal(str)
-    leave_message_received = pyqtSignal(str)
-    disconnected = pyqtSignal()
+    @nickname.setter
+    def nickname(self, nickname: Optional[str]) -> None:
+        """Sets the nickname sent to the server."""
+        self.core.nickname = nickname
 
-    def __init__(self) -> None:
-        super().__init__()
-        self.nickname: Optional[str] = None
-        self.server: ServerInfo = ServerInfo()
+    @property
+    def server(self) -> ServerInfo:
+        """Returns the server connection information."""
+        return self.core.server
 
     def send_nickname(self) -> None:
         """Sends the client's nickname to the server."""
-        self.server.socket.write_nickname(self.nickname)
+        self.core.send_nickname()
 
     def send_message(self, message: str) -> None:
         """Sends a chat message to the server with the client's nickname."""
-        self.server.socket.write_message(self.nickname, message)
+        self.core.send_message(message)
 
     def connect(self) -> bool:
         """Initiates the server connection and starts a request handling thread."""
@@ -83,7 +62,8 @@ class TumultClient(QObject):
                 self.server.address_scope,
                 self.server,
             )
-            self.server.connect()
+            self.leaving.clear()
+            self.core.connect()
             server_thread: threading.Thread = threading.Thread(
                 target=self._handle_server_requests
             )
@@ -103,54 +83,45 @@ class TumultClient(QObject):
         logging.error("Connection to server %s failed", self.server)
         return False
 
-    def _handle_server_requests(self) -> None:
-        """Processes incoming server requests and emits the corresponding signals."""
-        handling_server_requests: bool = True
-        while handling_server_requests:
-            try:
-                request: TumultSocket.Request = self.server.socket.read_request()
-                if not request or not request.header:
-                    continue
-
-                match request.header.request_type:
-
-                    case RequestType.NICKNAME:
-                        self.send_nickname()
-                        logging.info(
-                            "Server asked for nickname, provided %s", self.nickname
-                        )
-
-                    case RequestType.MESSAGE:
-                        nickname = request.header.nickname
-                        message = request.contents.decode(ENCODING_FORMAT)
-                        self.message_received.emit(nickname, message)
-
-                    case RequestType.JOIN_MESSAGE:
-                        nickname = request.header.nickname
-                        self.join_message_received.emit(nickname)
+    def take_pending_events(self) -> list[ChatEvent]:
+        """Removes and returns the chat events received since the last call."""
+        events: list[ChatEvent] = []
+        try:
+            while True:
+                events.append(self.pending_events.popleft())
+        except IndexError:
+            return events
 
-                    case RequestType.LEAVE_MESSAGE:
-                        nickname = request.header.nickname
-                        self.leave_message_received.emit(nickname)
+    def _buffer_event(self, event: ChatEvent) -> None:
+        """Buffers a displayed chat event, dropping the oldest if the buffer is full."""
+        if event.event_type in DISPLAYED_EVENT_TYPES:
+            self.pending_events.append(event)
 
+    def _handle_server_requests(self) -> None:
+        """
+        Processes incoming server requests and buffers the received chat events,
+        reconnecting whenever the connection is lost until the user leaves.
+        """
+        while True:
+            try:
+                self.core.run(self._buffer_event)
             except TimeoutError:
                 logging.error("Connection to server timed out")
-                handling_server_requests = False
             except ConnectionResetError:
                 logging.error("Connection was forcibly closed by the server")
-                handling_server_requests = False
             except ConnectionAbortedError:
                 logging.error("Connection to the server was aborted")
-                handling_server_requests = False
             except ConnectionError as error:
                 logging.error("Connection error occurred: %s", error)
-                handling_server_requests = False
+            except OSError as error:
+                if not self.leaving.is_set():
+                    logging.error("Connection error occurred: %s", error)
+            if self.leaving.is_set() or not self.core.reconnect(stop=self.leaving):
+                break
 
         self.disconnected.emit()
 
     def leave_server(self) -> None:
         """Disconnects from the server and resets the server information."""
-        self.server.ipv4_address = None
-        self.server.port = None
-        self.server.socket.close()
-        self.server.socket = TumultSocket()
+        self.leaving.set()
+        self.core.close()
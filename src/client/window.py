@@ -1,14 +1,14 @@
 """Provides the PyQt window for the Tumult client."""
 
+import functools
 import logging
 import os
 import sys
 from pathlib import Path
 from typing import override, Optional
 
-from PyQt6 import uic
-from PyQt6.QtCore import pyqtSlot
-from PyQt6.QtGui import QIcon, QCloseEvent
+from PyQt6.QtCore import pyqtSlot, QTimer
+from PyQt6.QtGui import QIcon, QCloseEvent, QTextCursor, QTextCharFormat
 from PyQt6.QtWidgets import (
     QMainWindow,
     QLineEdit,
@@ -19,19 +19,54 @@ from PyQt6.QtWidgets import (
     QLabel,
 )
 
+from src.client.client_core import ChatEvent
 from src.client.tumult_client import TumultClient
-from src.shared.protocol import DEFAULT_PORT, DEFAULT_IPV4_ADDRESS, TumultSocket
+from src.shared.protocol import (
+    DEFAULT_PORT,
+    DEFAULT_IPV4_ADDRESS,
+    TumultSocket,
+    RequestType,
+)
+
+try:
+    from src.client.client_window_ui import Ui_main_window
+except ImportError:
+    # The layout is parsed from the .ui file when the module has not been generated
+    Ui_main_window = None
 
 JOIN_MESSAGE: str = "has joined the server"
 LEAVE_MESSAGE: str = "has left the server"
+DEFAULT_SCROLLBACK: int = 5000
+DEFAULT_RENDER_RATE: int = 30
+SOURCE_ASSETS_DIRECTORY: Path = Path(os.path.dirname(__file__)).parent.parent.joinpath(
+    "assets"
+)
+BUNDLED_ASSETS_DIRECTORY: Path = Path(os.path.dirname(__file__)).joinpath("assets")
+UI_FILE_NAME: str = "client_window.ui"
+ICON_FILE_NAME: str = "icon.png"
+
+
+@functools.cache
+def _asset_path(file_name: str) -> Optional[Path]:
+    """Returns the path of an asset in the source tree or the bundle, probing only once."""
+    for assets_directory in (SOURCE_ASSETS_DIRECTORY, BUNDLED_ASSETS_DIRECTORY):
+        asset_path: Path = assets_directory.joinpath(file_name)
+        if asset_path.exists():
+            return asset_path
+    return None
 
 
 class ClientWindow(QMainWindow):
     """The PyQt window implementation for the Tumult client."""
 
-    def __init__(self) -> None:
+    def __init__(
+        self,
+        scrollback: int = DEFAULT_SCROLLBACK,
+        render_rate: int = DEFAULT_RENDER_RATE,
+    ) -> None:
         super().__init__()
-        self.client = TumultClient()
+        self.scrollback: int = scrollback
+        self.client = TumultClient(max_pending_events=scrollback)
 
         self._set_icon()
         self._load_ui()
@@ -52,8 +87,14 @@ class ClientWindow(QMainWindow):
         self.chat_box = self.findChild(QTextBrowser, "chat_box")
         self.server_name_label = self.findChild(QLabel, "server_name_label")
         self.central_stack.setCurrentIndex(self.connect_page_index)
+        self.chat_box.document().setMaximumBlockCount(scrollback)
+
+        # Received events are drawn in batches at most render_rate times per second
+        self.render_timer: QTimer = QTimer(self)
+        self.render_timer.setInterval(max(1000 // render_rate, 1))
 
         self._connect_callbacks()
+        self.render_timer.start()
 
         self.adjustSize()
         self.show()
@@ -65,49 +106,29 @@ class ClientWindow(QMainWindow):
         self.client.leave_server()
 
     def _load_ui(self) -> None:
-        """Loads the UI layout from the .ui file in the assets directory."""
-        source_ui_path = (
-            Path(os.path.dirname(__file__))
-            .parent.parent.joinpath("assets")
-            .joinpath("client_window.ui")
-        )
-
-        if source_ui_path.exists():
-            uic.loadUi(str(source_ui_path), self)
+        """
+        Builds the UI layout with the module pre-generated from the .ui file,
+        or parses the .ui file in the assets directory if the module is unavailable.
+        """
+        if Ui_main_window is not None:
+            Ui_main_window().setupUi(self)
             return
 
-        bundled_ui_path = (
-            Path(os.path.dirname(__file__))
-            .joinpath("assets")
-            .joinpath("client_window.ui")
-        )
+        ui_path: Optional[Path] = _asset_path(UI_FILE_NAME)
+        if ui_path is not None:
+            # Parsing .ui files is only needed without the generated module
+            from PyQt6 import uic
 
-        if bundled_ui_path.exists():
-            uic.loadUi(str(bundled_ui_path), self)
-            return
+            uic.loadUi(str(ui_path), self)
 
     def _set_icon(self) -> None:
         """Sets window icon with the icon PNG in the assets directory if the platform is Windows."""
         if not sys.platform.startswith("win"):
             return
 
-        source_icon_path = (
-            Path(os.path.dirname(__file__))
-            .parent.parent.joinpath("assets")
-            .joinpath("icon.png")
-        )
-
-        if source_icon_path.exists():
-            self.setWindowIcon(QIcon(str(source_icon_path)))
-            return
-
-        bundled_icon_path = (
-            Path(os.path.dirname(__file__)).joinpath("assets").joinpath("icon.png")
-        )
-
-        if bundled_icon_path.exists():
-            self.setWindowIcon(QIcon(str(bundled_icon_path)))
-            return
+        icon_path: Optional[Path] = _asset_path(ICON_FILE_NAME)
+        if icon_path is not None:
+            self.setWindowIcon(QIcon(str(icon_path)))
 
     def _connect_callbacks(self) -> None:
         """Connects each UI signal to its corresponding handler."""
@@ -116,9 +137,7 @@ class ClientWindow(QMainWindow):
         self.message_box_input.returnPressed.connect(self._on_send_message)
         self.leave_button.clicked.connect(self._on_leave_button_clicked)
         self.central_stack.currentChanged.connect(self.adjustSize)
-        self.client.message_received.connect(self._on_message_received)
-        self.client.join_message_received.connect(self._on_join_message_received)
-        self.client.leave_message_received.connect(self._on_leave_message_received)
+        self.render_timer.timeout.connect(self._render_pending_events)
         self.client.disconnected.connect(self._on_disconnected)
 
     def _on_connect_button_clicked(self) -> None:
@@ -169,20 +188,42 @@ class ClientWindow(QMainWindow):
             self.client.send_message(message)
         self.message_box_input.clear()
 
-    @pyqtSlot(str, str)
-    def _on_message_received(self, nickname: str, message: str) -> None:
-        """Displays the received chat message in chat box with sender's nickname."""
-        self.chat_box.append(f"<strong>{nickname}</strong> {message}")
+    @classmethod
+    def _format_event(cls, event: ChatEvent) -> str:
+        """Returns the chat box line for a message, join or leave."""
+        match event.event_type:
+            case RequestType.JOIN_MESSAGE:
+                return f"<em>{event.nickname} {JOIN_MESSAGE}</em>"
+            case RequestType.LEAVE_MESSAGE:
+                return f"<em>{event.nickname} {LEAVE_MESSAGE}</em>"
+            case _:
+                return f"<strong>{event.nickname}</strong> {event.contents}"
 
-    @pyqtSlot(str)
-    def _on_join_message_received(self, nickname: str) -> None:
-        """Displays a join message for the user who joined."""
-        self.chat_box.append(f"<em>{nickname} {JOIN_MESSAGE}</em>")
+    @pyqtSlot()
+    def _render_pending_events(self) -> None:
+        """
+        Appends every chat event received since the last frame to the chat box in one
+        edit, keeping the view at the bottom if it was already there.
+        """
+        events: list[ChatEvent] = self.client.take_pending_events()
+        if not events:
+            return
 
-    @pyqtSlot(str)
-    def _on_leave_message_received(self, nickname: str) -> None:
-        """Displays a leave message for the user who left."""
-        self.chat_box.append(f"<em>{nickname} {LEAVE_MESSAGE}</em>")
+        scroll_bar = self.chat_box.verticalScrollBar()
+        scrolled_to_bottom: bool = scroll_bar.value() == scroll_bar.maximum()
+        document = self.chat_box.document()
+        cursor: QTextCursor = QTextCursor(document)
+        cursor.movePosition(QTextCursor.MoveOperation.End)
+        cursor.beginEditBlock()
+        # Lines beyond the scrollback would be trimmed as soon as they were drawn
+        for event in events[-self.scrollback :]:
+            if not document.isEmpty():
+                cursor.insertBlock()
+                cursor.setCharFormat(QTextCharFormat())
+            cursor.insertHtml(self._format_event(event))
+        cursor.endEditBlock()
+        if scrolled_to_bottom:
+            scroll_bar.setValue(scroll_bar.maximum())
 
     @pyqtSlot()
     def _on_disconnected(self) -> None:
@@ -0,0 +1,447 @@
+"""Provides the asyncio server implementation for Tumult."""
+
+import asyncio
+import itertools
+import logging
+import socket
+import threading
+from typing import Optional, Callable, Any
+
+from src.server.client_registry import Transfer
+from src.server.hot_restart import (
+    ClientState,
+    Handoff,
+    listen_for_successor,
+    send_handoff,
+)
+from src.server.tumult_server import (
+    TumultServer,
+    ClientInfo,
+    ServerConfig,
+    MALFORMED_REQUEST_ERRORS,
+)
+from src.shared.protocol import (
+    FrameBuffer,
+    FrameTooLargeError,
+    TumultFrame,
+    TumultWriter,
+    TumultSocket,
+    RequestType,
+)
+
+HANDOFF_DRAIN_TIMEOUT: float = 5.0
+HANDOFF_DRAIN_POLL: float = 0.01
+
+
+class TumultTransport(TumultWriter):
+    """Writer implementing the Tumult protocol over an asyncio transport."""
+
+    def __init__(self, transport: asyncio.Transport) -> None:
+        self.__transport: asyncio.Transport = transport
+        self.paused: bool = False
+        self.flush_handle: Optional[asyncio.TimerHandle] = None
+
+    def write_frame(self, frame: TumultFrame) -> None:
+        """Queues the frame's buffers on the transport without blocking."""
+        self.__transport.writelines((frame.header, frame.contents))
+
+    def write_frames(self, frames: list[TumultFrame]) -> None:
+        """Queues the buffers of several frames on the transport in one call."""
+        self.__transport.writelines(
+            buffer for frame in frames for buffer in (frame.header, frame.contents)
+        )
+
+    def close(self) -> None:
+        """Closes the transport once its buffered frames are flushed."""
+        self.__transport.close()
+
+    def abort(self) -> None:
+        """Closes the transport immediately, discarding its buffered frames."""
+        self.__transport.abort()
+
+
+class TumultProtocol(asyncio.Protocol):
+    """
+    Protocol handling a single client connection for the asyncio server, either
+    a new one or one handed over by a previous server with the client's state.
+    """
+
+    def __init__(
+        self, server: "AsyncTumultServer", state: Optional[ClientState] = None
+    ) -> None:
+        self.server: AsyncTumultServer = server
+        self.state: Optional[ClientState] = state
+        self.client: Optional[ClientInfo] = None
+        self.transport: Optional[asyncio.Transport] = None
+        self.frame_buffer: FrameBuffer = FrameBuffer(server.config.max_frame_size)
+        self.waiting_for_nickname: bool = True
+        # Request held back with reading paused while its client is throttled
+        self.throttled_request: Optional[TumultSocket.Request] = None
+        # Set once the connection belongs to a successor, which keeps it open
+        self.handed_over: bool = False
+
+    def connection_made(self, transport: asyncio.BaseTransport) -> None:
+        """
+        Registers the client with the server and starts the nickname handshake,
+        or drops the connection if the server is not admitting any more.
+        A handed over client is restored instead.
+        """
+        self.server.protocols.add(self)
+        if self.state is not None:
+            self._restore(transport)
+            return
+        client_ipv4_address, client_port = transport.get_extra_info("peername")[:2]
+        if not self.server._admit_connection((client_ipv4_address, client_port)):
+            transport.abort()
+            return
+        self.transport = transport
+        self.client = ClientInfo(
+            ipv4_address=client_ipv4_address,
+            port=client_port,
+            socket=TumultTransport(transport),
+        )
+        self.server._connect_client(self.client)
+
+    def _restore(self, transport: asyncio.BaseTransport) -> None:
+        """Registers a handed over client, then handles the requests it had sent."""
+        self.transport = transport
+        self.client = ClientInfo(
+            ipv4_address=self.state.ipv4_address,
+            port=self.state.port,
+            socket=TumultTransport(transport),
+            nickname=self.state.nickname,
+            rooms=set(self.state.rooms),
+            heartbeat=self.state.heartbeat,
+            transfers={
+                sender_id: Transfer(transfer_id, room, offset)
+                for sender_id, transfer_id, room, offset in self.state.transfers
+            },
+        )
+        self.client.socket.protocol_version = self.state.protocol_version
+        self.waiting_for_nickname = self.state.waiting_for_nickname
+        self.server._restore_client(self.client)
+        self.frame_buffer.feed(self.state.pending)
+        self.state = None
+        self._handle_requests()
+
+    def hand_over_state(self) -> ClientState:
+        """
+        Returns the state a successor needs to keep serving the client, taking the
+        received bytes no request was handled from yet out of the buffer.
+        """
+        pending: bytes = b""
+        if self.throttled_request is not None:
+            request: TumultSocket.Request = self.throttled_request
+            frame: TumultFrame = TumultFrame.encode(
+                request.header.request_type,
+                request.header.nickname,
+                request.contents,
+                self.client.socket.protocol_version,
+                request.header.timestamp,
+            )
+            pending = bytes(frame.header) + bytes(frame.contents)
+            self.throttled_request = None
+        return ClientState(
+            ipv4_address=self.client.ipv4_address,
+            port=self.client.port,
+            nickname=self.client.nickname,
+            protocol_version=self.client.socket.protocol_version,
+            waiting_for_nickname=self.waiting_for_nickname,
+            heartbeat=self.client.heartbeat,
+            rooms=sorted(self.client.rooms),
+            transfers=[
+                (sender_id, transfer.transfer_id, transfer.room, transfer.offset)
+                for sender_id, transfer in self.client.transfers.items()
+            ],
+            pending=pending + self.frame_buffer.drain(),
+        )
+
+    def take_back_state(self, state: ClientState) -> None:
+        """
+        Handles the received bytes taken out for a successor that failed to take
+        over the client, then reads again.
+        """
+        self.frame_buffer.feed(state.pending)
+        self._handle_requests()
+        if self.throttled_request is None and not self.transport.is_closing():
+            self.transport.resume_reading()
+
+    def data_received(self, data: bytes) -> None:
+        """Buffers the received data and handles every complete request in the buffer."""
+        if self.client is None:
+            return
+        self.frame_buffer.feed(data)
+        self._handle_requests()
+
+    def _handle_requests(
+        self, throttled_request: Optional[TumultSocket.Request] = None
+    ) -> None:
+        """
+        Handles a throttled request, if any, then the buffered requests, dropping
+        the client if one of them is too large or malformed.
+        """
+        try:
+            if throttled_request is not None:
+                self.server._handle_request(self.client, throttled_request)
+            self._handle_buffered_requests()
+        except FrameTooLargeError as error:
+            logging.info("Dropping client %s: %s", self.client, error)
+            self.transport.abort()
+        except MALFORMED_REQUEST_ERRORS as error:
+            logging.info(
+                "Dropping client %s after a malformed request: %s", self.client, error
+            )
+            self.transport.abort()
+
+    def _handle_buffered_requests(self) -> None:
+        """
+        Handles the buffered requests within the client's rate limits, pausing
+        reading until the limits allow the next request if the client is throttled.
+        """
+        while self.throttled_request is None:
+            request: Optional[TumultSocket.Request] = self.frame_buffer.next_request()
+            if request is None:
+                return
+            if self.waiting_for_nickname:
+                if request.header.request_type == RequestType.NICKNAME:
+                    self.waiting_for_nickname = False
+                    self.server._accept_nickname(self.client, request)
+                continue
+            delay: Optional[float] = self.server._rate_limit(self.client, request)
+            if delay is None:
+                continue
+            if delay > 0:
+                self.throttled_request = request
+                self.transport.pause_reading()
+                self.server.loop.call_later(delay, self._resume_reading)
+                return
+            self.server._handle_request(self.client, request)
+
+    def _resume_reading(self) -> None:
+        """Handles the throttled request and the rest of the buffer, then reads again."""
+        # The request may have been taken out for a successor in the meantime
+        if self.transport.is_closing() or self.throttled_request is None:
+            return
+        request: TumultSocket.Request = self.throttled_request
+        self.throttled_request = None
+        self._handle_requests(request)
+        if self.throttled_request is None and not self.transport.is_closing():
+            self.transport.resume_reading()
+
+    def pause_writing(self) -> None:
+        """Holds frames in the client's outbound queue while the transport buffer is full."""
+        self.client.socket.paused = True
+
+    def resume_writing(self) -> None:
+        """Writes the frames queued while the transport buffer was full."""
+        self.client.socket.paused = False
+        self.server._flush_outbound(self.client)
+
+    def connection_lost(self, exc: Optional[Exception]) -> None:
+        """
+        Removes the client from the server when the connection closes,
+        unless the connection was handed over to a successor.
+        """
+        self.server.protocols.discard(self)
+        if self.client is None or self.handed_over:
+            return
+        if isinstance(exc, TimeoutError):
+            logging.info("Connection with client %s timed out", self.client)
+        elif isinstance(exc, ConnectionResetError):
+            logging.info(
+                "Connection with client %s was forcibly closed by them", self.client
+            )
+        elif isinstance(exc, ConnectionAbortedError):
+            logging.info("Connection with client %s was aborted", self.client)
+        elif exc is not None:
+            logging.error(
+                "Connection with client %s experienced an error: %s",
+                self.client,
+                exc,
+            )
+        self.server._disconnect_client(self.client)
+
+
+class AsyncTumultServer(TumultServer):
+    """Server implementation for Tumult handling every client on one asyncio event loop."""
+
+    def __init__(
+        self,
+        ipv4_address: str,
+        port: int,
+        config: Optional[ServerConfig] = None,
+        listening_socket: Optional[socket.socket] = None,
+    ) -> None:
+        super().__init__(ipv4_address, port, config, listening_socket)
+        self.loop: asyncio.AbstractEventLoop = asyncio.new_event_loop()
+        self.protocols: set[TumultProtocol] = set()
+        self.listener: Optional[asyncio.Server] = None
+        self.stopped: asyncio.Future = self.loop.create_future()
+        self.handoff: Optional[Handoff] = None
+        self.handoff_socket: Optional[socket.socket] = None
+
+    def restore(self, handoff: Handoff) -> None:
+        """Keeps the clients handed over by a previous server to serve once started."""
+        self.handoff = handoff
+        self.transfer_ids = itertools.count(handoff.next_transfer_id)
+
+    def run_threadsafe(self, callback: Callable[..., None], *args: Any) -> None:
+        """Schedules a callback from a foreign thread to run on the event loop."""
+        self.loop.call_soon_threadsafe(callback, *args)
+
+    def _flush_outbound(self, client: ClientInfo) -> None:
+        """Writes a client's queued frames to its transport, after the batch window if set."""
+        if self.config.batch_window <= 0:
+            self._write_outbound(client)
+        elif client.socket.flush_handle is None:
+            client.socket.flush_handle = self.loop.call_later(
+                self.config.batch_window, self._write_outbound, client
+            )
+
+    def _write_outbound(self, client: ClientInfo) -> None:
+        """Writes a client's queued frames to its transport unless the transport is full."""
+        client.socket.flush_handle = None
+        if not client.socket.paused:
+            frames: list[TumultFrame] = client.outbound.take_nowait()
+            if frames:
+                frames = self._pack_frames(client, frames)
+                client.socket.write_frames(frames)
+                self.bytes_sent.increment(sum(len(frame) for frame in frames))
+
+    def _start_writer(self, client: ClientInfo) -> None:
+        """Writes any frames queued during the handshake, the transport drains itself."""
+        self._flush_outbound(client)
+
+    def _start_liveness_checks(self) -> None:
+        """Runs the due liveness checks on the event loop once per tick."""
+        if self.liveness_checks is None:
+            return
+        self.loop.call_later(self.liveness_checks.tick, self._run_liveness_checks)
+
+    def _run_liveness_checks(self) -> None:
+        """Runs the due liveness checks then schedules the next tick."""
+        self._check_liveness()
+        self.loop.call_later(self.liveness_checks.tick, self._run_liveness_checks)
+
+    def start(self) -> None:
+        """
+        Starts listening for and accepting client connections on an event loop,
+        and for a successor to hand them over to if a handoff path is set.
+        """
+        logging.info("Listening at %s", self)
+        self.socket.listen()
+        self._start_metrics_endpoint()
+        self._start_liveness_checks()
+        if self.config.handoff_path is not None:
+            self._listen_for_successor()
+        self.loop.run_until_complete(self._serve())
+
+    async def _serve(self) -> None:
+        """Serves client connections until they are handed over to a successor."""
+        if self.handoff is not None:
+            for client_socket, state in zip(
+                self.handoff.client_sockets, self.handoff.client_states
+            ):
+                await self.loop.connect_accepted_socket(
+                    lambda state=state: TumultProtocol(self, state), client_socket
+                )
+            logging.info("Took over %i clients", len(self.handoff.client_states))
+            self.handoff = None
+        self.listener = await self.loop.create_server(
+            lambda: TumultProtocol(self), sock=self.socket.raw_socket
+        )
+        async with self.listener:
+            await self.stopped
+
+    def _listen_for_successor(self) -> None:
+        """Listens at the handoff path and waits for a successor in a thread."""
+        self.handoff_socket = listen_for_successor(self.config.handoff_path)
+        threading.Thread(target=self._wait_for_successor, daemon=True).start()
+
+    def _wait_for_successor(self) -> None:
+        """Waits for a successor to connect, then hands it the server's sockets."""
+        try:
+            connection, _ = self.handoff_socket.accept()
+        except OSError:
+            return
+        asyncio.run_coroutine_threadsafe(self._hand_off(connection), self.loop)
+
+    async def _hand_off(self, connection: socket.socket) -> None:
+        """
+        Stops accepting and reading, waits for every client's queued frames to be
+        written, then sends the listening socket and the client sockets with their
+        state to the successor and stops without closing the connections. If the
+        successor cannot be sent them, the server keeps serving instead.
+        """
+        logging.info("Handing %i clients over to a successor", len(self.clients))
+        # The duplicate keeps the listening socket and its backlog for the successor
+        listening_socket: socket.socket = self.listener.sockets[0].dup()
+        self.listener.close()
+        self.handoff_socket.close()
+        protocols: list[TumultProtocol] = [
+            protocol
+            for protocol in self.protocols
+            if protocol.client is not None and not protocol.transport.is_closing()
+        ]
+        for protocol in protocols:
+            protocol.transport.pause_reading()
+            self._flush_outbound(protocol.client)
+        deadline: float = self.loop.time() + HANDOFF_DRAIN_TIMEOUT
+        while self.loop.time() < deadline and any(
+            len(protocol.client.outbound) or protocol.transport.get_write_buffer_size()
+            for protocol in protocols
+        ):
+            await asyncio.sleep(HANDOFF_DRAIN_POLL)
+        protocols = [
+            protocol for protocol in protocols if not protocol.transport.is_closing()
+        ]
+
+        # The successor serves metrics on the same port, so it must be free first
+        if self.metrics_server is not None:
+            await self.loop.run_in_executor(None, self.metrics_server.shutdown)
+            self.metrics_server.server_close()
+        states: list[ClientState] = [
+            protocol.hand_over_state() for protocol in protocols
+        ]
+        handoff: Handoff = Handoff(
+            listening_socket,
+            [protocol.transport.get_extra_info("socket") for protocol in protocols],
+            states,
+            next(self.transfer_ids),
+        )
+        try:
+            await self.loop.run_in_executor(None, send_handoff, connection, handoff)
+        except OSError as error:
+            logging.error("Handing over to the successor failed: %s", error)
+            connection.close()
+            await self._resume_serving(listening_socket, protocols, states)
+            return
+        logging.info("Handed %i clients over to the successor", len(protocols))
+        # Nothing is appended with reading stopped, the successor reopens the logs
+        self.message_history.close()
+        self.rooms.close()
+        for protocol in protocols:
+            protocol.handed_over = True
+            protocol.transport.abort()
+        connection.close()
+        listening_socket.close()
+        self.stopped.set_result(None)
+
+    async def _resume_serving(
+        self,
+        listening_socket: socket.socket,
+        protocols: list[TumultProtocol],
+        states: list[ClientState],
+    ) -> None:
+        """
+        Takes back the clients and the listening socket from a failed handoff,
+        then accepts connections and waits for a successor again.
+        """
+        for protocol, state in zip(protocols, states):
+            protocol.take_back_state(state)
+        self.listener = await self.loop.create_server(
+            lambda: TumultProtocol(self), sock=listening_socket
+        )
+        self._start_metrics_endpoint()
+        self._listen_for_successor()
+        logging.info("Kept serving %i clients after the failed handoff", len(protocols))
@@ -0,0 +1,167 @@
+"""Provides the sets of clients connected to a Tumult server and its rooms."""
+
+import itertools
+import threading
+import time
+from dataclasses import dataclass, field
+from typing import Optional, Any, Iterator
+
+from src.server.outbound_queue import OutboundQueue
+from src.server.rate_limit import RateLimiter
+from src.shared.protocol import TumultWriter
+
+
+@dataclass
+class Transfer:
+    """
+    Container for a transfer relayed from a client under a server-wide id,
+    with the number of its payload's bytes relayed so far.
+    """
+
+    transfer_id: int
+    room: Optional[str] = None
+    offset: int = 0
+
+
+@dataclass
+class ClientInfo:
+    """Container for client connection information."""
+
+    ipv4_address: str
+    port: int
+    socket: TumultWriter
+    nickname: Optional[str] = None
+    outbound: OutboundQueue = field(default_factory=OutboundQueue)
+    compressor: Optional[Any] = None
+    connection_id: Optional[int] = None
+    rooms: set[str] = field(default_factory=set)
+    heartbeat: bool = False
+    last_activity: float = field(default_factory=time.monotonic)
+    rate_limiter: Optional[RateLimiter] = None
+    # Transfers being relayed from the client, by the ids the client gave them
+    transfers: dict[int, Transfer] = field(default_factory=dict)
+
+    def __str__(self) -> str:
+        """Returns a string representation of the socket address in address:port format."""
+        return f"{self.ipv4_address}:{self.port}"
+
+    @property
+    def socket_address(self) -> tuple[str, int]:
+        """Returns the socket address as a tuple."""
+        return self.ipv4_address, self.port
+
+
+class ClientSet:
+    """
+    Set of registered clients keyed by connection id. Broadcasters iterate an
+    immutable snapshot without taking the lock. The snapshot is only rebuilt on the
+    first read after clients are added or removed, so churn between broadcasts
+    costs constant time per change.
+    """
+
+    def __init__(self) -> None:
+        self._clients: dict[int, ClientInfo] = {}
+        self._snapshot: Optional[tuple[ClientInfo, ...]] = ()
+        self._lock: threading.Lock = threading.Lock()
+
+    def __len__(self) -> int:
+        """Returns the number of clients in the set."""
+        return len(self._clients)
+
+    def __iter__(self) -> Iterator[ClientInfo]:
+        """Iterates over a snapshot of the clients in the set."""
+        return iter(self.snapshot())
+
+    def __contains__(self, client: ClientInfo) -> bool:
+        """Returns whether the client is in the set."""
+        return self._clients.get(client.connection_id) is client
+
+    def snapshot(self) -> tuple[ClientInfo, ...]:
+        """Returns the clients in the order they were added, unaffected by later changes."""
+        snapshot: Optional[tuple[ClientInfo, ...]] = self._snapshot
+        if snapshot is None:
+            with self._lock:
+                if self._snapshot is None:
+                    self._snapshot = tuple(self._clients.values())
+                snapshot = self._snapshot
+        return snapshot
+
+    def add(self, client: ClientInfo) -> None:
+        """Adds a client that already has a connection id."""
+        with self._lock:
+            self._clients[client.connection_id] = client
+            self._snapshot = None
+
+    def remove(self, client: ClientInfo) -> bool:
+        """Removes a client, returning whether it was in the set."""
+        with self._lock:
+            if self._clients.get(client.connection_id) is not client:
+                return False
+            del self._clients[client.connection_id]
+            self._snapshot = None
+        return True
+
+
+class ClientRegistry(ClientSet):
+    """Connected clients keyed by connection id, with an index of their nicknames."""
+
+    def __init__(self) -> None:
+        super().__init__()
+        self.__nicknames: dict[str, dict[int, ClientInfo]] = {}
+        self.__connection_ids: Iterator[int] = itertools.count(1)
+
+    def add(self, client: ClientInfo) -> None:
+        """Registers a client under a new connection id."""
+        with self._lock:
+            client.connection_id = next(self.__connection_ids)
+            self._clients[client.connection_id] = client
+            self.__index_nickname(client)
+            self._snapshot = None
+
+    def remove(self, client: ClientInfo) -> bool:
+        """Unregisters a client, returning whether it was registered."""
+        with self._lock:
+            if self._clients.get(client.connection_id) is not client:
+                return False
+            del self._clients[client.connection_id]
+            self.__unindex_nickname(client)
+            self._snapshot = None
+        return True
+
+    def rename(self, client: ClientInfo, nickname: Optional[str]) -> None:
+        """Changes a client's nickname and moves it in the nickname index."""
+        with self._lock:
+            registered: bool = self._clients.get(client.connection_id) is client
+            if registered:
+                self.__unindex_nickname(client)
+            client.nickname = nickname
+            if registered:
+                self.__index_nickname(client)
+
+    def get(self, connection_id: int) -> Optional[ClientInfo]:
+        """Returns the client with a connection id, or None if it is not connected."""
+        return self._clients.get(connection_id)
+
+    def find(self, nickname: str) -> tuple[ClientInfo, ...]:
+        """Returns every connected client using a nickname."""
+        with self._lock:
+            return tuple(self.__nicknames.get(nickname, {}).values())
+
+    def __index_nickname(self, client: ClientInfo) -> None:
+        """Adds a client to the nickname index, the caller must hold the lock."""
+        if client.nickname is not None:
+            self.__nicknames.setdefault(client.nickname, {})[
+                client.connection_id
+            ] = client
+
+    def __unindex_nickname(self, client: ClientInfo) -> None:
+        """Removes a client from the nickname index, the caller must hold the lock."""
+        if client.nickname is None:
+            return
+        clients: Optional[dict[int, ClientInfo]] = self.__nicknames.get(
+            client.nickname
+        )
+        if clients is not None:
+            clients.pop(client.connection_id, None)
+            if not clients:
+                del self.__nicknames[client.nickname]
@@ -0,0 +1,321 @@
+"""Provides the links that federate Tumult servers on different hosts into one chat."""
+
+import itertools
+import logging
+import socket
+import threading
+import time
+from collections import OrderedDict
+from typing import Optional, Iterator
+
+from src.server.message_history import Message
+from src.server.metrics import Counter
+from src.server.outbound_queue import OutboundQueue, OverflowPolicy
+from src.server.tumult_server import TumultServer, MALFORMED_REQUEST_ERRORS
+from src.shared.protocol import (
+    TumultSocket,
+    TumultFrame,
+    RequestType,
+    PROTOCOL_VERSION,
+    batch_requests,
+    federated_message,
+    valid_room_name,
+)
+
+LINK_QUEUE_SIZE: int = 65536
+DEDUPLICATION_WINDOW: int = 65536
+RECONNECT_DELAY: float = 1.0
+MAX_RECONNECT_DELAY: float = 30.0
+FEDERATED_MESSAGE_TYPES: frozenset[RequestType] = frozenset(
+    (RequestType.MESSAGE, RequestType.JOIN_MESSAGE, RequestType.LEAVE_MESSAGE)
+)
+# Closing or malformed links, which are dropped and opened again
+LINK_ERRORS: tuple[type[Exception], ...] = (
+    ConnectionError,
+    OSError,
+    *MALFORMED_REQUEST_ERRORS,
+)
+
+
+class DeduplicationWindow:
+    """Ids of the most recently seen federated messages, forgetting the oldest first."""
+
+    def __init__(self, capacity: int = DEDUPLICATION_WINDOW) -> None:
+        self.capacity: int = capacity
+        self.__ids: OrderedDict[tuple[str, int, int], None] = OrderedDict()
+        self.__lock: threading.Lock = threading.Lock()
+
+    def add(self, message_id: tuple[str, int, int]) -> bool:
+        """Records a message id, returning whether it had not been seen yet."""
+        with self.__lock:
+            if message_id in self.__ids:
+                return False
+            self.__ids[message_id] = None
+            if len(self.__ids) > self.capacity:
+                self.__ids.popitem(last=False)
+            return True
+
+
+class FederationLink:
+    """Connection to a peer server, written to by its own thread through a bounded queue."""
+
+    def __init__(self, link_socket: TumultSocket, peer_id: str) -> None:
+        self.socket: TumultSocket = link_socket
+        self.peer_id: str = peer_id
+        # A peer too slow to keep up is dropped and relinked rather than waited for
+        self.outbound: OutboundQueue = OutboundQueue(
+            LINK_QUEUE_SIZE, OverflowPolicy.DISCONNECT
+        )
+
+    def __str__(self) -> str:
+        """Returns the peer's node id."""
+        return self.peer_id
+
+    def send(self, frames: list[TumultFrame]) -> None:
+        """Queues frames for the peer, closing the link if its queue is full."""
+        if self.outbound.put(tuple(frames)) is OverflowPolicy.DISCONNECT:
+            logging.info("Federation link to %s fell behind, relinking", self)
+            self.socket.abort()
+
+    def write_frames(self) -> None:
+        """Writes the queued frames to the peer until the link closes."""
+        while frames := self.outbound.take():
+            try:
+                self.socket.write_frames(frames)
+            except OSError as error:
+                logging.info("Writing to federation link %s failed: %s", self, error)
+                self.socket.abort()
+                return
+
+
+class Federation:
+    """
+    Links between a server and its peers that relay every message, join and leave
+    published on one server to the others. Each message is tagged with the node it
+    was published on, that node's incarnation and a sequence number. A node drops
+    its own messages and any it has already seen, and never sends a message back
+    over the link it came from, so messages cannot loop between peers.
+    """
+
+    def __init__(self, server: TumultServer) -> None:
+        self.server: TumultServer = server
+        self.node_id: str = (
+            server.config.node_id
+            if server.config.node_id is not None
+            else f"{socket.gethostname()}:{server.port}"
+        )
+        # Sequence numbers restart with the process, the incarnation tells them apart
+        self.incarnation: int = time.time_ns()
+        self.sequence: Iterator[int] = itertools.count(1)
+        self.seen: DeduplicationWindow = DeduplicationWindow()
+        self.links: list[FederationLink] = []
+        self.links_lock: threading.Lock = threading.Lock()
+        self.socket: Optional[TumultSocket] = None
+        if server.config.federation_port is not None:
+            self.socket = TumultSocket()
+            self.socket.raw_socket.setsockopt(
+                socket.SOL_SOCKET, socket.SO_REUSEADDR, 1
+            )
+            self.socket.bind((server.ipv4_address, server.config.federation_port))
+            self.socket.listen()
+
+        self.federated_messages: dict[str, Counter] = {
+            direction: server.metrics.counter(
+                "tumult_federated_messages_total",
+                "Messages exchanged with federated peers",
+                {"direction": direction},
+            )
+            for direction in ("sent", "received", "duplicate")
+        }
+        server.metrics.gauge(
+            "tumult_federation_links",
+            "Links to federated peers currently open",
+            lambda: len(self.links),
+        )
+        server.federate = self.publish
+
+    def start(self) -> None:
+        """Starts accepting links from peers and linking to every configured peer."""
+        if self.socket is not None:
+            logging.info(
+                "Accepting federation links at %s:%i as %s",
+                self.server.ipv4_address,
+                self.server.config.federation_port,
+                self.node_id,
+            )
+            threading.Thread(target=self._accept_links, daemon=True).start()
+        for peer_address in self.server.config.peers:
+            threading.Thread(
+                target=self._maintain_link, args=[peer_address], daemon=True
+            ).start()
+
+    def publish(self, message: Message) -> None:
+        """Tags a message published on this server as its own and sends it to every peer."""
+        sequence: int = next(self.sequence)
+        self.seen.add((self.node_id, self.incarnation, sequence))
+        frames: list[TumultFrame] = TumultFrame.federated(
+            self.node_id,
+            self.incarnation,
+            sequence,
+            self.__delivery_frames(message),
+            PROTOCOL_VERSION,
+        )
+        self.__send(frames)
+
+    def _accept_links(self) -> None:
+        """Accepts links opened by the configured peers, refusing any other host."""
+        while True:
+            try:
+                peer_socket, peer_address = self.socket.accept()
+            except OSError as error:
+                logging.error("Stopped accepting federation links: %s", error)
+                return
+            address: str = f"{peer_address[0]}:{peer_address[1]}"
+            if peer_address[0] not in self._peer_hosts():
+                logging.info("Refusing federation link from unknown host %s", address)
+                peer_socket.close()
+                continue
+            threading.Thread(
+                target=self._run_link,
+                args=[self.__link_socket(peer_socket), address],
+                daemon=True,
+            ).start()
+
+    def _peer_hosts(self) -> set[str]:
+        """Returns the addresses of the configured peers, resolved again every time."""
+        hosts: set[str] = set()
+        for host, port in self.server.config.peers:
+            try:
+                hosts.update(
+                    address_info[4][0]
+                    for address_info in socket.getaddrinfo(host, port)
+                )
+            except OSError as error:
+                logging.info("Resolving peer %s:%i failed: %s", host, port, error)
+        return hosts
+
+    def _maintain_link(self, peer_address: tuple[str, int]) -> None:
+        """Keeps a link open to a configured peer, reconnecting with a growing delay."""
+        delay: float = RECONNECT_DELAY
+        while True:
+            try:
+                peer_socket: socket.socket = socket.create_connection(peer_address)
+            except OSError as error:
+                logging.info(
+                    "Linking to peer %s:%i failed: %s, retrying in %.0f seconds",
+                    *peer_address,
+                    error,
+                    delay,
+                )
+            else:
+                linked_at: float = time.monotonic()
+                self._run_link(
+                    self.__link_socket(peer_socket),
+                    f"{peer_address[0]}:{peer_address[1]}",
+                )
+                # Only a link that stayed up resets the delay
+                if time.monotonic() - linked_at >= MAX_RECONNECT_DELAY:
+                    delay = RECONNECT_DELAY
+            time.sleep(delay)
+            delay = min(delay * 2, MAX_RECONNECT_DELAY)
+
+    def _run_link(self, link_socket: TumultSocket, address: str) -> None:
+        """
+        Greets a peer over a new link, then relays the messages it sends until the
+        link closes. Both ends greet and relay, whichever one opened the link.
+        """
+        link_socket.protocol_version = PROTOCOL_VERSION
+        link_socket.raw_socket.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+        try:
+            link_socket.write_frame(
+                TumultFrame.federation_hello(self.node_id, PROTOCOL_VERSION)
+            )
+            hello: TumultSocket.Request = link_socket.wait_for_request(
+                RequestType.FEDERATION
+            )
+        except LINK_ERRORS as error:
+            logging.info("Federation link with %s failed to open: %s", address, error)
+            link_socket.close()
+            return
+        if hello.header.nickname is None or hello.header.nickname == self.node_id:
+            logging.info("Refusing federation link with %s to this node", address)
+            link_socket.close()
+            return
+
+        link: FederationLink = FederationLink(link_socket, hello.header.nickname)
+        with self.links_lock:
+            self.links.append(link)
+        logging.info("Federation link with %s at %s opened", link, address)
+        threading.Thread(target=link.write_frames, daemon=True).start()
+        try:
+            while True:
+                self._receive(link, link_socket.read_request())
+        except LINK_ERRORS as error:
+            logging.info("Federation link with %s closed: %s", link, error)
+        finally:
+            with self.links_lock:
+                self.links.remove(link)
+            link.outbound.close()
+            link_socket.close()
+
+    def _receive(self, link: FederationLink, request: TumultSocket.Request) -> None:
+        """
+        Delivers a message federated by a peer to the local clients and passes it on
+        to the other peers, unless it came from this node or was already seen.
+        """
+        if (
+            request.header.request_type != RequestType.FEDERATION
+            or not request.contents
+        ):
+            return
+        origin: Optional[str] = request.header.nickname
+        try:
+            incarnation, sequence, frames = federated_message(request.contents)
+            message: Message = Message.from_request(next(batch_requests(frames)))
+        except (StopIteration, *MALFORMED_REQUEST_ERRORS) as error:
+            logging.info(
+                "Federation link with %s sent an invalid message: %s", link, error
+            )
+            return
+        if origin is None or origin == self.node_id:
+            return
+        if message.message_type not in FEDERATED_MESSAGE_TYPES or (
+            message.room is not None and not valid_room_name(message.room)
+        ):
+            logging.info("Federation link with %s sent an invalid message", link)
+            return
+        if not self.seen.add((origin, incarnation, sequence)):
+            self.federated_messages["duplicate"].increment()
+            return
+        self.federated_messages["received"].increment()
+        self.server.run_threadsafe(self.server.deliver_message, message)
+        self.__send(
+            [
+                TumultFrame.encode(
+                    RequestType.FEDERATION, origin, request.contents, PROTOCOL_VERSION
+                )
+            ],
+            link,
+        )
+
+    def __link_socket(self, peer_socket: socket.socket) -> TumultSocket:
+        """Wraps a link's socket, bounding its frames like those of clients."""
+        return TumultSocket(peer_socket, self.server.config.max_frame_size)
+
+    def __delivery_frames(self, message: Message) -> list[TumultFrame]:
+        """Returns the frames delivering a message, wrapped in its room if it has one."""
+        delivery: TumultFrame | tuple[TumultFrame, ...] = message.delivery(
+            PROTOCOL_VERSION
+        )
+        return [delivery] if isinstance(delivery, TumultFrame) else list(delivery)
+
+    def __send(
+        self, frames: list[TumultFrame], source: Optional[FederationLink] = None
+    ) -> None:
+        """Queues a federated message for every peer except the link it came from."""
+        with self.links_lock:
+            links: list[FederationLink] = self.links.copy()
+        for link in links:
+            if link is not source:
+                link.send(frames)
+                self.federated_messages["sent"].increment()
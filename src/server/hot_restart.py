@@ -0,0 +1,155 @@
+"""Provides the socket handoff that lets a new Tumult server take over from a running one."""
+
+import base64
+import json
+import logging
+import os
+import socket
+import struct
+from dataclasses import dataclass, field
+from typing import Optional, Any
+
+HANDOFF_LENGTH_STRUCT: struct.Struct = struct.Struct("!I")
+# Stays under the kernel's limit of descriptors passed in one message
+MAX_FDS_PER_MESSAGE: int = 250
+
+
+@dataclass
+class ClientState:
+    """
+    Container for what a successor needs to keep serving a handed over client,
+    including the bytes it sent that no request was parsed from yet.
+    """
+
+    ipv4_address: str
+    port: int
+    nickname: Optional[str]
+    protocol_version: str
+    waiting_for_nickname: bool
+    heartbeat: bool = False
+    rooms: list[str] = field(default_factory=list)
+    # Open transfers as the client's id, the server-wide id, the room and the offset
+    transfers: list[tuple[int, int, Optional[str], int]] = field(
+        default_factory=list
+    )
+    pending: bytes = b""
+
+    def to_fields(self) -> dict[str, Any]:
+        """Returns the state as JSON-compatible fields."""
+        return {
+            "ipv4_address": self.ipv4_address,
+            "port": self.port,
+            "nickname": self.nickname,
+            "protocol_version": self.protocol_version,
+            "waiting_for_nickname": self.waiting_for_nickname,
+            "heartbeat": self.heartbeat,
+            "rooms": self.rooms,
+            "transfers": self.transfers,
+            "pending": base64.b64encode(self.pending).decode("ascii"),
+        }
+
+    @classmethod
+    def from_fields(cls, fields: dict[str, Any]) -> "ClientState":
+        """Creates a state from the fields written by to_fields."""
+        return cls(
+            ipv4_address=fields["ipv4_address"],
+            port=fields["port"],
+            nickname=fields["nickname"],
+            protocol_version=fields["protocol_version"],
+            waiting_for_nickname=fields["waiting_for_nickname"],
+            heartbeat=fields["heartbeat"],
+            rooms=fields["rooms"],
+            transfers=[tuple(transfer) for transfer in fields["transfers"]],
+            pending=base64.b64decode(fields["pending"]),
+        )
+
+
+@dataclass
+class Handoff:
+    """Container for the listening socket, client sockets and state a server hands over."""
+
+    listening_socket: socket.socket
+    client_sockets: list[socket.socket]
+    client_states: list[ClientState]
+    next_transfer_id: int = 1
+
+
+def listen_for_successor(path: str) -> socket.socket:
+    """Listens at a Unix socket path for the server that will take over, replacing any stale file."""
+    if os.path.exists(path):
+        os.unlink(path)
+    handoff_socket: socket.socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    handoff_socket.bind(path)
+    handoff_socket.listen(1)
+    return handoff_socket
+
+
+def send_handoff(connection: socket.socket, handoff: Handoff) -> None:
+    """
+    Sends the state document followed by the listening socket and every client socket,
+    passed as descriptors in as few messages as the kernel allows.
+    """
+    document: bytes = json.dumps(
+        {
+            "clients": [state.to_fields() for state in handoff.client_states],
+            "next_transfer_id": handoff.next_transfer_id,
+        }
+    ).encode("utf-8")
+    connection.sendall(HANDOFF_LENGTH_STRUCT.pack(len(document)) + document)
+    descriptors: list[int] = [
+        handoff.listening_socket.fileno(),
+        *(client_socket.fileno() for client_socket in handoff.client_sockets),
+    ]
+    for start in range(0, len(descriptors), MAX_FDS_PER_MESSAGE):
+        batch: list[int] = descriptors[start : start + MAX_FDS_PER_MESSAGE]
+        socket.send_fds(connection, [HANDOFF_LENGTH_STRUCT.pack(len(batch))], batch)
+
+
+def _receive_exactly(connection: socket.socket, length: int) -> bytes:
+    """Receives exactly the provided number of bytes."""
+    received: bytearray = bytearray()
+    while len(received) < length:
+        chunk: bytes = connection.recv(length - len(received))
+        if not chunk:
+            raise ConnectionError("Handoff connection closed early")
+        received += chunk
+    return bytes(received)
+
+
+def take_over(path: str) -> Optional[Handoff]:
+    """
+    Asks the server listening at a Unix socket path to hand over its sockets and
+    returns them, or None if no server is listening there.
+    """
+    if not os.path.exists(path):
+        return None
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as connection:
+        try:
+            connection.connect(path)
+        except (ConnectionRefusedError, FileNotFoundError):
+            logging.info("No server to take over from at %s", path)
+            return None
+        logging.info("Taking over from the server at %s", path)
+        (document_length,) = HANDOFF_LENGTH_STRUCT.unpack(
+            _receive_exactly(connection, HANDOFF_LENGTH_STRUCT.size)
+        )
+        document: dict[str, Any] = json.loads(
+            _receive_exactly(connection, document_length)
+        )
+        client_states: list[ClientState] = [
+            ClientState.from_fields(fields) for fields in document["clients"]
+        ]
+        descriptors: list[int] = []
+        while len(descriptors) < len(client_states) + 1:
+            _, received_descriptors, _, _ = socket.recv_fds(
+                connection, HANDOFF_LENGTH_STRUCT.size, MAX_FDS_PER_MESSAGE
+            )
+            if not received_descriptors:
+                raise ConnectionError("Handoff connection closed early")
+            descriptors.extend(received_descriptors)
+    return Handoff(
+        socket.socket(fileno=descriptors[0]),
+        [socket.socket(fileno=descriptor) for descriptor in descriptors[1:]],
+        client_states,
+        document["next_transfer_id"],
+    )
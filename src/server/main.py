@@ -2,12 +2,42 @@
 
 import argparse
 import logging
+import socket
 from argparse import Namespace, ArgumentParser
+from typing import Optional
 
-from src.server.tumult_server import TumultServer
+from src.server.async_tumult_server import AsyncTumultServer
+from src.server.federation import Federation
+from src.server.hot_restart import Handoff, take_over
+from src.server.sharding import start_sharded_server
+from src.server.message_history import (
+    DEFAULT_SEGMENT_SIZE,
+    DEFAULT_FSYNC_BATCH,
+    DEFAULT_FSYNC_INTERVAL,
+)
+from src.server.metrics import DEFAULT_METRICS_HOST
+from src.server.outbound_queue import OverflowPolicy, DEFAULT_QUEUE_SIZE
+from src.server.rate_limit import RateLimitPolicy
+from src.server.rooms import DEFAULT_MAX_ROOMS
+from src.server.tumult_server import (
+    TumultServer,
+    ServerConfig,
+    DEFAULT_HISTORY_PAGE_SIZE,
+    MAX_HISTORY_PAGE_SIZE,
+    DEFAULT_BATCH_WINDOW,
+    DEFAULT_COMPRESSION_THRESHOLD,
+    DEFAULT_HEARTBEAT_INTERVAL,
+    DEFAULT_IDLE_TIMEOUT,
+    DEFAULT_MAX_FRAME_SIZE,
+)
 from src.shared.logging import DATETIME_FORMAT, LOG_FORMAT
 from src.shared.protocol import DEFAULT_IPV4_ADDRESS, DEFAULT_PORT
 
+SERVER_ENGINES: dict[str, type[TumultServer]] = {
+    "threads": TumultServer,
+    "asyncio": AsyncTumultServer,
+}
+
 
 def _setup_logging() -> None:
     """Configures the logging with the formats from the Tumult logging module."""
@@ -18,8 +48,16 @@ def _setup_logging() -> None:
     )
 
 
+def _peer_address(peer: str) -> tuple[str, int]:
+    """Parses a peer's federation address in host:port format."""
+    host, separator, port = peer.rpartition(":")
+    if not separator or not host or not port.isdigit():
+        raise argparse.ArgumentTypeError(f"{peer} is not in host:port format")
+    return host, int(port)
+
+
 def _parse_arguments() -> Namespace:
-    """Parses the command line arguments for the server host and port."""
+    """Parses the command line arguments for the server address and settings."""
     parser: ArgumentParser = argparse.ArgumentParser(description="Tumult Chat Server")
     parser.add_argument(
         "--host",
@@ -28,7 +66,270 @@ def _parse_arguments() -> Namespace:
         help="Server host IPv4 address",
     )
     parser.add_argument("--port", type=int, default=DEFAULT_PORT, help="Server port")
-    return parser.parse_args()
+    parser.add_argument(
+        "--engine",
+        type=str,
+        choices=SERVER_ENGINES.keys(),
+        default="threads",
+        help="Connection handling engine, a thread per client or a single asyncio loop",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=1,
+        help="Number of server processes sharing the port, requires SO_REUSEPORT",
+    )
+    parser.add_argument(
+        "--queue-size",
+        type=int,
+        default=DEFAULT_QUEUE_SIZE,
+        help="Maximum number of frames waiting to be written to each client",
+    )
+    parser.add_argument(
+        "--overflow-policy",
+        type=OverflowPolicy,
+        choices=list(OverflowPolicy),
+        default=OverflowPolicy.DROP_OLDEST,
+        help="Action taken when a client's outbound queue is full",
+    )
+    parser.add_argument(
+        "--history-dir",
+        type=str,
+        default=None,
+        help="Directory of the persistent message log, history is kept in memory if unset",
+    )
+    parser.add_argument(
+        "--segment-size",
+        type=int,
+        default=DEFAULT_SEGMENT_SIZE,
+        help="Maximum size in bytes of each message log segment file",
+    )
+    parser.add_argument(
+        "--fsync-batch",
+        type=int,
+        default=DEFAULT_FSYNC_BATCH,
+        help="Number of logged messages between each sync to disk",
+    )
+    parser.add_argument(
+        "--fsync-interval",
+        type=float,
+        default=DEFAULT_FSYNC_INTERVAL,
+        help="Maximum seconds between each sync of the message log to disk",
+    )
+    parser.add_argument(
+        "--history-page-size",
+        type=int,
+        default=DEFAULT_HISTORY_PAGE_SIZE,
+        help="Number of recent messages sent to a joining client that asks for none",
+    )
+    parser.add_argument(
+        "--max-history-page-size",
+        type=int,
+        default=MAX_HISTORY_PAGE_SIZE,
+        help="Maximum number of messages sent for a single history request",
+    )
+    parser.add_argument(
+        "--batch-window",
+        type=float,
+        default=DEFAULT_BATCH_WINDOW,
+        help="Seconds to wait for more frames before writing to a client, sent as one batch",
+    )
+    parser.add_argument(
+        "--compression-threshold",
+        type=int,
+        default=DEFAULT_COMPRESSION_THRESHOLD,
+        help="Minimum size in bytes of a write compressed for clients that accept it",
+    )
+    parser.add_argument(
+        "--no-compression",
+        dest="compression",
+        action="store_false",
+        help="Never compress writes, even for clients that accept it",
+    )
+    parser.add_argument(
+        "--no-search",
+        dest="search",
+        action="store_false",
+        help="Do not index message histories, so searches find nothing",
+    )
+    parser.add_argument(
+        "--metrics-port",
+        type=int,
+        default=None,
+        help="Local port serving metrics in the Prometheus text format, off if unset",
+    )
+    parser.add_argument(
+        "--metrics-host",
+        type=str,
+        default=DEFAULT_METRICS_HOST,
+        help="Address the metrics endpoint listens to",
+    )
+    parser.add_argument(
+        "--heartbeat-interval",
+        type=float,
+        default=DEFAULT_HEARTBEAT_INTERVAL,
+        help="Seconds a client can be idle before it is pinged",
+    )
+    parser.add_argument(
+        "--idle-timeout",
+        type=float,
+        default=DEFAULT_IDLE_TIMEOUT,
+        help="Seconds a client can be idle before it is disconnected, never if 0",
+    )
+    parser.add_argument(
+        "--max-frame-size",
+        type=int,
+        default=DEFAULT_MAX_FRAME_SIZE,
+        help="Maximum size in bytes of a request's contents, larger requests disconnect",
+    )
+    parser.add_argument(
+        "--request-rate",
+        type=float,
+        default=None,
+        help="Maximum requests per second from each client, unlimited if unset",
+    )
+    parser.add_argument(
+        "--byte-rate",
+        type=float,
+        default=None,
+        help="Maximum bytes per second received from each client, unlimited if unset",
+    )
+    parser.add_argument(
+        "--rate-limit-policy",
+        type=RateLimitPolicy,
+        choices=list(RateLimitPolicy),
+        default=RateLimitPolicy.THROTTLE,
+        help="Action taken when a client sends faster than its rate limits",
+    )
+    parser.add_argument(
+        "--max-connections",
+        type=int,
+        default=None,
+        help="Maximum number of connected clients, unlimited if unset",
+    )
+    parser.add_argument(
+        "--max-rooms",
+        type=int,
+        default=DEFAULT_MAX_ROOMS,
+        help="Maximum number of rooms clients can create, joining another is refused",
+    )
+    parser.add_argument(
+        "--accept-rate",
+        type=float,
+        default=None,
+        help="Maximum new connections accepted per second, unlimited if unset",
+    )
+    parser.add_argument(
+        "--node-id",
+        type=str,
+        default=None,
+        help="Name of this server among its federated peers, hostname:port if unset",
+    )
+    parser.add_argument(
+        "--federation-port",
+        type=int,
+        default=None,
+        help="Port accepting federation links from peers, none if unset",
+    )
+    parser.add_argument(
+        "--peer",
+        type=_peer_address,
+        action="append",
+        default=[],
+        help="Federation address of a peer server to link to, e.g. 10.0.0.2:65534",
+    )
+    parser.add_argument(
+        "--handoff-path",
+        type=str,
+        default=None,
+        help="Unix socket path to take over clients from and hand them over at, off if unset",
+    )
+    arguments: Namespace = parser.parse_args()
+    if arguments.workers < 1:
+        parser.error("--workers must be at least 1")
+    if arguments.queue_size < 1:
+        parser.error("--queue-size must be at least 1")
+    if arguments.segment_size < 1:
+        parser.error("--segment-size must be at least 1")
+    if arguments.fsync_batch < 1:
+        parser.error("--fsync-batch must be at least 1")
+    if arguments.history_page_size < 0:
+        parser.error("--history-page-size must be at least 0")
+    if arguments.max_history_page_size < arguments.history_page_size:
+        parser.error("--max-history-page-size must be at least --history-page-size")
+    if arguments.batch_window < 0:
+        parser.error("--batch-window must be at least 0")
+    if arguments.compression_threshold < 0:
+        parser.error("--compression-threshold must be at least 0")
+    if arguments.heartbeat_interval <= 0:
+        parser.error("--heartbeat-interval must be greater than 0")
+    if arguments.idle_timeout < 0:
+        parser.error("--idle-timeout must be at least 0")
+    if 0 < arguments.idle_timeout <= arguments.heartbeat_interval:
+        parser.error("--idle-timeout must be greater than --heartbeat-interval")
+    if arguments.max_frame_size < 1:
+        parser.error("--max-frame-size must be at least 1")
+    if arguments.request_rate is not None and arguments.request_rate <= 0:
+        parser.error("--request-rate must be greater than 0")
+    if arguments.byte_rate is not None and arguments.byte_rate <= 0:
+        parser.error("--byte-rate must be greater than 0")
+    if arguments.max_connections is not None and arguments.max_connections < 1:
+        parser.error("--max-connections must be at least 1")
+    if arguments.max_rooms < 1:
+        parser.error("--max-rooms must be at least 1")
+    if arguments.accept_rate is not None and arguments.accept_rate <= 0:
+        parser.error("--accept-rate must be greater than 0")
+    if arguments.workers > 1 and (
+        arguments.federation_port is not None or arguments.peer
+    ):
+        parser.error("--workers cannot be combined with federation")
+    if arguments.handoff_path is not None:
+        if arguments.engine != "asyncio":
+            parser.error("--handoff-path requires --engine asyncio")
+        if arguments.history_dir is None:
+            parser.error("--handoff-path requires --history-dir")
+        if arguments.workers > 1:
+            parser.error("--handoff-path cannot be combined with --workers")
+        if arguments.federation_port is not None:
+            parser.error("--handoff-path cannot be combined with --federation-port")
+        if not hasattr(socket, "AF_UNIX") or not hasattr(socket, "send_fds"):
+            parser.error("--handoff-path is not supported on this platform")
+    if arguments.workers > 1 and not hasattr(socket, "SO_REUSEPORT"):
+        parser.error("--workers is not supported on this platform")
+    return arguments
+
+
+def _build_config(arguments: Namespace) -> ServerConfig:
+    """Creates the server settings from the parsed command line arguments."""
+    return ServerConfig(
+        queue_size=arguments.queue_size,
+        overflow_policy=arguments.overflow_policy,
+        history_directory=arguments.history_dir,
+        segment_size=arguments.segment_size,
+        fsync_batch=arguments.fsync_batch,
+        fsync_interval=arguments.fsync_interval,
+        history_page_size=arguments.history_page_size,
+        max_history_page_size=arguments.max_history_page_size,
+        batch_window=arguments.batch_window,
+        compression=arguments.compression,
+        search=arguments.search,
+        compression_threshold=arguments.compression_threshold,
+        metrics_host=arguments.metrics_host,
+        metrics_port=arguments.metrics_port,
+        heartbeat_interval=arguments.heartbeat_interval,
+        idle_timeout=arguments.idle_timeout,
+        max_frame_size=arguments.max_frame_size,
+        request_rate=arguments.request_rate,
+        byte_rate=arguments.byte_rate,
+        rate_limit_policy=arguments.rate_limit_policy,
+        max_connections=arguments.max_connections,
+        max_rooms=arguments.max_rooms,
+        accept_rate=arguments.accept_rate,
+        node_id=arguments.node_id,
+        federation_port=arguments.federation_port,
+        peers=tuple(arguments.peer),
+        handoff_path=arguments.handoff_path,
+    )
 
 
 def main() -> None:
@@ -36,7 +337,28 @@ def main() -> None:
     _setup_logging()
 
     arguments: Namespace = _parse_arguments()
-    server: TumultServer = TumultServer(arguments.host, arguments.port)
+    server_class: type[TumultServer] = SERVER_ENGINES[arguments.engine]
+    config: ServerConfig = _build_config(arguments)
+    if arguments.workers > 1:
+        start_sharded_server(
+            server_class, arguments.host, arguments.port, config, arguments.workers
+        )
+        return
+
+    # A running server at the handoff path hands over its listening socket and clients
+    handoff: Optional[Handoff] = (
+        take_over(config.handoff_path) if config.handoff_path is not None else None
+    )
+    server: TumultServer = server_class(
+        arguments.host,
+        arguments.port,
+        config,
+        handoff.listening_socket if handoff is not None else None,
+    )
+    if handoff is not None:
+        server.restore(handoff)
+    if config.federation_port is not None or config.peers:
+        Federation(server).start()
     server.start()
 
 
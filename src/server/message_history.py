@@ -0,0 +1,462 @@
+"""Provides chat messages and the in-memory and on-disk message history for Tumult."""
+
+import logging
+import mmap
+import os
+import queue
+import struct
+import threading
+import time
+from array import array
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Optional, Iterator
+
+from src.shared.protocol import (
+    TumultSocket,
+    TumultFrame,
+    TumultWriter,
+    FrameBuffer,
+    RequestType,
+    ENCODING_FORMAT,
+    PROTOCOL_VERSION,
+    batch_requests,
+)
+
+DEFAULT_SEGMENT_SIZE: int = 64 * 1024 * 1024
+DEFAULT_FSYNC_BATCH: int = 256
+DEFAULT_FSYNC_INTERVAL: float = 1.0
+SEGMENT_DATA_SUFFIX: str = ".log"
+SEGMENT_INDEX_SUFFIX: str = ".index"
+INDEX_ENTRY_STRUCT: struct.Struct = struct.Struct("!II")
+# Segments whose mapping, and the descriptor it holds, stays open for reads
+MAX_MAPPED_SEGMENTS: int = 16
+EPOCH_FILE_NAME: str = "epoch"
+OPEN_BINARY_FLAG: int = getattr(os, "O_BINARY", 0)
+
+
+@dataclass
+class Message:
+    """
+    Container for chat messages with the message type, sender nickname, the room
+    the message was sent to, or None if it was sent to the whole server, and its
+    sequence number once it is recorded in a history.
+    """
+
+    nickname: Optional[str]
+    contents: str
+    message_type: RequestType = RequestType.MESSAGE
+    timestamp: float = field(default_factory=time.time)
+    room: Optional[str] = None
+    sequence: Optional[int] = None
+    frames: dict[str, TumultFrame] = field(
+        default_factory=dict, init=False, repr=False, compare=False
+    )
+    room_frames: dict[str, tuple[TumultFrame, ...]] = field(
+        default_factory=dict, init=False, repr=False, compare=False
+    )
+
+    @classmethod
+    def from_request(cls, request: TumultSocket.Request) -> "Message":
+        """
+        Creates a message from a received message, join or leave request,
+        or from a room request carrying one.
+        """
+        match request.header.request_type:
+            case RequestType.ROOM:
+                message: Message = cls.from_request(
+                    next(batch_requests(request.contents))
+                )
+                message.room = request.header.nickname
+                return message
+            case RequestType.JOIN_MESSAGE:
+                contents = "joined"
+            case RequestType.LEAVE_MESSAGE:
+                contents = "left"
+            case _:
+                contents = request.contents.decode(ENCODING_FORMAT)
+        return cls(
+            request.header.nickname,
+            contents,
+            request.header.request_type,
+            request.header.timestamp,
+            sequence=request.header.sequence,
+        )
+
+    def number(self, sequence: int) -> None:
+        """Sets the message's sequence number, dropping any frames encoded without it."""
+        self.sequence = sequence
+        self.frames.clear()
+        self.room_frames.clear()
+
+    def frame(self, version: str) -> TumultFrame:
+        """Returns the message encoded for a protocol version, encoding it only once."""
+        frame: Optional[TumultFrame] = self.frames.get(version)
+        if frame is None:
+            contents: bytes = (
+                self.contents.encode(ENCODING_FORMAT)
+                if self.message_type == RequestType.MESSAGE
+                else b""
+            )
+            frame = TumultFrame.encode(
+                self.message_type,
+                self.nickname,
+                contents,
+                version,
+                self.timestamp,
+                self.sequence,
+            )
+            self.frames[version] = frame
+        return frame
+
+    def delivery(self, version: str) -> TumultFrame | tuple[TumultFrame, ...]:
+        """
+        Returns the message encoded for a protocol version, wrapped in a request
+        naming its room if it has one, encoding it only once.
+        """
+        if self.room is None:
+            return self.frame(version)
+        room_frames: Optional[tuple[TumultFrame, ...]] = self.room_frames.get(version)
+        if room_frames is None:
+            room_frames = tuple(
+                TumultFrame.room(self.room, [self.frame(version)], version)
+            )
+            self.room_frames[version] = room_frames
+        return room_frames
+
+    def write_to(self, writer: TumultWriter) -> None:
+        """Writes the message's encoded frames to a connection."""
+        delivery: TumultFrame | tuple[TumultFrame, ...] = self.delivery(
+            writer.protocol_version
+        )
+        if isinstance(delivery, TumultFrame):
+            writer.write_frame(delivery)
+        else:
+            writer.write_frames(list(delivery))
+
+
+class MessageHistory:
+    """
+    In-memory history of every delivered message, lost when the server stops.
+    Its epoch tells it apart from the histories of earlier runs, which reuse
+    the same sequence numbers.
+    """
+
+    def __init__(self, epoch: Optional[int] = None) -> None:
+        self.epoch: int = epoch if epoch is not None else time.time_ns()
+        self.__messages: list[Message] = []
+        self.__lock: threading.Lock = threading.Lock()
+
+    def __len__(self) -> int:
+        """Returns the number of messages in the history."""
+        return len(self.__messages)
+
+    def __iter__(self) -> Iterator[Message]:
+        """Iterates over the messages in the order they were delivered."""
+        return iter(self.__messages.copy())
+
+    def append(self, message: Message) -> int:
+        """
+        Adds a delivered message to the end of the history, numbering it with its index,
+        and returns the index. The message is encoded first, so that one that cannot
+        be encoded raises ValueError instead of breaking every later history page.
+        """
+        with self.__lock:
+            message.number(len(self.__messages))
+            message.frame(PROTOCOL_VERSION)
+            self.__messages.append(message)
+            return len(self.__messages) - 1
+
+    def frames(
+        self, version: str, start: int = 0, stop: Optional[int] = None
+    ) -> Iterator[TumultFrame]:
+        """Yields the encoded frames of the messages in the provided range."""
+        for message in self.__messages[start:stop]:
+            yield message.frame(version)
+
+    def close(self) -> None:
+        """Releases the history, which holds nothing outside of memory."""
+
+
+class LogSegment:
+    """
+    Append-only data file of encoded frames with an index of each frame's position.
+    Only the segment being appended to keeps its files open for writing.
+    """
+
+    def __init__(self, directory: Path, base_index: int, writable: bool = True) -> None:
+        self.base_index: int = base_index
+        self.data_path: Path = directory / f"{base_index:020d}{SEGMENT_DATA_SUFFIX}"
+        self.index_path: Path = directory / f"{base_index:020d}{SEGMENT_INDEX_SUFFIX}"
+        self.offsets: array = array("I")
+        self.lengths: array = array("I")
+        self.size: int = 0
+        self.__mapping: Optional[mmap.mmap] = None
+        self.__mapping_lock: threading.Lock = threading.Lock()
+
+        self.__load_index()
+        self.__data_descriptor: Optional[int] = None
+        self.__index_descriptor: Optional[int] = None
+        if writable:
+            self.__data_descriptor = os.open(
+                self.data_path,
+                os.O_WRONLY | os.O_CREAT | os.O_APPEND | OPEN_BINARY_FLAG,
+            )
+            self.__index_descriptor = os.open(
+                self.index_path,
+                os.O_WRONLY | os.O_CREAT | os.O_APPEND | OPEN_BINARY_FLAG,
+            )
+        # Drop any frame written after the last one that made it into the index
+        if self.data_path.exists():
+            os.truncate(self.data_path, self.size)
+
+    def __len__(self) -> int:
+        """Returns the number of frames in the segment."""
+        return len(self.offsets)
+
+    def append(self, record: bytes) -> None:
+        """Appends an encoded frame and its index entry."""
+        os.write(self.__data_descriptor, record)
+        os.write(
+            self.__index_descriptor, INDEX_ENTRY_STRUCT.pack(self.size, len(record))
+        )
+        self.offsets.append(self.size)
+        self.lengths.append(len(record))
+        self.size += len(record)
+
+    def view(self, start: int, stop: int) -> memoryview:
+        """Returns a zero-copy view of the contiguous frames in the provided range."""
+        start_offset: int = self.offsets[start]
+        stop_offset: int = self.offsets[stop - 1] + self.lengths[stop - 1]
+        return memoryview(self.__map(stop_offset))[start_offset:stop_offset]
+
+    def sync(self) -> None:
+        """Flushes the segment's data and index to disk if it is still written to."""
+        if self.__data_descriptor is None:
+            return
+        os.fsync(self.__data_descriptor)
+        os.fsync(self.__index_descriptor)
+
+    def seal(self) -> None:
+        """Syncs a full segment and closes its files for writing, keeping it readable."""
+        self.sync()
+        self.close()
+
+    def release_mapping(self) -> None:
+        """Drops the segment's mapping, which views still referencing it keep valid."""
+        with self.__mapping_lock:
+            self.__mapping = None
+
+    def close(self) -> None:
+        """Closes the segment's files, mappings still referenced by views stay valid."""
+        if self.__data_descriptor is not None:
+            os.close(self.__data_descriptor)
+            os.close(self.__index_descriptor)
+            self.__data_descriptor = None
+            self.__index_descriptor = None
+        self.release_mapping()
+
+    def __map(self, length: int) -> mmap.mmap:
+        """Returns a read-only mapping covering at least the provided number of bytes."""
+        with self.__mapping_lock:
+            if self.__mapping is None or len(self.__mapping) < length:
+                with open(self.data_path, "rb") as data_file:
+                    self.__mapping = mmap.mmap(
+                        data_file.fileno(), 0, access=mmap.ACCESS_READ
+                    )
+            return self.__mapping
+
+    def __load_index(self) -> None:
+        """Reads the index entries of a previously written segment."""
+        if not self.index_path.exists():
+            return
+        index_bytes: bytes = self.index_path.read_bytes()
+        data_size: int = self.data_path.stat().st_size if self.data_path.exists() else 0
+        complete_length: int = len(index_bytes) - (
+            len(index_bytes) % INDEX_ENTRY_STRUCT.size
+        )
+        for offset, length in INDEX_ENTRY_STRUCT.iter_unpack(
+            index_bytes[:complete_length]
+        ):
+            if offset + length > data_size:
+                break
+            self.offsets.append(offset)
+            self.lengths.append(length)
+            self.size = offset + length
+        # Rewrite the index if it ends with entries for frames that were never written
+        if len(self.offsets) * INDEX_ENTRY_STRUCT.size != len(index_bytes):
+            os.truncate(self.index_path, len(self.offsets) * INDEX_ENTRY_STRUCT.size)
+
+
+class MessageLog:
+    """
+    Durable message history stored as size-capped segment files of encoded frames.
+    Replays are served from memory-mapped segments without decoding any messages.
+    Its epoch is set when the log is created and kept across restarts. Syncs to
+    disk run on a flusher thread, so appending never waits for the disk.
+    """
+
+    def __init__(
+        self,
+        directory: str,
+        segment_size: int = DEFAULT_SEGMENT_SIZE,
+        fsync_batch: int = DEFAULT_FSYNC_BATCH,
+        fsync_interval: float = DEFAULT_FSYNC_INTERVAL,
+        epoch: Optional[int] = None,
+    ) -> None:
+        self.directory: Path = Path(directory)
+        self.segment_size: int = segment_size
+        self.fsync_batch: int = fsync_batch
+        self.fsync_interval: float = fsync_interval
+        self.segments: list[LogSegment] = []
+        self.__length: int = 0
+        self.__unsynced_count: int = 0
+        self.__last_sync: float = time.monotonic()
+        self.__lock: threading.Lock = threading.Lock()
+        # Segments to sync, each sealed too once full, or None to stop the flusher
+        self.__flushes: queue.Queue[Optional[tuple[LogSegment, bool]]] = queue.Queue()
+        self.__mapped_segments: OrderedDict[int, LogSegment] = OrderedDict()
+        self.__mapped_segments_lock: threading.Lock = threading.Lock()
+
+        self.directory.mkdir(parents=True, exist_ok=True)
+        base_indexes: list[int] = sorted(
+            int(path.stem) for path in self.directory.glob(f"*{SEGMENT_DATA_SUFFIX}")
+        )
+        for position, base_index in enumerate(base_indexes):
+            self.segments.append(
+                LogSegment(
+                    self.directory,
+                    base_index,
+                    writable=position == len(base_indexes) - 1,
+                )
+            )
+        if not self.segments:
+            self.segments.append(LogSegment(self.directory, 0))
+        self.__length = self.segments[-1].base_index + len(self.segments[-1])
+        self.epoch: int = self.__load_epoch(epoch)
+        self.__flusher: threading.Thread = threading.Thread(
+            target=self.__flush_segments, daemon=True
+        )
+        self.__flusher.start()
+        logging.info(
+            "Loaded %i messages from the message log at %s",
+            self.__length,
+            self.directory,
+        )
+
+    def __len__(self) -> int:
+        """Returns the number of messages in the log."""
+        return self.__length
+
+    def __iter__(self) -> Iterator[Message]:
+        """Iterates over the logged messages, decoding each one."""
+        frame_buffer: FrameBuffer = FrameBuffer()
+        for segment_view in self.__segment_views(0, len(self)):
+            frame_buffer.feed(segment_view)
+            for request in frame_buffer.requests():
+                yield Message.from_request(request)
+
+    def append(self, message: Message) -> int:
+        """
+        Appends a delivered message numbered with its index, handing the segment
+        to the flusher once a batch is due, and returns the index.
+        """
+        with self.__lock:
+            # Numbering and encoding under the lock keeps sequences in log order
+            message.number(self.__length)
+            frame: TumultFrame = message.frame(PROTOCOL_VERSION)
+            record: bytes = frame.header + frame.contents
+            active_segment: LogSegment = self.segments[-1]
+            if active_segment.size and active_segment.size + len(record) > (
+                self.segment_size
+            ):
+                self.__flushes.put((active_segment, True))
+                active_segment = LogSegment(self.directory, self.__length)
+                self.segments.append(active_segment)
+            active_segment.append(record)
+            self.__length += 1
+
+            self.__unsynced_count += 1
+            if (
+                self.__unsynced_count >= self.fsync_batch
+                or time.monotonic() - self.__last_sync >= self.fsync_interval
+            ):
+                self.__flushes.put((active_segment, False))
+                self.__unsynced_count = 0
+                self.__last_sync = time.monotonic()
+            return self.__length - 1
+
+    def frames(
+        self, version: str, start: int = 0, stop: Optional[int] = None
+    ) -> Iterator[TumultFrame]:
+        """
+        Yields the frames of the messages in the provided range. Binary header clients
+        get one zero-copy frame per segment, while others get re-encoded frames.
+        """
+        stop = len(self) if stop is None else min(stop, len(self))
+        if version == PROTOCOL_VERSION:
+            for segment_view in self.__segment_views(start, stop):
+                yield TumultFrame(segment_view)
+            return
+
+        frame_buffer: FrameBuffer = FrameBuffer()
+        for segment_view in self.__segment_views(start, stop):
+            frame_buffer.feed(segment_view)
+            for request in frame_buffer.requests():
+                yield Message.from_request(request).frame(version)
+
+    def close(self) -> None:
+        """Waits for the pending syncs, then syncs and closes every segment."""
+        self.__flushes.put(None)
+        self.__flusher.join()
+        with self.__lock:
+            self.segments[-1].sync()
+            for segment in self.segments:
+                segment.close()
+
+    def __load_epoch(self, epoch: Optional[int]) -> int:
+        """Reads the log's epoch, or records the provided or a new one for a new log."""
+        epoch_path: Path = self.directory / EPOCH_FILE_NAME
+        if epoch_path.exists():
+            return int(epoch_path.read_text())
+        epoch = epoch if epoch is not None else time.time_ns()
+        # Replacing a complete temporary file never leaves a torn epoch behind
+        temporary_path: Path = epoch_path.with_suffix(".tmp")
+        temporary_path.write_text(str(epoch))
+        os.replace(temporary_path, epoch_path)
+        return epoch
+
+    def __flush_segments(self) -> None:
+        """Syncs the segments handed over by appends until the log is closed."""
+        while (flush := self.__flushes.get()) is not None:
+            segment, full = flush
+            try:
+                if full:
+                    segment.seal()
+                else:
+                    segment.sync()
+            except OSError as error:
+                logging.error(
+                    "Syncing the message log at %s failed: %s", self.directory, error
+                )
+
+    def __segment_views(self, start: int, stop: int) -> Iterator[memoryview]:
+        """Yields a view of the contiguous frames in each segment overlapping the range."""
+        with self.__lock:
+            segments: list[LogSegment] = self.segments.copy()
+        for segment in segments:
+            segment_start: int = max(start - segment.base_index, 0)
+            segment_stop: int = min(stop - segment.base_index, len(segment))
+            if segment_start < segment_stop:
+                self.__track_mapping(segment)
+                yield segment.view(segment_start, segment_stop)
+
+    def __track_mapping(self, segment: LogSegment) -> None:
+        """Marks a segment as recently read, unmapping the least recently read ones."""
+        with self.__mapped_segments_lock:
+            self.__mapped_segments[segment.base_index] = segment
+            self.__mapped_segments.move_to_end(segment.base_index)
+            while len(self.__mapped_segments) > MAX_MAPPED_SEGMENTS:
+                _, unmapped_segment = self.__mapped_segments.popitem(last=False)
+                unmapped_segment.release_mapping()
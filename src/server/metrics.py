@@ -0,0 +1,271 @@
+"""Provides the in-process metrics registry and Prometheus endpoint for the Tumult server."""
+
+import bisect
+import logging
+import threading
+import weakref
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from typing import Optional, Callable
+
+PROMETHEUS_CONTENT_TYPE: str = "text/plain; version=0.0.4; charset=utf-8"
+METRICS_PATH: str = "/metrics"
+DEFAULT_METRICS_HOST: str = "127.0.0.1"
+DEFAULT_LATENCY_BUCKETS: tuple[float, ...] = (
+    0.0001,
+    0.00025,
+    0.0005,
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+)
+
+
+def _format_labels(labels: dict[str, str]) -> str:
+    """Returns labels in the Prometheus text format, or nothing if there are none."""
+    if not labels:
+        return ""
+    pairs: str = ",".join(f'{name}="{value}"' for name, value in labels.items())
+    return f"{{{pairs}}}"
+
+
+class _CellHolder:
+    """Thread-local holder of a thread's cell, released when the thread exits."""
+
+    __slots__ = ("cell", "__weakref__")
+
+    def __init__(self, cell: list[float]) -> None:
+        self.cell: list[float] = cell
+
+
+class _ThreadCells:
+    """
+    Per-thread cells of a metric, so updates never take a lock or race.
+    The lock is only taken the first time a thread updates the metric and
+    when the thread exits, which folds its cell into the retired totals.
+    """
+
+    def __init__(self, cell_size: int) -> None:
+        self.cell_size: int = cell_size
+        self.__local: threading.local = threading.local()
+        # Cells of the live threads by identity, as equal cells are not the same
+        self.__cells: dict[int, list[float]] = {}
+        self.__retired: list[float] = [0.0] * cell_size
+        self.__cells_lock: threading.Lock = threading.Lock()
+
+    def cell(self) -> list[float]:
+        """Returns the calling thread's cell, creating it on the first update."""
+        try:
+            return self.__local.holder.cell
+        except AttributeError:
+            cell: list[float] = [0.0] * self.cell_size
+            holder: _CellHolder = _CellHolder(cell)
+            with self.__cells_lock:
+                self.__cells[id(cell)] = cell
+            # Short-lived threads such as metrics requests would otherwise leak a cell
+            weakref.finalize(holder, self.__retire, cell)
+            self.__local.holder = holder
+            return cell
+
+    def __retire(self, cell: list[float]) -> None:
+        """Folds the cell of an exited thread into the retired totals."""
+        with self.__cells_lock:
+            del self.__cells[id(cell)]
+            for index, value in enumerate(cell):
+                self.__retired[index] += value
+
+    def totals(self) -> list[float]:
+        """Returns the sum of the retired totals and every live thread's cell."""
+        with self.__cells_lock:
+            cells: list[list[float]] = [self.__retired.copy(), *self.__cells.values()]
+        return [sum(values) for values in zip(*cells)]
+
+
+class Counter:
+    """Monotonically increasing count, such as requests received."""
+
+    metric_type: str = "counter"
+
+    def __init__(
+        self, name: str, description: str, labels: Optional[dict[str, str]] = None
+    ) -> None:
+        self.name: str = name
+        self.description: str = description
+        self.labels: dict[str, str] = labels or {}
+        self.__cells: _ThreadCells = _ThreadCells(1)
+
+    def increment(self, amount: float = 1) -> None:
+        """Adds to the count without taking a lock."""
+        self.__cells.cell()[0] += amount
+
+    @property
+    def value(self) -> float:
+        """Returns the current count."""
+        return self.__cells.totals()[0]
+
+    def samples(self) -> list[str]:
+        """Returns the metric's lines in the Prometheus text format."""
+        return [f"{self.name}{_format_labels(self.labels)} {self.value:g}"]
+
+
+class Gauge:
+    """Value that can go up and down, read from a callback whenever it is collected."""
+
+    metric_type: str = "gauge"
+
+    def __init__(
+        self,
+        name: str,
+        description: str,
+        function: Callable[[], float],
+        labels: Optional[dict[str, str]] = None,
+    ) -> None:
+        self.name: str = name
+        self.description: str = description
+        self.function: Callable[[], float] = function
+        self.labels: dict[str, str] = labels or {}
+
+    @property
+    def value(self) -> float:
+        """Returns the current value."""
+        return self.function()
+
+    def samples(self) -> list[str]:
+        """Returns the metric's lines in the Prometheus text format."""
+        return [f"{self.name}{_format_labels(self.labels)} {self.value:g}"]
+
+
+class Histogram:
+    """Distribution of observed values, such as durations, counted in buckets."""
+
+    metric_type: str = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        description: str,
+        buckets: tuple[float, ...] = DEFAULT_LATENCY_BUCKETS,
+        labels: Optional[dict[str, str]] = None,
+    ) -> None:
+        self.name: str = name
+        self.description: str = description
+        self.buckets: tuple[float, ...] = tuple(sorted(buckets))
+        self.labels: dict[str, str] = labels or {}
+        # One count per bucket, then the overflow bucket, the sum and the count
+        self.__cells: _ThreadCells = _ThreadCells(len(self.buckets) + 3)
+
+    def observe(self, value: float) -> None:
+        """Records a value without taking a lock."""
+        cell: list[float] = self.__cells.cell()
+        cell[bisect.bisect_left(self.buckets, value)] += 1
+        cell[-2] += value
+        cell[-1] += 1
+
+    def samples(self) -> list[str]:
+        """Returns the metric's cumulative bucket, sum and count lines in the Prometheus text format."""
+        totals: list[float] = self.__cells.totals()
+        lines: list[str] = []
+        cumulative_count: float = 0
+        for bound, count in zip((*self.buckets, float("inf")), totals):
+            cumulative_count += count
+            bucket_labels: dict[str, str] = {
+                **self.labels,
+                "le": "+Inf" if bound == float("inf") else f"{bound:g}",
+            }
+            lines.append(
+                f"{self.name}_bucket{_format_labels(bucket_labels)} {cumulative_count:g}"
+            )
+        lines.append(f"{self.name}_sum{_format_labels(self.labels)} {totals[-2]:g}")
+        lines.append(f"{self.name}_count{_format_labels(self.labels)} {totals[-1]:g}")
+        return lines
+
+
+Metric = Counter | Gauge | Histogram
+
+
+class MetricsRegistry:
+    """Collection of metrics rendered together in the Prometheus text format."""
+
+    def __init__(self) -> None:
+        self.metrics: list[Metric] = []
+
+    def counter(
+        self, name: str, description: str, labels: Optional[dict[str, str]] = None
+    ) -> Counter:
+        """Registers and returns a counter."""
+        return self.__register(Counter(name, description, labels))
+
+    def gauge(
+        self,
+        name: str,
+        description: str,
+        function: Callable[[], float],
+        labels: Optional[dict[str, str]] = None,
+    ) -> Gauge:
+        """Registers and returns a gauge read from a callback."""
+        return self.__register(Gauge(name, description, function, labels))
+
+    def histogram(
+        self,
+        name: str,
+        description: str,
+        buckets: tuple[float, ...] = DEFAULT_LATENCY_BUCKETS,
+        labels: Optional[dict[str, str]] = None,
+    ) -> Histogram:
+        """Registers and returns a histogram."""
+        return self.__register(Histogram(name, description, buckets, labels))
+
+    def render(self) -> str:
+        """Returns every metric in the Prometheus text format, grouped by name."""
+        lines: list[str] = []
+        described_names: set[str] = set()
+        for metric in sorted(self.metrics, key=lambda metric: metric.name):
+            if metric.name not in described_names:
+                described_names.add(metric.name)
+                lines.append(f"# HELP {metric.name} {metric.description}")
+                lines.append(f"# TYPE {metric.name} {metric.metric_type}")
+            lines.extend(metric.samples())
+        return "\n".join(lines) + "\n"
+
+    def serve(self, ipv4_address: str, port: int) -> ThreadingHTTPServer:
+        """Serves the metrics over HTTP from a background thread."""
+        registry: MetricsRegistry = self
+
+        class MetricsRequestHandler(BaseHTTPRequestHandler):
+            """Handler answering scrapes of the metrics path."""
+
+            def do_GET(self) -> None:
+                """Responds with the rendered metrics."""
+                if self.path.split("?", maxsplit=1)[0] != METRICS_PATH:
+                    self.send_error(404)
+                    return
+                body: bytes = registry.render().encode()
+                self.send_response(200)
+                self.send_header("Content-Type", PROMETHEUS_CONTENT_TYPE)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format: str, *args) -> None:
+                """Silences the per-request access log."""
+
+        http_server: ThreadingHTTPServer = ThreadingHTTPServer(
+            (ipv4_address, port), MetricsRequestHandler
+        )
+        http_server.daemon_threads = True
+        threading.Thread(target=http_server.serve_forever, daemon=True).start()
+        logging.info(
+            "Serving metrics at http://%s:%i%s", ipv4_address, port, METRICS_PATH
+        )
+        return http_server
+
+    def __register(self, metric: Metric) -> Metric:
+        """Adds a metric to the registry."""
+        self.metrics.append(metric)
+        return metric
@@ -0,0 +1,126 @@
+"""Provides the bounded outbound frame queue used for each Tumult client."""
+
+import threading
+from collections import deque
+from enum import Enum
+from typing import Optional, Iterator, Iterable
+
+from src.shared.protocol import TumultFrame
+
+DEFAULT_QUEUE_SIZE: int = 1024
+DEFAULT_COALESCE_LIMIT: int = 4 * 1024 * 1024
+
+# A run of frames, such as a history page, that is queued and dropped as one entry
+FrameBatch = tuple[TumultFrame, ...]
+
+
+class OverflowPolicy(Enum):
+    """Enum for the actions taken when a client's outbound queue is full."""
+
+    DROP_OLDEST = "drop-oldest"
+    COALESCE = "coalesce"
+    DISCONNECT = "disconnect"
+
+    def __str__(self) -> str:
+        """Returns the policy's command line name."""
+        return self.value
+
+
+def _flatten(entries: Iterable[TumultFrame | FrameBatch]) -> Iterator[TumultFrame]:
+    """Yields every frame of the queue entries in order."""
+    for entry in entries:
+        if isinstance(entry, TumultFrame):
+            yield entry
+        else:
+            yield from entry
+
+
+class OutboundQueue:
+    """Bounded queue of frames waiting to be written to one client."""
+
+    def __init__(
+        self,
+        max_frames: int = DEFAULT_QUEUE_SIZE,
+        policy: OverflowPolicy = OverflowPolicy.DROP_OLDEST,
+        coalesce_limit: int = DEFAULT_COALESCE_LIMIT,
+    ) -> None:
+        self.max_frames: int = max_frames
+        self.policy: OverflowPolicy = policy
+        self.coalesce_limit: int = coalesce_limit
+        self.__frames: deque[TumultFrame | FrameBatch] = deque()
+        self.__condition: threading.Condition = threading.Condition()
+        self.__closed: bool = False
+
+    def __len__(self) -> int:
+        """Returns the number of queued entries."""
+        return len(self.__frames)
+
+    @property
+    def closed(self) -> bool:
+        """Returns whether the queue has been closed."""
+        return self.__closed
+
+    def put(self, frame: TumultFrame | FrameBatch) -> Optional[OverflowPolicy]:
+        """
+        Queues a frame or batch of frames for the writer, applying the overflow policy
+        if the queue is full. Returns the policy that fired, or None if it was queued.
+        """
+        with self.__condition:
+            if self.__closed:
+                return None
+            fired_policy: Optional[OverflowPolicy] = None
+            if len(self.__frames) >= self.max_frames:
+                fired_policy = self.__apply_policy()
+                if fired_policy is OverflowPolicy.DISCONNECT:
+                    return fired_policy
+            self.__frames.append(frame)
+            self.__condition.notify()
+            return fired_policy
+
+    def take(self) -> list[TumultFrame]:
+        """Blocks until frames are queued then removes them all, or returns none if closed."""
+        with self.__condition:
+            while not self.__frames and not self.__closed:
+                self.__condition.wait()
+            return self.__take_all()
+
+    def take_nowait(self) -> list[TumultFrame]:
+        """Removes and returns every queued frame without blocking."""
+        with self.__condition:
+            return self.__take_all()
+
+    def close(self) -> None:
+        """Closes the queue, discarding queued frames and waking the writer."""
+        with self.__condition:
+            self.__closed = True
+            self.__frames.clear()
+            self.__condition.notify_all()
+
+    def __take_all(self) -> list[TumultFrame]:
+        """Removes and returns every queued frame, the caller must hold the lock."""
+        frames: list[TumultFrame] = list(_flatten(self.__frames))
+        self.__frames.clear()
+        return frames
+
+    def __apply_policy(self) -> OverflowPolicy:
+        """Makes room in a full queue, the caller must hold the lock."""
+        if self.policy is OverflowPolicy.DROP_OLDEST:
+            self.__frames.popleft()
+            return OverflowPolicy.DROP_OLDEST
+
+        if self.policy is OverflowPolicy.COALESCE:
+            queued_frames: list[TumultFrame] = list(_flatten(self.__frames))
+            coalesced_length: int = sum(len(frame) for frame in queued_frames)
+            if coalesced_length <= self.coalesce_limit:
+                # One contiguous frame holding every queued frame's bytes in order
+                coalesced: bytes = b"".join(
+                    buffer
+                    for frame in queued_frames
+                    for buffer in (frame.header, frame.contents)
+                )
+                self.__frames.clear()
+                self.__frames.append(TumultFrame(coalesced))
+                return OverflowPolicy.COALESCE
+
+        self.close()
+        return OverflowPolicy.DISCONNECT
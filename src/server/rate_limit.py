@@ -0,0 +1,105 @@
+"""Provides the token buckets used to rate limit Tumult clients and connections."""
+
+import time
+from enum import Enum
+from typing import Optional
+
+
+class RateLimitPolicy(Enum):
+    """Enum for the actions taken when a client sends faster than its rate limit."""
+
+    THROTTLE = "throttle"
+    DROP = "drop"
+    DISCONNECT = "disconnect"
+
+    def __str__(self) -> str:
+        """Returns the policy's command line name."""
+        return self.value
+
+
+class TokenBucket:
+    """
+    Bucket refilled with tokens at a constant rate up to one second's worth.
+    Taking more tokens than the bucket holds leaves it in debt, so a single
+    large request is delayed rather than refused forever.
+    """
+
+    def __init__(self, rate: float, start_time: Optional[float] = None) -> None:
+        self.rate: float = rate
+        self.capacity: float = max(rate, 1.0)
+        self.tokens: float = self.capacity
+        self.__last_refill: float = (
+            start_time if start_time is not None else time.monotonic()
+        )
+
+    def take(self, amount: float = 1.0, now: Optional[float] = None) -> float:
+        """
+        Takes tokens from the bucket and returns the seconds until the bucket is out
+        of debt again, which is 0 if there were enough tokens.
+        """
+        self.__refill(now)
+        self.tokens -= amount
+        return max(-self.tokens / self.rate, 0.0)
+
+    def try_take(self, amount: float = 1.0, now: Optional[float] = None) -> bool:
+        """Takes tokens from the bucket only if it holds enough, returning whether it did."""
+        self.__refill(now)
+        if self.tokens < amount:
+            return False
+        self.tokens -= amount
+        return True
+
+    def give_back(self, amount: float = 1.0) -> None:
+        """Returns tokens to the bucket that were taken for a refused request."""
+        self.tokens = min(self.tokens + amount, self.capacity)
+
+    def __refill(self, now: Optional[float]) -> None:
+        """Adds the tokens accumulated since the last refill, up to the capacity."""
+        now = now if now is not None else time.monotonic()
+        self.tokens = min(
+            self.tokens + (now - self.__last_refill) * self.rate, self.capacity
+        )
+        self.__last_refill = now
+
+
+class RateLimiter:
+    """Request and byte rate limits of one client, either of which may be unlimited."""
+
+    def __init__(
+        self, request_rate: Optional[float], byte_rate: Optional[float]
+    ) -> None:
+        self.requests: Optional[TokenBucket] = (
+            TokenBucket(request_rate) if request_rate is not None else None
+        )
+        self.bytes: Optional[TokenBucket] = (
+            TokenBucket(byte_rate) if byte_rate is not None else None
+        )
+
+    def take(self, size: float, now: Optional[float] = None) -> float:
+        """
+        Takes the tokens for a request of the provided size from both buckets and
+        returns the seconds the request has to wait to stay within both limits.
+        """
+        now = now if now is not None else time.monotonic()
+        delay: float = 0.0
+        if self.requests is not None:
+            delay = max(delay, self.requests.take(1, now))
+        if self.bytes is not None:
+            delay = max(delay, self.bytes.take(size, now))
+        return delay
+
+    def capped_size(self, size: int) -> float:
+        """
+        Returns a request's size capped to a full byte bucket, so that a request
+        larger than the byte rate can still be admitted once the bucket is full.
+        """
+        if self.bytes is None:
+            return size
+        return min(size, self.bytes.capacity)
+
+    def give_back(self, size: float) -> None:
+        """Returns the tokens taken for a request that was refused."""
+        if self.requests is not None:
+            self.requests.give_back(1)
+        if self.bytes is not None:
+            self.bytes.give_back(size)
@@ -0,0 +1,131 @@
+"""Provides the chat rooms hosted by a Tumult server."""
+
+import threading
+from typing import Optional, Callable
+
+from src.server.client_registry import ClientInfo, ClientSet
+from src.server.message_history import MessageHistory, MessageLog
+from src.server.search_index import SearchIndex
+from src.shared.protocol import valid_room_name
+
+DEFAULT_MAX_ROOMS: int = 1024
+
+
+class Room:
+    """Named conversation with its own members, message history and search index."""
+
+    def __init__(
+        self,
+        name: str,
+        history: MessageHistory | MessageLog,
+        search_index: Optional[SearchIndex] = None,
+    ) -> None:
+        self.name: str = name
+        self.members: ClientSet = ClientSet()
+        self.message_history: MessageHistory | MessageLog = history
+        self.search_index: Optional[SearchIndex] = search_index
+        # Held from numbering a message to queueing it, so members get it in order
+        self.delivery_lock: threading.Lock = threading.Lock()
+
+    def __str__(self) -> str:
+        """Returns the room's name."""
+        return self.name
+
+
+class RoomRegistry:
+    """
+    Rooms of a server by name, each created on first use. Clients can only create
+    rooms up to a maximum number. Rooms with a logged history are kept once they are
+    empty, so their history is still there for the next members, while empty rooms
+    with an in-memory history are evicted unless eviction is off. Each room's
+    history is indexed for searching unless search is off.
+    """
+
+    def __init__(
+        self,
+        history_factory: Callable[[str], MessageHistory | MessageLog],
+        search: bool = True,
+        max_rooms: Optional[int] = DEFAULT_MAX_ROOMS,
+    ) -> None:
+        self.history_factory: Callable[[str], MessageHistory | MessageLog] = (
+            history_factory
+        )
+        self.search: bool = search
+        self.max_rooms: Optional[int] = max_rooms
+        self.evict_empty_rooms: bool = True
+        self.__rooms: dict[str, Room] = {}
+        self.__lock: threading.Lock = threading.Lock()
+
+    def __len__(self) -> int:
+        """Returns the number of rooms."""
+        return len(self.__rooms)
+
+    def get(self, name: str) -> Optional[Room]:
+        """Returns the room with a name, or None if it has not been created."""
+        return self.__rooms.get(name)
+
+    def room(self, name: str) -> Room:
+        """Returns the room with a name, creating it if needed."""
+        room: Optional[Room] = self.__rooms.get(name)
+        if room is None:
+            with self.__lock:
+                room = self.__rooms.get(name) or self.__create(name)
+        return room
+
+    def join(self, name: str, client: ClientInfo) -> Optional[Room]:
+        """
+        Adds a client to a room's members, creating the room if needed, or returns
+        None if the room does not exist and there are already as many as allowed.
+        """
+        with self.__lock:
+            room: Optional[Room] = self.__rooms.get(name)
+            if room is None:
+                if self.max_rooms is not None and len(self.__rooms) >= self.max_rooms:
+                    return None
+                room = self.__create(name)
+            # Added under the lock so that the room cannot be evicted in between
+            room.members.add(client)
+        client.rooms.add(name)
+        return room
+
+    def leave(self, name: str, client: ClientInfo) -> Optional[Room]:
+        """Removes a client from a room's members, returning the room if it was a member."""
+        room: Optional[Room] = self.__rooms.get(name)
+        client.rooms.discard(name)
+        if room is None or not room.members.remove(client):
+            return None
+        return room
+
+    def evict_if_empty(self, name: str) -> None:
+        """Evicts a room with an in-memory history once its last member has left."""
+        if not self.evict_empty_rooms:
+            return
+        with self.__lock:
+            room: Optional[Room] = self.__rooms.get(name)
+            if (
+                room is not None
+                and not len(room.members)
+                and isinstance(room.message_history, MessageHistory)
+            ):
+                del self.__rooms[name]
+
+    def __create(self, name: str) -> Room:
+        """Creates and registers a room, raising ValueError for an invalid name."""
+        # Room names become directory names of the rooms' message logs
+        if not valid_room_name(name):
+            raise ValueError(f"Invalid room name {name!r}")
+        history: MessageHistory | MessageLog = self.history_factory(name)
+        room: Room = Room(
+            name,
+            history,
+            SearchIndex.from_history(history) if self.search else None,
+        )
+        self.__rooms[name] = room
+        return room
+
+    def close(self) -> None:
+        """Closes the message history of every room."""
+        with self.__lock:
+            rooms: list[Room] = list(self.__rooms.values())
+        for room in rooms:
+            room.message_history.close()
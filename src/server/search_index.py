@@ -0,0 +1,136 @@
+"""Provides the inverted index used to search Tumult message histories."""
+
+import bisect
+import re
+import threading
+from array import array
+from typing import Optional, Iterable
+
+from src.server.message_history import Message
+from src.shared.protocol import RequestType
+
+TOKEN_PATTERN: re.Pattern = re.compile(r"\w+")
+MAX_TOKEN_LENGTH: int = 64
+MAX_QUERY_TERMS: int = 8
+# Bounds the work of one search, which otherwise grows with the terms' postings
+MAX_SEARCH_STEPS: int = 2048
+
+
+def _seek(positions: array, target: int, stop: int) -> int:
+    """
+    Returns the number of positions before stop that are at most target, galloping
+    back from stop so that nearby targets cost a few comparisons.
+    """
+    high: int = stop
+    step: int = 1
+    low: int = high - step
+    while low > 0 and positions[low] > target:
+        high = low
+        step *= 2
+        low = high - step
+    return bisect.bisect_right(positions, target, max(low, 0), high)
+
+
+def tokenize(text: Optional[str]) -> set[str]:
+    """Returns the distinct case-folded words of a text, each cut to the maximum length."""
+    if not text:
+        return set()
+    return {
+        token.casefold()[:MAX_TOKEN_LENGTH] for token in TOKEN_PATTERN.findall(text)
+    }
+
+
+class SearchIndex:
+    """
+    Inverted index from each word of the chat messages in a history, and of their
+    senders' nicknames, to the sorted positions of the messages containing it.
+    A search leapfrogs through every term's positions from the newest message down,
+    each term galloping to the next candidate proposed by the others, so it never
+    scans the history and skips over runs of positions only some terms contain.
+    """
+
+    def __init__(self) -> None:
+        self.__postings: dict[str, array] = {}
+        self.__length: int = 0
+        self.__lock: threading.Lock = threading.Lock()
+
+    @classmethod
+    def from_history(cls, messages: Iterable[Message]) -> "SearchIndex":
+        """Creates an index of the messages already in a history."""
+        search_index: SearchIndex = cls()
+        for position, message in enumerate(messages):
+            search_index.add(position, message)
+        return search_index
+
+    def __len__(self) -> int:
+        """Returns the number of indexed messages."""
+        return self.__length
+
+    def add(self, position: int, message: Message) -> None:
+        """Indexes a chat message at its position in the history, ignoring joins and leaves."""
+        if message.message_type != RequestType.MESSAGE:
+            return
+        tokens: set[str] = tokenize(message.contents) | tokenize(message.nickname)
+        with self.__lock:
+            for token in tokens:
+                positions: Optional[array] = self.__postings.get(token)
+                if positions is None:
+                    self.__postings[token] = array("I", (position,))
+                elif positions[-1] < position:
+                    positions.append(position)
+                else:
+                    # Concurrent deliveries can finish indexing out of order
+                    positions.insert(bisect.bisect_left(positions, position), position)
+            self.__length += 1
+
+    def search(
+        self, query: str, limit: int, before: Optional[int] = None
+    ) -> tuple[list[int], Optional[int]]:
+        """
+        Returns the positions of at most limit messages before a position, newest
+        first, that contain every word of the query in their contents or nickname,
+        and the position to search before for the next page, or None if there are
+        no more. A search that runs out of steps returns the hits found so far with
+        the position it stopped at, so every page takes bounded time.
+        """
+        terms: list[str] = sorted(tokenize(query))[:MAX_QUERY_TERMS]
+        if not terms or limit <= 0 or (before is not None and before <= 0):
+            return [], None
+        # Positions are appended, or inserted near the end by deliveries finishing out
+        # of order, so searching a snapshot of the lengths without the lock at worst
+        # misses a message being indexed, and deliveries are not held up meanwhile
+        with self.__lock:
+            term_postings: list[Optional[array]] = [
+                self.__postings.get(term) for term in terms
+            ]
+            if any(positions is None for positions in term_postings):
+                return [], None
+            postings: list[array] = sorted(term_postings, key=len)
+            stops: list[int] = [len(positions) for positions in postings]
+
+        hits: list[int] = []
+        candidate: int = before - 1 if before is not None else postings[0][-1]
+        steps: int = 0
+        while len(hits) < limit:
+            matched: int = 0
+            term_index: int = 0
+            while matched < len(postings):
+                if steps == MAX_SEARCH_STEPS:
+                    return hits, candidate + 1
+                steps += 1
+                positions: array = postings[term_index]
+                stops[term_index] = _seek(positions, candidate, stops[term_index])
+                if stops[term_index] == 0:
+                    return hits, None
+                found: int = positions[stops[term_index] - 1]
+                if found == candidate:
+                    matched += 1
+                else:
+                    candidate = found
+                    matched = 1
+                term_index = (term_index + 1) % len(postings)
+            hits.append(candidate)
+            if candidate == 0:
+                return hits, None
+            candidate -= 1
+        return hits, hits[-1]
@@ -0,0 +1,208 @@
+"""Provides the multi-process sharded server for Tumult."""
+
+import logging
+import multiprocessing
+import os
+import shutil
+import signal
+import socket
+import sys
+import tempfile
+import threading
+import time
+from dataclasses import replace
+from typing import Optional
+
+from src.server.message_history import Message
+from src.server.tumult_server import TumultServer, ServerConfig
+from src.shared.logging import DATETIME_FORMAT, LOG_FORMAT
+from src.shared.protocol import TumultSocket, PROTOCOL_VERSION
+
+BUS_SOCKET_NAME: str = "bus.sock"
+
+
+class ShardBusHub:
+    """Relays messages between shard workers so every shard delivers them in one order."""
+
+    def __init__(self, bus_path: str, workers: int) -> None:
+        self.bus_path: str = bus_path
+        self.workers: int = workers
+        self.socket: TumultSocket = TumultSocket(
+            socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        )
+        self.shard_sockets: list[TumultSocket] = []
+        self.relay_lock: threading.Lock = threading.Lock()
+        self.socket.raw_socket.bind(bus_path)
+        self.socket.listen()
+
+    def start(self) -> None:
+        """Waits for every shard worker to connect then relays their messages."""
+        while len(self.shard_sockets) < self.workers:
+            shard_socket, _ = self.socket.accept()
+            bus_socket: TumultSocket = TumultSocket(shard_socket)
+            bus_socket.protocol_version = PROTOCOL_VERSION
+            self.shard_sockets.append(bus_socket)
+        logging.info("All %i shards connected to the bus", self.workers)
+
+        for shard_socket in self.shard_sockets:
+            relay_thread: threading.Thread = threading.Thread(
+                target=self._relay_messages, args=[shard_socket], daemon=True
+            )
+            relay_thread.start()
+
+    def close(self) -> None:
+        """Closes the bus and every shard connection."""
+        for shard_socket in self.shard_sockets:
+            shard_socket.close()
+        self.socket.close()
+
+    def _relay_messages(self, shard_socket: TumultSocket) -> None:
+        """
+        Forwards each message published by a shard to all shards, including itself,
+        dropping any shard that can no longer be written to.
+        """
+        while True:
+            try:
+                request: TumultSocket.Request = shard_socket.read_request()
+            except (ConnectionError, OSError) as error:
+                logging.error("Shard disconnected from the bus: %s", error)
+                with self.relay_lock:
+                    self._remove_shard(shard_socket)
+                return
+
+            message: Message = Message.from_request(request)
+            with self.relay_lock:
+                for relay_socket in self.shard_sockets.copy():
+                    try:
+                        message.write_to(relay_socket)
+                    except OSError as error:
+                        logging.error("Writing to a shard on the bus failed: %s", error)
+                        self._remove_shard(relay_socket)
+
+    def _remove_shard(self, shard_socket: TumultSocket) -> None:
+        """Stops relaying to a shard and closes its connection, holding the relay lock."""
+        if shard_socket in self.shard_sockets:
+            self.shard_sockets.remove(shard_socket)
+            shard_socket.close()
+
+
+class ShardBusClient:
+    """Connection from a shard worker to the hub, used as its server's relay."""
+
+    def __init__(self, bus_path: str, server: TumultServer) -> None:
+        self.server: TumultServer = server
+        self.socket: TumultSocket = TumultSocket(
+            socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        )
+        self.socket.protocol_version = PROTOCOL_VERSION
+        self.write_lock: threading.Lock = threading.Lock()
+        self.socket.raw_socket.connect(bus_path)
+
+    def publish(self, message: Message) -> None:
+        """Sends a message to the hub, which relays it back to every shard."""
+        with self.write_lock:
+            message.write_to(self.socket)
+
+    def start(self) -> None:
+        """Starts delivering relayed messages to the server's clients."""
+        bus_thread: threading.Thread = threading.Thread(
+            target=self._receive_messages, daemon=True
+        )
+        bus_thread.start()
+
+    def _receive_messages(self) -> None:
+        """Delivers every message relayed by the hub to the local clients."""
+        while True:
+            try:
+                request: TumultSocket.Request = self.socket.read_request()
+            except (ConnectionError, OSError) as error:
+                logging.error("Lost connection to the shard bus: %s", error)
+                return
+
+            message: Message = Message.from_request(request)
+            self.server.run_threadsafe(self.server.deliver_message, message)
+
+
+def _run_shard_worker(
+    server_class: type[TumultServer],
+    ipv4_address: str,
+    port: int,
+    config: ServerConfig,
+    bus_path: str,
+    shard: int,
+) -> None:
+    """Runs one server shard accepting on the shared port and relaying through the bus."""
+    logging.basicConfig(
+        level=logging.INFO,
+        format=LOG_FORMAT,
+        datefmt=DATETIME_FORMAT,
+    )
+
+    # Every shard keeps its own copy of the history, so each needs its own log
+    history_directory: Optional[str] = (
+        os.path.join(config.history_directory, f"shard{shard}")
+        if config.history_directory is not None
+        else None
+    )
+    # Each shard serves its own metrics on the port after the previous shard's
+    metrics_port: Optional[int] = (
+        config.metrics_port + shard if config.metrics_port is not None else None
+    )
+    server: TumultServer = server_class(
+        ipv4_address,
+        port,
+        replace(
+            config,
+            reuse_port=True,
+            history_directory=history_directory,
+            metrics_port=metrics_port,
+            shard=shard,
+        ),
+    )
+    # Every shard must keep the same rooms for their histories to stay identical
+    server.rooms.evict_empty_rooms = False
+    bus_client: ShardBusClient = ShardBusClient(bus_path, server)
+    server.relay = bus_client.publish
+    bus_client.start()
+    server.start()
+
+
+def start_sharded_server(
+    server_class: type[TumultServer],
+    ipv4_address: str,
+    port: int,
+    config: ServerConfig,
+    workers: int,
+) -> None:
+    """Starts server shards in worker processes that share the port and a message bus."""
+    bus_directory: str = tempfile.mkdtemp(prefix="tumult-")
+    bus_path: str = os.path.join(bus_directory, BUS_SOCKET_NAME)
+    # Shards share one epoch so a client resumes from any shard after a reconnect
+    if config.history_epoch is None:
+        config = replace(config, history_epoch=time.time_ns())
+    hub: ShardBusHub = ShardBusHub(bus_path, workers)
+
+    processes: list[multiprocessing.Process] = [
+        multiprocessing.Process(
+            target=_run_shard_worker,
+            args=(server_class, ipv4_address, port, config, bus_path, shard + 1),
+            name=f"TumultShard{shard + 1}",
+        )
+        for shard in range(workers)
+    ]
+    logging.info("Starting %i server shards", workers)
+    for process in processes:
+        process.start()
+
+    # Raise SystemExit on termination so the shards are stopped with the hub
+    signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
+
+    try:
+        hub.start()
+        for process in processes:
+            process.join()
+    finally:
+        for process in processes:
+            process.terminate()
+        hub.close()
+        shutil.rmtree(bus_directory, ignore_errors=True)
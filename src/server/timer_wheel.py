@@ -0,0 +1,86 @@
+"""Provides the hashed timer wheel used to schedule Tumult client deadlines."""
+
+import math
+import threading
+import time
+from typing import Optional, Hashable, Any
+
+DEFAULT_TICK: float = 1.0
+DEFAULT_WHEEL_SLOTS: int = 64
+
+
+class TimerWheel:
+    """
+    Timers held in a ring of slots that a cursor advances through once per tick.
+    Scheduling and cancelling take constant time, and each tick only visits the
+    timers in one slot, so tracking many deadlines costs no threads or sorting.
+    Timers further away than one turn of the wheel wait out the extra turns.
+    """
+
+    def __init__(
+        self,
+        tick: float = DEFAULT_TICK,
+        slots: int = DEFAULT_WHEEL_SLOTS,
+        start_time: Optional[float] = None,
+    ) -> None:
+        self.tick: float = tick
+        # Each slot maps a timer's key to its remaining turns and its value
+        self.__slots: list[dict[Hashable, tuple[int, Any]]] = [
+            {} for _ in range(slots)
+        ]
+        self.__positions: dict[Hashable, int] = {}
+        self.__cursor: int = 0
+        self.__next_tick: float = (
+            start_time if start_time is not None else time.monotonic()
+        ) + tick
+        self.__lock: threading.Lock = threading.Lock()
+
+    def __len__(self) -> int:
+        """Returns the number of scheduled timers."""
+        return len(self.__positions)
+
+    def __contains__(self, key: Hashable) -> bool:
+        """Returns whether a timer is scheduled under the key."""
+        return key in self.__positions
+
+    def schedule(self, key: Hashable, delay: float, value: Any) -> None:
+        """
+        Schedules a timer to expire with the value after at least the delay in seconds,
+        replacing any timer already scheduled under the key.
+        """
+        ticks: int = max(math.ceil(delay / self.tick), 1)
+        slot_count: int = len(self.__slots)
+        with self.__lock:
+            self.__cancel(key)
+            position: int = (self.__cursor + ticks) % slot_count
+            self.__slots[position][key] = ((ticks - 1) // slot_count, value)
+            self.__positions[key] = position
+
+    def cancel(self, key: Hashable) -> None:
+        """Removes the timer scheduled under the key, if there is one."""
+        with self.__lock:
+            self.__cancel(key)
+
+    def advance(self, now: Optional[float] = None) -> list[Any]:
+        """Moves the cursor over every tick that has passed, returning the expired values."""
+        now = now if now is not None else time.monotonic()
+        expired: list[Any] = []
+        with self.__lock:
+            while now >= self.__next_tick:
+                self.__cursor = (self.__cursor + 1) % len(self.__slots)
+                self.__next_tick += self.tick
+                slot: dict[Hashable, tuple[int, Any]] = self.__slots[self.__cursor]
+                for key, (turns, value) in list(slot.items()):
+                    if turns:
+                        slot[key] = (turns - 1, value)
+                        continue
+                    del slot[key]
+                    del self.__positions[key]
+                    expired.append(value)
+        return expired
+
+    def __cancel(self, key: Hashable) -> None:
+        """Removes the timer scheduled under the key, the caller must hold the lock."""
+        position: Optional[int] = self.__positions.pop(key, None)
+        if position is not None:
+            del self.__slots[position][key]
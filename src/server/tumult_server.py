@@ -1,57 +1,175 @@
 """Provides the server implementation for Tumult."""
 
+import itertools
 import logging
+import os
 import socket
+import struct
 import threading
+import time
+import zlib
 from dataclasses import dataclass
-from typing import Optional
+from http.server import ThreadingHTTPServer
+from typing import Optional, Callable, Any, Iterator
 
+from src.server.client_registry import ClientInfo, ClientRegistry, Transfer
+from src.server.message_history import (
+    Message,
+    MessageHistory,
+    MessageLog,
+    DEFAULT_SEGMENT_SIZE,
+    DEFAULT_FSYNC_BATCH,
+    DEFAULT_FSYNC_INTERVAL,
+)
+from src.server.metrics import (
+    MetricsRegistry,
+    Counter,
+    Histogram,
+    DEFAULT_METRICS_HOST,
+)
+from src.server.outbound_queue import (
+    FrameBatch,
+    OutboundQueue,
+    OverflowPolicy,
+    DEFAULT_QUEUE_SIZE,
+)
+from src.server.rate_limit import RateLimitPolicy, RateLimiter, TokenBucket
+from src.server.rooms import Room, RoomRegistry, DEFAULT_MAX_ROOMS
+from src.server.search_index import SearchIndex
+from src.server.timer_wheel import TimerWheel, DEFAULT_TICK
 from src.shared.protocol import (
     TumultSocket,
+    TumultFrame,
+    TumultWriter,
+    FrameTooLargeError,
     RequestType,
     ENCODING_FORMAT,
+    LEGACY_PROTOCOL_VERSION,
+    COMPRESSION_DEFLATE,
+    HEARTBEAT_OPTION,
+    RESUME_OPTION,
+    EPOCH_OPTION,
+    batch_requests,
+    transfer_chunk,
+    decode_json_body,
+    negotiate_version,
+    valid_room_name,
 )
 
-
-@dataclass
-class ClientInfo:
-    """Container for client connection information."""
-
-    ipv4_address: str
-    port: int
-    socket: TumultSocket
-    nickname: Optional[str] = None
-
-    def __str__(self) -> str:
-        """Returns a string representation of the socket address in address:port format."""
-        return f"{self.ipv4_address}:{self.port}"
-
-    @property
-    def socket_address(self) -> tuple[str, int]:
-        """Returns the socket address as a tuple."""
-        return self.ipv4_address, self.port
+DEFAULT_HISTORY_PAGE_SIZE: int = 200
+MAX_HISTORY_PAGE_SIZE: int = 1000
+DEFAULT_SEARCH_PAGE_SIZE: int = 20
+DEFAULT_BATCH_WINDOW: float = 0.0
+DEFAULT_COMPRESSION_THRESHOLD: int = 1024
+ROOMS_DIRECTORY_NAME: str = "rooms"
+DEFAULT_MAX_FRAME_SIZE: int = 1024 * 1024
+MAX_TRANSFERS_PER_CLIENT: int = 8
+# Raised by headers, request types and bodies a client could not have encoded
+MALFORMED_REQUEST_ERRORS: tuple[type[Exception], ...] = (
+    ValueError,
+    UnicodeDecodeError,
+    KeyError,
+    struct.error,
+)
+DEFAULT_HEARTBEAT_INTERVAL: float = 15.0
+DEFAULT_IDLE_TIMEOUT: float = 45.0
 
 
 @dataclass
-class Message:
-    """Container for chat messages with the message type and sender nickname."""
+class ServerConfig:
+    """Container for tunable server settings."""
 
-    nickname: Optional[str]
-    contents: str
-    message_type: RequestType = RequestType.MESSAGE
+    reuse_port: bool = False
+    queue_size: int = DEFAULT_QUEUE_SIZE
+    overflow_policy: OverflowPolicy = OverflowPolicy.DROP_OLDEST
+    history_directory: Optional[str] = None
+    history_epoch: Optional[int] = None
+    segment_size: int = DEFAULT_SEGMENT_SIZE
+    fsync_batch: int = DEFAULT_FSYNC_BATCH
+    fsync_interval: float = DEFAULT_FSYNC_INTERVAL
+    history_page_size: int = DEFAULT_HISTORY_PAGE_SIZE
+    max_history_page_size: int = MAX_HISTORY_PAGE_SIZE
+    batch_window: float = DEFAULT_BATCH_WINDOW
+    compression: bool = True
+    compression_threshold: int = DEFAULT_COMPRESSION_THRESHOLD
+    search: bool = True
+    metrics_host: str = DEFAULT_METRICS_HOST
+    metrics_port: Optional[int] = None
+    heartbeat_interval: float = DEFAULT_HEARTBEAT_INTERVAL
+    idle_timeout: float = DEFAULT_IDLE_TIMEOUT
+    max_frame_size: int = DEFAULT_MAX_FRAME_SIZE
+    request_rate: Optional[float] = None
+    byte_rate: Optional[float] = None
+    rate_limit_policy: RateLimitPolicy = RateLimitPolicy.THROTTLE
+    max_connections: Optional[int] = None
+    max_rooms: Optional[int] = DEFAULT_MAX_ROOMS
+    accept_rate: Optional[float] = None
+    node_id: Optional[str] = None
+    federation_port: Optional[int] = None
+    peers: tuple[tuple[str, int], ...] = ()
+    handoff_path: Optional[str] = None
+    shard: Optional[int] = None
 
 
 class TumultServer:
     """Server implementation for Tumult."""
 
-    def __init__(self, ipv4_address: str, port: int) -> None:
+    def __init__(
+        self,
+        ipv4_address: str,
+        port: int,
+        config: Optional[ServerConfig] = None,
+        listening_socket: Optional[socket.socket] = None,
+    ) -> None:
         self.ipv4_address: str = ipv4_address
         self.port: int = port
-        self.socket: TumultSocket = TumultSocket()
-        self.clients: list[ClientInfo] = []
-        self.message_history: list[Message] = []
+        self.config: ServerConfig = config if config is not None else ServerConfig()
+        # A socket handed over by a previous server is already bound and listening
+        self.socket: TumultSocket = TumultSocket(listening_socket)
+        self.clients: ClientRegistry = ClientRegistry()
+        self.message_history: MessageHistory | MessageLog = self._create_history(
+            self.config.history_directory
+        )
+        self.search_index: Optional[SearchIndex] = (
+            SearchIndex.from_history(self.message_history)
+            if self.config.search
+            else None
+        )
+        # Held from numbering a message to queueing it, so clients get it in order
+        self.delivery_lock: threading.Lock = threading.Lock()
+        self.rooms: RoomRegistry = RoomRegistry(
+            self._create_room_history, self.config.search, self.config.max_rooms
+        )
+        self.relay: Optional[Callable[[Message], None]] = None
+        self.federate: Optional[Callable[[Message], None]] = None
+        # Deadlines of every client's next liveness check, unless idle detection is off
+        self.liveness_checks: Optional[TimerWheel] = (
+            TimerWheel(min(DEFAULT_TICK, self.config.heartbeat_interval))
+            if self.config.idle_timeout > 0
+            else None
+        )
+        self.transfer_ids: Iterator[int] = itertools.count(1)
+        self.accepts: Optional[TokenBucket] = (
+            TokenBucket(self.config.accept_rate)
+            if self.config.accept_rate is not None
+            else None
+        )
+        self.metrics: MetricsRegistry = MetricsRegistry()
+        self.metrics_server: Optional[ThreadingHTTPServer] = None
+        self._register_metrics()
+        if listening_socket is not None:
+            return
 
         try:
+            # Lets a restarted server bind while old connections are in TIME_WAIT
+            if os.name != "nt":
+                self.socket.raw_socket.setsockopt(
+                    socket.SOL_SOCKET, socket.SO_REUSEADDR, 1
+                )
+            if self.config.reuse_port:
+                self.socket.raw_socket.setsockopt(
+                    socket.SOL_SOCKET, socket.SO_REUSEPORT, 1
+                )
             self.socket.bind((ipv4_address, port))
         except socket.error as error:
             logging.error(
@@ -71,147 +189,1026 @@ class TumultServer:
         return self.ipv4_address, self.port
 
     @property
-    def client_sockets(self) -> list[TumultSocket]:
+    def client_sockets(self) -> list[TumultWriter]:
         """Returns the current list of client socket connections."""
-        return [client.socket for client in self.clients]
+        return [client.socket for client in self.clients.snapshot()]
 
     @property
     def client_nicknames(self) -> list[Optional[str]]:
         """Returns the current list of client nicknames."""
-        return [client.nickname for client in self.clients]
+        return [client.nickname for client in self.clients.snapshot()]
 
     @property
     def client_ipv4_addresses(self) -> list[str]:
         """Returns the current list of client addresses."""
-        return [client.ipv4_address for client in self.clients]
+        return [client.ipv4_address for client in self.clients.snapshot()]
 
     def start(self) -> None:
         """Starts listening for and accepting client connections."""
         logging.info("Listening at %s", self)
         self.socket.listen()
+        self._start_metrics_endpoint()
+        self._start_liveness_checks()
         self._handle_client_connections()
 
-    def broadcast_message(self, nickname: Optional[str], contents: str) -> None:
-        """Sends a message to all connected clients."""
-        message = Message(nickname, contents, RequestType.MESSAGE)
-        self.message_history.append(message)
-        logging.info("%s says %s", message.nickname, message.contents)
-        for client_socket in self.client_sockets:
-            client_socket.write_message(message.nickname, message.contents)
-
-    def broadcast_join_message(self, nickname: Optional[str]) -> None:
-        """Sends a join to all connected clients."""
-        message = Message(nickname, "joined", RequestType.JOIN_MESSAGE)
-        self.message_history.append(message)
-        logging.info("%s joined", nickname)
-        for client_socket in self.client_sockets:
-            client_socket.write_join_message(nickname)
-
-    def broadcast_leave_message(self, nickname: Optional[str]) -> None:
-        """Sends a leave to all connected clients."""
-        message = Message(nickname, "left", RequestType.LEAVE_MESSAGE)
-        self.message_history.append(message)
-        logging.info("%s left", nickname)
-        for client_socket in self.client_sockets:
-            client_socket.write_leave_message(nickname)
-
-    def send_message_history(self, client: ClientInfo) -> None:
-        """Sends all previous messages to a client."""
-        client_socket = client.socket
-        for message in self.message_history:
-            match message.message_type:
-                case RequestType.MESSAGE:
-                    client_socket.write_message(message.nickname, message.contents)
-                case RequestType.JOIN_MESSAGE:
-                    client_socket.write_join_message(message.nickname)
-                case RequestType.LEAVE_MESSAGE:
-                    client_socket.write_leave_message(message.nickname)
+    def broadcast_message(
+        self, nickname: Optional[str], contents: str, room: Optional[str] = None
+    ) -> None:
+        """Sends a message to all connected clients, or to the members of a room."""
+        self._publish(Message(nickname, contents, RequestType.MESSAGE, room=room))
+
+    def broadcast_join_message(
+        self, nickname: Optional[str], room: Optional[str] = None
+    ) -> None:
+        """Sends a join to all connected clients, or to the members of a room."""
+        self._publish(Message(nickname, "joined", RequestType.JOIN_MESSAGE, room=room))
+
+    def broadcast_leave_message(
+        self, nickname: Optional[str], room: Optional[str] = None
+    ) -> None:
+        """Sends a leave to all connected clients, or to the members of a room."""
+        self._publish(Message(nickname, "left", RequestType.LEAVE_MESSAGE, room=room))
+
+    def deliver_message(self, message: Message) -> None:
+        """
+        Records a message in the history of the server or its room,
+        then writes it to every local client or room member. Messages of the
+        same history are queued for the clients in the order they are numbered,
+        so that the last sequence number a client received is a safe point to
+        resume from.
+        """
+        delivery_start: float = time.perf_counter()
+        history: MessageHistory | MessageLog = self.message_history
+        search_index: Optional[SearchIndex] = self.search_index
+        delivery_lock: threading.Lock = self.delivery_lock
+        room_suffix: str = ""
+        room: Optional[Room] = None
+        if message.room is not None:
+            room = self.rooms.room(message.room)
+            history = room.message_history
+            search_index = room.search_index
+            delivery_lock = room.delivery_lock
+            room_suffix = f" in room {room}"
+        with delivery_lock:
+            position: int = history.append(message)
+            recipients: tuple[ClientInfo, ...] = (
+                room.members.snapshot() if room is not None else self.clients.snapshot()
+            )
+            for client in recipients:
+                self.send_frame(
+                    client, message.delivery(client.socket.protocol_version)
+                )
+        if search_index is not None:
+            search_index.add(position, message)
+        match message.message_type:
+            case RequestType.MESSAGE:
+                logging.info(
+                    "%s says %s%s", message.nickname, message.contents, room_suffix
+                )
+            case RequestType.JOIN_MESSAGE:
+                logging.info("%s joined%s", message.nickname, room_suffix)
+            case RequestType.LEAVE_MESSAGE:
+                logging.info("%s left%s", message.nickname, room_suffix)
+        self.messages_delivered.increment()
+        self.broadcast_seconds.observe(time.perf_counter() - delivery_start)
+
+    def send_frame(self, client: ClientInfo, frame: TumultFrame | FrameBatch) -> None:
+        """
+        Queues a frame, or a batch of frames written together, for a client
+        and applies the overflow policy if its queue is full.
+        """
+        fired_policy: Optional[OverflowPolicy] = client.outbound.put(frame)
+        if fired_policy is not None:
+            self.overflow_counters[fired_policy].increment()
+            if fired_policy is OverflowPolicy.DISCONNECT:
+                logging.info("Disconnecting slow client %s", client)
+                client.socket.abort()
+                return
+        self._flush_outbound(client)
+
+    def run_threadsafe(self, callback: Callable[..., None], *args: Any) -> None:
+        """Runs a callback from a foreign thread where it may touch server state."""
+        callback(*args)
+
+    def send_message_history(
+        self,
+        client: ClientInfo,
+        limit: int,
+        before: Optional[int] = None,
+        room: Optional[Room] = None,
+    ) -> None:
+        """
+        Sends a client a page of at most limit messages before an index in the history
+        of the server or a room, or the latest messages without one, as a single batch
+        of pre-encoded frames.
+        """
+        history: MessageHistory | MessageLog = (
+            room.message_history if room is not None else self.message_history
+        )
+        stop: int = len(history)
+        if before is not None:
+            stop = max(min(before, stop), 0)
+        self._send_history_page(client, max(stop - limit, 0), stop, room)
+
+    def send_missed_messages(
+        self,
+        client: ClientInfo,
+        after: int,
+        epoch: Any,
+        limit: int,
+        room: Optional[Room] = None,
+    ) -> None:
+        """
+        Sends a reconnecting client every message after a sequence number in the history
+        of the server or a room. If more were missed than the largest history page, the
+        history no longer reaches the sequence number, or the number belongs to another
+        epoch of the history, only a page of at most limit latest messages is sent and
+        flagged as leaving a gap.
+        """
+        history: MessageHistory | MessageLog = (
+            room.message_history if room is not None else self.message_history
+        )
+        stop: int = len(history)
+        start: int = after + 1
+        if epoch != history.epoch:
+            self.resumes["gap"].increment()
+            logging.info(
+                "Client %s resumed from another history epoch%s, sending the latest",
+                client,
+                f" in room {room}" if room is not None else "",
+            )
+            self._send_history_page(client, max(stop - limit, 0), stop, room, gap=True)
+            return
+        if start <= stop and stop - start <= self.config.max_history_page_size:
+            self.resumes["delta"].increment()
+            self._send_history_page(client, start, stop, room)
+            return
+        self.resumes["gap"].increment()
+        logging.info(
+            "Client %s missed too many messages after %i%s, sending the latest",
+            client,
+            after,
+            f" in room {room}" if room is not None else "",
+        )
+        self._send_history_page(client, max(stop - limit, 0), stop, room, gap=True)
+
+    def send_search_results(
+        self,
+        client: ClientInfo,
+        query: str,
+        limit: int,
+        before: Optional[int] = None,
+        room: Optional[Room] = None,
+    ) -> None:
+        """
+        Sends a client at most limit messages before an index in the history of the
+        server or a room that contain every word of a query, newest first, as a single
+        batch of the results announcement followed by the messages' pre-encoded frames.
+        A page can hold fewer hits and still announce a next index if the search ran
+        out of steps.
+        """
+        search_start: float = time.perf_counter()
+        history: MessageHistory | MessageLog = self.message_history
+        search_index: Optional[SearchIndex] = self.search_index
+        if room is not None:
+            history = room.message_history
+            search_index = room.search_index
+        version: str = client.socket.protocol_version
+        hits: list[int] = []
+        next_before: Optional[int] = None
+        if search_index is not None:
+            hits, next_before = search_index.search(query, limit, before)
+
+        frames: list[TumultFrame] = [
+            TumultFrame.search_results(query, hits, next_before, version)
+        ]
+        for hit in hits:
+            frames.extend(history.frames(version, hit, hit + 1))
+        if room is not None:
+            frames = TumultFrame.room(room.name, frames, version)
+        logging.info(
+            "Sending %i search results%s to client %s",
+            len(hits),
+            f" from room {room}" if room is not None else "",
+            client,
+        )
+        self.send_frame(client, tuple(frames))
+        self.search_seconds.observe(time.perf_counter() - search_start)
+
+    def _send_history_page(
+        self,
+        client: ClientInfo,
+        start: int,
+        stop: int,
+        room: Optional[Room] = None,
+        gap: bool = False,
+    ) -> None:
+        """
+        Sends a client the messages from start to stop in the history of the server
+        or a room, announced as a page, as a single batch of pre-encoded frames.
+        """
+        history: MessageHistory | MessageLog = (
+            room.message_history if room is not None else self.message_history
+        )
+        version: str = client.socket.protocol_version
+        frames: list[TumultFrame] = list(history.frames(version, start, stop))
+        # Legacy clients do not know the page announcement and just get the messages
+        if version != LEGACY_PROTOCOL_VERSION:
+            frames.insert(
+                0, TumultFrame.history_page(start, stop, version, gap, history.epoch)
+            )
+        if room is not None:
+            frames = TumultFrame.room(room.name, frames, version)
+        logging.info(
+            "Sending messages %i to %i of the history%s to client %s",
+            start,
+            stop,
+            f" of room {room}" if room is not None else "",
+            client,
+        )
+        self.send_frame(client, tuple(frames))
+
+    def _create_history(
+        self, directory: Optional[str]
+    ) -> MessageHistory | MessageLog:
+        """Creates a message log in a directory, or an in-memory history without one."""
+        if directory is None:
+            return MessageHistory(self.config.history_epoch)
+        return MessageLog(
+            directory,
+            self.config.segment_size,
+            self.config.fsync_batch,
+            self.config.fsync_interval,
+            self.config.history_epoch,
+        )
+
+    def _create_room_history(self, room: str) -> MessageHistory | MessageLog:
+        """Creates the history of a room, logged in its own directory if the server's is."""
+        return self._create_history(
+            os.path.join(self.config.history_directory, ROOMS_DIRECTORY_NAME, room)
+            if self.config.history_directory is not None
+            else None
+        )
+
+    def _register_metrics(self) -> None:
+        """Creates the server's counters, gauges and histograms."""
+        self.connections_accepted: Counter = self.metrics.counter(
+            "tumult_connections_accepted_total", "Client connections accepted"
+        )
+        self.disconnections: Counter = self.metrics.counter(
+            "tumult_disconnections_total", "Client connections closed"
+        )
+        self.requests_received: Counter = self.metrics.counter(
+            "tumult_requests_received_total", "Requests received from clients"
+        )
+        self.bytes_received: Counter = self.metrics.counter(
+            "tumult_received_bytes_total", "Bytes of requests received from clients"
+        )
+        self.transfer_bytes: Counter = self.metrics.counter(
+            "tumult_transfer_bytes_total", "Bytes of transfer chunks relayed"
+        )
+        self.bytes_sent: Counter = self.metrics.counter(
+            "tumult_sent_bytes_total", "Bytes written to clients"
+        )
+        self.messages_delivered: Counter = self.metrics.counter(
+            "tumult_messages_delivered_total", "Messages, joins and leaves delivered"
+        )
+        self.broadcast_seconds: Histogram = self.metrics.histogram(
+            "tumult_broadcast_seconds",
+            "Seconds to record a message and queue it for every client",
+        )
+        self.search_seconds: Histogram = self.metrics.histogram(
+            "tumult_search_seconds",
+            "Seconds to search a history and queue the results for a client",
+        )
+        self.resumes: dict[str, Counter] = {
+            outcome: self.metrics.counter(
+                "tumult_resumes_total",
+                "Histories resumed by reconnecting clients",
+                {"outcome": outcome},
+            )
+            for outcome in ("delta", "gap")
+        }
+        self.idle_disconnections: Counter = self.metrics.counter(
+            "tumult_idle_disconnections_total",
+            "Client connections closed for being idle past the timeout",
+        )
+        self.rejected_connections: dict[str, Counter] = {
+            reason: self.metrics.counter(
+                "tumult_rejected_connections_total",
+                "Client connections refused by admission control",
+                {"reason": reason},
+            )
+            for reason in ("max_connections", "accept_rate")
+        }
+        self.rate_limited_requests: dict[RateLimitPolicy, Counter] = {
+            policy: self.metrics.counter(
+                "tumult_rate_limited_requests_total",
+                "Requests over a client's rate limit",
+                {"policy": str(policy)},
+            )
+            for policy in RateLimitPolicy
+        }
+        self.overflow_counters: dict[OverflowPolicy, Counter] = {
+            policy: self.metrics.counter(
+                "tumult_outbound_overflows_total",
+                "Overflow policies fired on full outbound queues",
+                {"policy": str(policy)},
+            )
+            for policy in OverflowPolicy
+        }
+        self.metrics.gauge(
+            "tumult_connected_clients",
+            "Clients currently connected",
+            lambda: len(self.clients),
+        )
+        self.metrics.gauge(
+            "tumult_rooms",
+            "Rooms created since the server started",
+            lambda: len(self.rooms),
+        )
+        self.metrics.gauge(
+            "tumult_history_messages",
+            "Messages in the message history",
+            lambda: len(self.message_history),
+        )
+        self.metrics.gauge(
+            "tumult_outbound_queued_entries",
+            "Frames and batches waiting in every client's outbound queue",
+            lambda: sum(len(client.outbound) for client in self.clients.snapshot()),
+        )
+
+    def _start_metrics_endpoint(self) -> None:
+        """Serves the metrics in the Prometheus text format if a metrics port is set."""
+        if self.config.metrics_port is None:
+            return
+        try:
+            self.metrics_server = self.metrics.serve(
+                self.config.metrics_host, self.config.metrics_port
+            )
+        except OSError as error:
+            logging.error(
+                "An error occurred while serving metrics at %s:%i: %s",
+                self.config.metrics_host,
+                self.config.metrics_port,
+                error,
+            )
+
+    def _start_liveness_checks(self) -> None:
+        """Starts a thread running the due liveness checks once per tick."""
+        if self.liveness_checks is None:
+            return
+        liveness_thread: threading.Thread = threading.Thread(
+            target=self._run_liveness_checks, daemon=True
+        )
+        liveness_thread.start()
+
+    def _run_liveness_checks(self) -> None:
+        """Runs the due liveness checks once per tick, forever."""
+        while True:
+            time.sleep(self.liveness_checks.tick)
+            self.run_threadsafe(self._check_liveness)
+
+    def _check_liveness(self) -> None:
+        """
+        Disconnects the clients idle for longer than the idle timeout, pings the
+        ones idle for longer than the heartbeat interval, and schedules each
+        checked client's next check.
+        """
+        now: float = time.monotonic()
+        for client in self.liveness_checks.advance(now):
+            if client not in self.clients:
+                continue
+            idle_time: float = now - client.last_activity
+            if idle_time >= self.config.idle_timeout:
+                logging.info(
+                    "Disconnecting client %s after %.1f idle seconds", client, idle_time
+                )
+                self.idle_disconnections.increment()
+                client.socket.abort()
+                continue
+            if idle_time >= self.config.heartbeat_interval and client.heartbeat:
+                self.send_frame(
+                    client, TumultFrame.ping(client.socket.protocol_version)
+                )
+            self._schedule_liveness_check(client, now)
+
+    def _schedule_liveness_check(
+        self, client: ClientInfo, now: Optional[float] = None
+    ) -> None:
+        """
+        Schedules a client's next liveness check for when it could next be pinged,
+        or for when it would reach the idle timeout if it was already pinged.
+        """
+        if self.liveness_checks is None:
+            return
+        now = now if now is not None else time.monotonic()
+        idle_time: float = now - client.last_activity
+        delay: float = self.config.heartbeat_interval - idle_time
+        if delay <= 0:
+            delay = min(
+                self.config.heartbeat_interval, self.config.idle_timeout - idle_time
+            )
+        self.liveness_checks.schedule(client.connection_id, delay, client)
+
+    def _admit_connection(self, client_socket_address: tuple[str, int]) -> bool:
+        """Returns whether a new connection fits within the connection and accept rate limits."""
+        reason: Optional[str] = None
+        if (
+            self.config.max_connections is not None
+            and len(self.clients) >= self.config.max_connections
+        ):
+            reason = "max_connections"
+        elif self.accepts is not None and not self.accepts.try_take():
+            reason = "accept_rate"
+        if reason is None:
+            return True
+        logging.info(
+            "Refusing connection from %s:%i over the %s limit",
+            *client_socket_address,
+            reason.replace("_", " "),
+        )
+        self.rejected_connections[reason].increment()
+        return False
+
+    def _rate_limit(
+        self, client: ClientInfo, request: TumultSocket.Request
+    ) -> Optional[float]:
+        """
+        Applies a client's rate limits to a request, returning the seconds to wait
+        before handling it, or None if the request was refused by the rate limit policy.
+        """
+        if client.rate_limiter is None:
+            return 0.0
+        policy: RateLimitPolicy = self.config.rate_limit_policy
+        # Throttled requests wait out their debt, refused ones would never fit at all
+        size: float = (
+            request.size
+            if policy is RateLimitPolicy.THROTTLE
+            else client.rate_limiter.capped_size(request.size)
+        )
+        delay: float = client.rate_limiter.take(size)
+        if delay <= 0:
+            return 0.0
+        self.rate_limited_requests[policy].increment()
+        if policy is RateLimitPolicy.THROTTLE:
+            return delay
+        client.rate_limiter.give_back(size)
+        if policy is RateLimitPolicy.DISCONNECT:
+            logging.info("Disconnecting client %s over its rate limit", client)
+            client.socket.abort()
+        return None
+
+    def _publish(self, message: Message) -> None:
+        """
+        Delivers a message locally, or hands it to the relay to deliver everywhere,
+        and sends it to the federated peers if there are any.
+        """
+        if self.federate is not None:
+            self.federate(message)
+        if self.relay is None:
+            self.deliver_message(message)
+        else:
+            self.relay(message)
+
+    def _flush_outbound(self, client: ClientInfo) -> None:
+        """Hands queued frames to the client's writer, which the writer thread does itself."""
+
+    def _start_writer(self, client: ClientInfo) -> None:
+        """Starts a thread writing the frames queued for a client to its socket."""
+        writer_thread: threading.Thread = threading.Thread(
+            target=self._write_client_frames, args=[client], daemon=True
+        )
+        writer_thread.start()
+
+    def _pack_frames(
+        self, client: ClientInfo, frames: list[TumultFrame]
+    ) -> list[TumultFrame]:
+        """
+        Combines several frames bound for a client into one batch request, then
+        compresses them if the client accepted compression and they are large enough.
+        """
+        version: str = client.socket.protocol_version
+        if version == LEGACY_PROTOCOL_VERSION:
+            return frames
+        if (
+            client.compressor is not None
+            and sum(len(frame) for frame in frames) >= self.config.compression_threshold
+        ):
+            return [TumultFrame.compressed(frames, client.compressor, version)]
+        if len(frames) < 2:
+            return frames
+        return TumultFrame.batch(frames, version)
+
+    def _write_client_frames(self, client: ClientInfo) -> None:
+        """
+        Writes queued frames to a client until its queue is closed, waiting out
+        the batch window after the first frame so that a burst is sent together.
+        """
+        while frames := client.outbound.take():
+            if self.config.batch_window > 0:
+                time.sleep(self.config.batch_window)
+                frames.extend(client.outbound.take_nowait())
+            frames = self._pack_frames(client, frames)
+            try:
+                client.socket.write_frames(frames)
+            except OSError as error:
+                logging.info("Writing to client %s failed: %s", client, error)
+                client.socket.abort()
+                return
+            self.bytes_sent.increment(sum(len(frame) for frame in frames))
 
-    @classmethod
-    def _request_nickname(cls, client: ClientInfo) -> None:
-        """Requests the nickname from a client."""
-        client.socket.write_nickname(client.nickname)
+    def _request_nickname(self, client: ClientInfo) -> None:
+        """Requests the nickname from a client, telling it the epoch of the history."""
+        self.send_frame(
+            client,
+            TumultFrame.nickname(
+                client.nickname,
+                client.socket.protocol_version,
+                {EPOCH_OPTION: self.message_history.epoch},
+            ),
+        )
+
+    def _history_page_size(self, requested_size: Any) -> int:
+        """Returns the page size requested by a client within the configured bounds."""
+        if not isinstance(requested_size, int) or isinstance(requested_size, bool):
+            return self.config.history_page_size
+        return max(min(requested_size, self.config.max_history_page_size), 0)
+
+    def _send_history(
+        self, client: ClientInfo, fields: dict[str, Any], room: Optional[Room] = None
+    ) -> None:
+        """
+        Sends the history a joining client asked for, the messages after the sequence
+        number and epoch it resumes from or else a page of recent messages.
+        """
+        limit: int = self._history_page_size(fields.get("history_limit"))
+        resume: Any = fields.get(RESUME_OPTION)
+        if isinstance(resume, int) and not isinstance(resume, bool) and resume >= 0:
+            self.send_missed_messages(
+                client, resume, fields.get(EPOCH_OPTION), limit, room
+            )
+        else:
+            self.send_message_history(client, limit, room=room)
+
+    def _search(
+        self, client: ClientInfo, fields: dict[str, Any], room: Optional[Room] = None
+    ) -> None:
+        """Answers a client's search request with a page of results."""
+        query: Any = fields.get("query")
+        limit: Any = fields.get("limit")
+        before: Any = fields.get("before")
+        if not isinstance(query, str):
+            logging.info("Client %s sent a search without a query", client)
+            return
+        if not isinstance(limit, int) or isinstance(limit, bool):
+            limit = DEFAULT_SEARCH_PAGE_SIZE
+        self.send_search_results(
+            client,
+            query,
+            max(min(limit, self.config.max_history_page_size), 0),
+            before if isinstance(before, int) else None,
+            room,
+        )
 
     def _wait_for_nickname(self, client: ClientInfo) -> None:
-        """Waits for a client nickname response then accepts it or generates a default."""
+        """Waits for a client nickname response then accepts it."""
         nickname_request = client.socket.wait_for_request(RequestType.NICKNAME)
+        self._accept_nickname(client, nickname_request)
 
-        if nickname_request.header.nickname is None:
+    def _accept_nickname(
+        self, client: ClientInfo, request: TumultSocket.Request
+    ) -> None:
+        """
+        Accepts the nickname from a client's response or generates a default,
+        switches to the newest protocol version the client supports, then sends
+        the page of recent history the client asked for, or the messages it missed
+        if it is resuming after a reconnect.
+        """
+        self._count_request(request)
+        client.socket.protocol_version = negotiate_version(request.header.version)
+        if request.header.nickname is None:
             self._generate_nickname(client)
         else:
-            client.nickname = nickname_request.header.nickname
+            self.clients.rename(client, request.header.nickname)
+
+        options: dict[str, Any] = decode_json_body(request.contents)
+        offered_compression: Any = options.get("compression")
+        if (
+            self.config.compression
+            and client.socket.protocol_version != LEGACY_PROTOCOL_VERSION
+            and isinstance(offered_compression, list)
+            and COMPRESSION_DEFLATE in offered_compression
+        ):
+            client.compressor = zlib.compressobj()
+            logging.info("Compressing large writes to client %s", client)
+        # Clients that cannot answer pings are only checked until their handshake
+        client.heartbeat = options.get(HEARTBEAT_OPTION) is True
+        if not client.heartbeat and self.liveness_checks is not None:
+            self.liveness_checks.cancel(client.connection_id)
+        self._send_history(client, options)
         self.broadcast_join_message(client.nickname)
 
     def _disconnect_client(self, client: ClientInfo) -> None:
         """Removes a client from the server and broadcast a leave message the other clients."""
         self.clients.remove(client)
+        if self.liveness_checks is not None:
+            self.liveness_checks.cancel(client.connection_id)
+        self.disconnections.increment()
+        client.outbound.close()
         if client.socket:
             client.socket.close()
+        for transfer in list(client.transfers.values()):
+            self._relay_transfer(
+                client,
+                transfer,
+                lambda version, transfer_id=transfer.transfer_id: (
+                    TumultFrame.transfer_end(client.nickname, transfer_id, True, version)
+                ),
+            )
+        client.transfers.clear()
+        for room in client.rooms.copy():
+            self._leave_room(client, room)
         self.broadcast_leave_message(client.nickname)
 
-        logging.info("Client list updated to %s", str(self.client_ipv4_addresses))
+        logging.info("%i clients connected", len(self.clients))
 
     def _generate_nickname(self, client: ClientInfo) -> None:
         """
-        Creates default nickname for the client based on connection order.
-        E.g. User1, User2, User3...
+        Creates default nickname for the client based on its connection id.
+        E.g. User1, User2, User3..., or User2-1, User2-2... on the second shard,
+        since every shard counts its connections from one.
         """
-        client.nickname = f"User{self.clients.index(client) + 1}"
+        prefix: str = f"{self.config.shard}-" if self.config.shard is not None else ""
+        self.clients.rename(client, f"User{prefix}{client.connection_id}")
         logging.info("Generated nickname %s for client %s", client.nickname, client)
 
-    def _handle_client_requests(self, client: ClientInfo) -> None:
-        """Processes incoming requests from a specific client."""
+    def _connect_client(self, client: ClientInfo) -> None:
+        """Registers a new client, starts its writer and requests its nickname."""
         logging.info("Client connected from %s", client)
-        self.clients.append(client)
-        logging.info("Client list updated to %s", str(self.client_ipv4_addresses))
-        logging.info("Sending message history to client %s", client)
-        self.send_message_history(client)
-
+        self.connections_accepted.increment()
+        client.outbound = OutboundQueue(
+            self.config.queue_size, self.config.overflow_policy
+        )
+        if self.config.request_rate is not None or self.config.byte_rate is not None:
+            client.rate_limiter = RateLimiter(
+                self.config.request_rate, self.config.byte_rate
+            )
+        self.clients.add(client)
+        logging.info("%i clients connected", len(self.clients))
+        self._schedule_liveness_check(client)
+        self._start_writer(client)
         self._request_nickname(client)
-        self._wait_for_nickname(client)
 
-        handling_requests: bool = True
-        while handling_requests:
-            try:
-                request: TumultSocket.Request = client.socket.read_request()
-                if not request or not request.header:
-                    continue
+    def _restore_client(self, client: ClientInfo) -> None:
+        """
+        Registers a client handed over by a previous server with its nickname and rooms,
+        without a handshake or any announcements, then starts its writer.
+        """
+        logging.info("Client %s handed over as %s", client, client.nickname)
+        client.outbound = OutboundQueue(
+            self.config.queue_size, self.config.overflow_policy
+        )
+        if self.config.request_rate is not None or self.config.byte_rate is not None:
+            client.rate_limiter = RateLimiter(
+                self.config.request_rate, self.config.byte_rate
+            )
+        self.clients.add(client)
+        for room_name in client.rooms.copy():
+            if self.rooms.join(room_name, client) is None:
+                client.rooms.discard(room_name)
+        self._schedule_liveness_check(client)
+        self._start_writer(client)
 
-                match request.header.request_type:
+    def _join_room(self, client: ClientInfo, fields: dict[str, Any]) -> None:
+        """
+        Adds a client to the room named in a join request, sends it the page
+        of the room's recent history it asked for, or the messages it missed,
+        then announces it in the room.
+        """
+        room_name: Any = fields.get("room")
+        if not valid_room_name(room_name):
+            logging.info("Client %s asked to join an invalid room", client)
+            return
+        if room_name in client.rooms:
+            return
+        room: Optional[Room] = self.rooms.join(room_name, client)
+        if room is None:
+            logging.info("Refusing to create room %s for client %s", room_name, client)
+            self.send_frame(
+                client,
+                TumultFrame.room_refused(
+                    room_name,
+                    "too many rooms on the server",
+                    client.socket.protocol_version,
+                ),
+            )
+            return
+        self._send_history(client, fields, room)
+        self.broadcast_join_message(client.nickname, room_name)
 
-                    case RequestType.NICKNAME:
-                        client.nickname = request.header.nickname
+    def _leave_room(self, client: ClientInfo, room_name: Any) -> None:
+        """
+        Removes a client from a room and announces it to the remaining members,
+        then evicts the room if it was the last member.
+        """
+        if not isinstance(room_name, str):
+            return
+        if self.rooms.leave(room_name, client) is not None:
+            self.broadcast_leave_message(client.nickname, room_name)
+            self.rooms.evict_if_empty(room_name)
 
-                    case RequestType.MESSAGE:
-                        message = request.contents.decode(ENCODING_FORMAT)
-                        self.broadcast_message(client.nickname, message)
+    def _handle_room_request(
+        self, client: ClientInfo, request: TumultSocket.Request
+    ) -> None:
+        """Processes the messages and history requests a client sends to one of its rooms."""
+        room: Optional[Room] = self.rooms.get(request.header.nickname)
+        if room is None or client not in room.members:
+            logging.info(
+                "Client %s sent a request to room %s without joining it",
+                client,
+                request.header.nickname,
+            )
+            return
+        for room_request in batch_requests(request.contents):
+            match room_request.header.request_type:
 
-            except TimeoutError:
-                logging.info("Connection with client %s timed out", client)
-                handling_requests = False
-            except ConnectionResetError:
-                logging.info(
-                    "Connection with client %s was forcibly closed by them", client
+                case RequestType.MESSAGE:
+                    message = room_request.contents.decode(ENCODING_FORMAT)
+                    self.broadcast_message(client.nickname, message, room.name)
+
+                case RequestType.HISTORY:
+                    fields: dict[str, Any] = decode_json_body(room_request.contents)
+                    before: Any = fields.get("before")
+                    self.send_message_history(
+                        client,
+                        self._history_page_size(fields.get("limit")),
+                        before if isinstance(before, int) else None,
+                        room,
+                    )
+
+                case RequestType.SEARCH:
+                    self._search(
+                        client, decode_json_body(room_request.contents), room
+                    )
+
+                case (
+                    RequestType.TRANSFER_START
+                    | RequestType.TRANSFER_CHUNK
+                    | RequestType.TRANSFER_END
+                ):
+                    self._handle_transfer_request(client, room_request, room.name)
+
+    def _handle_transfer_request(
+        self,
+        client: ClientInfo,
+        request: TumultSocket.Request,
+        room: Optional[str] = None,
+    ) -> None:
+        """
+        Relays the start, chunks and end of a client's transfer to the other clients,
+        or to the other members of the room it was started in, one chunk at a time.
+        """
+        match request.header.request_type:
+            case RequestType.TRANSFER_START:
+                self._start_transfer(client, decode_json_body(request.contents), room)
+            case RequestType.TRANSFER_CHUNK:
+                self._relay_transfer_chunk(client, request.contents)
+            case RequestType.TRANSFER_END:
+                self._end_transfer(client, decode_json_body(request.contents))
+
+    def _start_transfer(
+        self, client: ClientInfo, fields: dict[str, Any], room: Optional[str]
+    ) -> None:
+        """
+        Registers a client's new transfer under a server-wide id and announces it,
+        or tells the client why it was refused.
+        """
+        sender_id: Any = fields.get("transfer")
+        if not isinstance(sender_id, int) or sender_id in client.transfers:
+            return
+        reason: Optional[str] = None
+        if len(client.transfers) >= MAX_TRANSFERS_PER_CLIENT:
+            reason = "too many open transfers"
+        # Chunks are only relayed to this server's clients, not over the shard bus
+        # or federation links, so clients of other servers would silently miss them
+        elif self.relay is not None or self.federate is not None:
+            reason = "transfers cannot reach the clients of other servers"
+        if reason is not None:
+            logging.info("Refusing transfer from client %s: %s", client, reason)
+            self.send_frame(
+                client,
+                TumultFrame.transfer_refused(
+                    sender_id, reason, client.socket.protocol_version
+                ),
+            )
+            return
+        transfer: Transfer = Transfer(next(self.transfer_ids), room)
+        client.transfers[sender_id] = transfer
+        name: str = str(fields.get("name"))
+        size: Any = fields.get("size")
+        logging.info("%s started transfer of %s", client.nickname, name)
+        self._relay_transfer(
+            client,
+            transfer,
+            lambda version: TumultFrame.transfer_start(
+                client.nickname,
+                transfer.transfer_id,
+                name,
+                size if isinstance(size, int) else None,
+                version,
+            ),
+        )
+
+    def _relay_transfer_chunk(self, client: ClientInfo, contents: bytes) -> None:
+        """
+        Relays a chunk of one of a client's transfers without copying its bytes,
+        or aborts the transfer if the chunk does not start where the last one ended.
+        """
+        sender_id, offset, data = transfer_chunk(contents)
+        transfer: Optional[Transfer] = client.transfers.get(sender_id)
+        if transfer is None:
+            return
+        if offset != transfer.offset:
+            logging.info(
+                "Client %s sent a chunk at offset %i of a transfer at offset %i",
+                client,
+                offset,
+                transfer.offset,
+            )
+            self._end_transfer(client, {"transfer": sender_id, "aborted": True})
+            return
+        transfer.offset += len(data)
+        self.transfer_bytes.increment(len(data))
+        self._relay_transfer(
+            client,
+            transfer,
+            lambda version: TumultFrame.transfer_chunk(
+                transfer.transfer_id, offset, data, version
+            ),
+        )
+
+    def _end_transfer(self, client: ClientInfo, fields: dict[str, Any]) -> None:
+        """Relays the end of one of a client's transfers and forgets the transfer."""
+        sender_id: Any = fields.get("transfer")
+        if not isinstance(sender_id, int):
+            return
+        transfer: Optional[Transfer] = client.transfers.pop(sender_id, None)
+        if transfer is None:
+            return
+        aborted: bool = fields.get("aborted") is True
+        self._relay_transfer(
+            client,
+            transfer,
+            lambda version: TumultFrame.transfer_end(
+                client.nickname, transfer.transfer_id, aborted, version
+            ),
+        )
+
+    def _relay_transfer(
+        self,
+        sender: ClientInfo,
+        transfer: Transfer,
+        encode: Callable[[str], TumultFrame],
+    ) -> None:
+        """
+        Queues a transfer's frame for every recipient except its sender and legacy
+        clients, which cannot decode transfers, encoding it once for each protocol
+        version in use.
+        """
+        recipients: tuple[ClientInfo, ...] = self.clients.snapshot()
+        if transfer.room is not None:
+            room: Optional[Room] = self.rooms.get(transfer.room)
+            recipients = room.members.snapshot() if room is not None else ()
+        frames: dict[str, TumultFrame | FrameBatch] = {}
+        for recipient in recipients:
+            version: str = recipient.socket.protocol_version
+            if recipient is sender or version == LEGACY_PROTOCOL_VERSION:
+                continue
+            frame: Optional[TumultFrame | FrameBatch] = frames.get(version)
+            if frame is None:
+                frame = encode(version)
+                if transfer.room is not None:
+                    frame = tuple(TumultFrame.room(transfer.room, [frame], version))
+                frames[version] = frame
+            self.send_frame(recipient, frame)
+
+    def _count_request(self, request: TumultSocket.Request) -> None:
+        """Records a received request in the metrics."""
+        self.requests_received.increment()
+        self.bytes_received.increment(request.size)
+
+    def _handle_request(
+        self, client: ClientInfo, request: TumultSocket.Request
+    ) -> None:
+        """Processes a single request from a client that has completed the handshake."""
+        self._count_request(request)
+        client.last_activity = time.monotonic()
+        match request.header.request_type:
+
+            case RequestType.PING:
+                self.send_frame(
+                    client, TumultFrame.pong(client.socket.protocol_version)
                 )
-                handling_requests = False
-            except ConnectionAbortedError:
-                logging.info("Connection with client %s was aborted", client)
-                handling_requests = False
-            except ConnectionError as error:
-                logging.error(
-                    "Connection with client %s experienced an error: %s",
+
+            case RequestType.NICKNAME:
+                self.clients.rename(client, request.header.nickname)
+
+            case RequestType.MESSAGE:
+                message = request.contents.decode(ENCODING_FORMAT)
+                self.broadcast_message(client.nickname, message)
+
+            case RequestType.HISTORY:
+                fields: dict[str, Any] = decode_json_body(request.contents)
+                before: Any = fields.get("before")
+                self.send_message_history(
                     client,
-                    error,
+                    self._history_page_size(fields.get("limit")),
+                    before if isinstance(before, int) else None,
                 )
-                handling_requests = False
-            except socket.error as error:
-                logging.error(
-                    "An unknown error occurred with client %s: %s",
-                    client,
-                    error,
+
+            case RequestType.SEARCH:
+                self._search(client, decode_json_body(request.contents))
+
+            case RequestType.JOIN_ROOM:
+                self._join_room(client, decode_json_body(request.contents))
+
+            case RequestType.LEAVE_ROOM:
+                self._leave_room(
+                    client, decode_json_body(request.contents).get("room")
                 )
-                handling_requests = False
-        self._disconnect_client(client)
+
+            case RequestType.ROOM:
+                self._handle_room_request(client, request)
+
+            case (
+                RequestType.TRANSFER_START
+                | RequestType.TRANSFER_CHUNK
+                | RequestType.TRANSFER_END
+            ):
+                self._handle_transfer_request(client, request)
+
+    def _handle_client_requests(self, client: ClientInfo) -> None:
+        """Processes incoming requests from a specific client."""
+        self._connect_client(client)
+        # Whatever ends the loop, even an unexpected error, the client must be removed
+        try:
+
+            nickname_accepted: bool = False
+            handling_requests: bool = True
+            while handling_requests:
+                try:
+                    if not nickname_accepted:
+                        self._wait_for_nickname(client)
+                        nickname_accepted = True
+                        continue
+                    request: TumultSocket.Request = client.socket.read_request()
+                    if not request or not request.header:
+                        continue
+                    delay: Optional[float] = self._rate_limit(client, request)
+                    if delay is None:
+                        continue
+                    # Throttling stops reading, pushing back on the client through TCP
+                    if delay > 0:
+                        time.sleep(delay)
+                    self._handle_request(client, request)
+                except TimeoutError:
+                    logging.info("Connection with client %s timed out", client)
+                    handling_requests = False
+                except FrameTooLargeError as error:
+                    logging.info("Dropping client %s: %s", client, error)
+                    handling_requests = False
+                except MALFORMED_REQUEST_ERRORS as error:
+                    logging.info(
+                        "Dropping client %s after a malformed request: %s",
+                        client,
+                        error,
+                    )
+                    handling_requests = False
+                except ConnectionResetError:
+                    logging.info(
+                        "Connection with client %s was forcibly closed by them", client
+                    )
+                    handling_requests = False
+                except ConnectionAbortedError:
+                    logging.info("Connection with client %s was aborted", client)
+                    handling_requests = False
+                except ConnectionError as error:
+                    logging.error(
+                        "Connection with client %s experienced an error: %s",
+                        client,
+                        error,
+                    )
+                    handling_requests = False
+                except socket.error as error:
+                    logging.error(
+                        "An unknown error occurred with client %s: %s",
+                        client,
+                        error,
+                    )
+                    handling_requests = False
+        finally:
+            self._disconnect_client(client)
 
     def _handle_client_connections(self) -> None:
         """Accepts new client connections and creates a corresponding handler thread."""
@@ -225,13 +1222,18 @@ class TumultServer:
             client_socket_address: tuple[str, int] = client_socket_info[1]
             client_ipv4_address: str = client_socket_address[0]
             client_port: int = client_socket_address[1]
+            if not self._admit_connection(client_socket_address):
+                client_socket.close()
+                continue
             client_thread: threading.Thread = threading.Thread(
                 target=self._handle_client_requests,
                 args=[
                     ClientInfo(
                         ipv4_address=client_ipv4_address,
                         port=client_port,
-                        socket=TumultSocket(client_socket),
+                        socket=TumultSocket(
+                            client_socket, self.config.max_frame_size
+                        ),
                     )
                 ],
             )
@@ -5,16 +5,96 @@ import json
 import logging
 import re
 import socket
+import struct
 import time
+import zlib
+from abc import ABC, abstractmethod
 from collections import namedtuple
-from dataclasses import dataclass
+from dataclasses import dataclass, field
 from enum import IntEnum
-from typing import Optional, Any
+from typing import Optional, Any, Iterator
 
-PROTOCOL_VERSION: str = "1.0"
+PROTOCOL_VERSION: str = "2.0"
+LEGACY_PROTOCOL_VERSION: str = "1.0"
 DEFAULT_IPV4_ADDRESS: str = "127.0.0.1"
 DEFAULT_PORT: int = 65535
 ENCODING_FORMAT: str = "utf-8"
+HEADER_TERMINATOR: bytes = b"\r\n"
+RECEIVE_BUFFER_SIZE: int = 65536
+SENDMSG_MAX_BUFFERS: int = 512
+
+# Binary headers start with the major version, which can never begin a JSON header
+BINARY_HEADER_MAGIC: int = 2
+BINARY_HEADER_STRUCT: struct.Struct = struct.Struct("!BBBdIH")
+NO_NICKNAME_LENGTH: int = 0xFFFF
+# Flag of binary headers followed by the message's sequence number
+SEQUENCE_FLAG: int = 0x01
+SEQUENCE_STRUCT: struct.Struct = struct.Struct("!Q")
+
+# Name of the stream compression offered in the nickname handshake options
+COMPRESSION_DEFLATE: str = "deflate"
+
+# Handshake option of clients that answer the server's pings
+HEARTBEAT_OPTION: str = "heartbeat"
+
+# Handshake and join option of clients asking for the messages after a sequence number
+RESUME_OPTION: str = "resume"
+# Identifies the history that sequence numbers to resume from belong to
+EPOCH_OPTION: str = "epoch"
+
+# Longest JSON header accepted from a peer whose frame sizes are bounded
+MAX_JSON_HEADER_LENGTH: int = 64 * 1024
+
+# Transfer chunks carry their transfer's id and offset before the chunk's bytes
+TRANSFER_CHUNK_STRUCT: struct.Struct = struct.Struct("!IQ")
+DEFAULT_CHUNK_SIZE: int = 64 * 1024
+
+# Federated messages carry their origin's incarnation and sequence number
+FEDERATION_ID_STRUCT: struct.Struct = struct.Struct("!QQ")
+
+# Room names are also used as directory names for the rooms' message logs
+ROOM_NAME_PATTERN: re.Pattern = re.compile(r"^[A-Za-z0-9_-]{1,32}$")
+
+
+def encode_json_body(fields: dict[str, Any]) -> bytes:
+    """Encodes the fields of a request body as JSON bytes."""
+    return json.dumps(fields).encode(ENCODING_FORMAT)
+
+
+def decode_json_body(contents: bytes) -> dict[str, Any]:
+    """Decodes the fields of a JSON request body, or none if the body is empty or invalid."""
+    if not contents:
+        return {}
+    try:
+        fields: Any = json.loads(contents.decode(ENCODING_FORMAT))
+    except (UnicodeDecodeError, json.JSONDecodeError):
+        return {}
+    return fields if isinstance(fields, dict) else {}
+
+
+def valid_room_name(room: Any) -> bool:
+    """Returns whether a room name is a string of 1 to 32 letters, digits, dashes or underscores."""
+    return isinstance(room, str) and ROOM_NAME_PATTERN.match(room) is not None
+
+
+def _is_count(value: Any) -> bool:
+    """Returns whether a decoded JSON value is a non-negative integer."""
+    return isinstance(value, int) and not isinstance(value, bool) and value >= 0
+
+
+def negotiate_version(peer_version: Any) -> str:
+    """Returns the newest protocol version supported by both this side and the peer."""
+    try:
+        peer_major_version: int = int(str(peer_version).split(".", maxsplit=1)[0])
+    except ValueError:
+        return LEGACY_PROTOCOL_VERSION
+    if peer_major_version >= BINARY_HEADER_MAGIC:
+        return PROTOCOL_VERSION
+    return LEGACY_PROTOCOL_VERSION
+
+
+class FrameTooLargeError(ConnectionError):
+    """Raised when a peer sends a frame larger than the receiver accepts."""
 
 
 class RequestType(IntEnum):
@@ -24,50 +104,762 @@ class RequestType(IntEnum):
     JOIN_MESSAGE = 2
     LEAVE_MESSAGE = 3
     NICKNAME = 4
+    HISTORY = 5
+    BATCH = 6
+    COMPRESSED = 7
+    JOIN_ROOM = 8
+    LEAVE_ROOM = 9
+    ROOM = 10
+    PING = 11
+    PONG = 12
+    TRANSFER_START = 13
+    TRANSFER_CHUNK = 14
+    TRANSFER_END = 15
+    SEARCH = 16
+    FEDERATION = 17
 
 
 @dataclass
 class TumultHeader:
-    """Header containing metadata for Tumult protocol messages."""
+    """
+    Header containing metadata for Tumult protocol messages. Messages delivered
+    from a history carry their sequence number, their index in that history.
+    """
 
     request_type: RequestType
     version: str = PROTOCOL_VERSION
-    timestamp: float = time.time()
+    timestamp: float = field(default_factory=time.time)
     nickname: Optional[str] = None
     content_length: int = 0
+    sequence: Optional[int] = None
 
     def to_bytes(self) -> bytes:
         """Encodes a header to JSON bytes with a 'carriage-return-new-line' termination."""
-        header: str = json.dumps(
-            {
-                "version": self.version,
-                "timestamp": self.timestamp,
-                "request_type": int(self.request_type),
-                "nickname": self.nickname,
-                "content_length": self.content_length,
-            }
-        )
+        fields: dict[str, Any] = {
+            "version": self.version,
+            "timestamp": self.timestamp,
+            "request_type": int(self.request_type),
+            "nickname": self.nickname,
+            "content_length": self.content_length,
+        }
+        if self.sequence is not None:
+            fields["sequence"] = self.sequence
+        header: str = json.dumps(fields)
         return f"{header}\r\n".encode(ENCODING_FORMAT)
 
     @classmethod
     def from_bytes(cls, header_bytes: bytes) -> "TumultHeader":
-        """Creates a header instance from JSON bytes."""
-        header: dict[str, Any] = json.loads(
-            header_bytes.decode(ENCODING_FORMAT).strip()
-        )
+        """
+        Creates a header instance from JSON bytes, raising ValueError if a field
+        has a type no peer could have encoded.
+        """
+        header: Any = json.loads(header_bytes.decode(ENCODING_FORMAT).strip())
+        if not isinstance(header, dict):
+            raise ValueError("Header is not a JSON object")
+        if not isinstance(header["version"], str):
+            raise ValueError("Header version is not a string")
+        if not isinstance(header["timestamp"], (int, float)) or isinstance(
+            header["timestamp"], bool
+        ):
+            raise ValueError("Header timestamp is not a number")
+        if not _is_count(header["request_type"]):
+            raise ValueError("Header request type is not an integer")
+        if header["nickname"] is not None and not isinstance(header["nickname"], str):
+            raise ValueError("Header nickname is not a string")
+        if not _is_count(header["content_length"]):
+            raise ValueError("Header content length is not a non-negative integer")
+        sequence: Any = header.get("sequence")
+        if sequence is not None and not _is_count(sequence):
+            raise ValueError("Header sequence number is not a non-negative integer")
         return cls(
             version=header["version"],
             timestamp=header["timestamp"],
             request_type=RequestType(header["request_type"]),
             nickname=header["nickname"],
             content_length=header["content_length"],
+            sequence=sequence,
         )
 
+    def to_binary(self) -> bytes:
+        """
+        Encodes a header to the fixed-size binary layout of protocol version 2.0:
+        magic, request type, flags, timestamp, content length and nickname length,
+        followed by the sequence number if flagged and the nickname itself.
+        """
+        if self.nickname is not None and not isinstance(self.nickname, str):
+            raise ValueError("Nickname is not a string")
+        nickname_bytes: bytes = (
+            self.nickname.encode(ENCODING_FORMAT) if self.nickname is not None else b""
+        )
+        if len(nickname_bytes) >= NO_NICKNAME_LENGTH:
+            raise ValueError("Nickname is too long for a binary header")
+        sequence_bytes: bytes = (
+            SEQUENCE_STRUCT.pack(self.sequence) if self.sequence is not None else b""
+        )
+        return (
+            BINARY_HEADER_STRUCT.pack(
+                BINARY_HEADER_MAGIC,
+                int(self.request_type),
+                SEQUENCE_FLAG if self.sequence is not None else 0,
+                self.timestamp,
+                self.content_length,
+                (
+                    len(nickname_bytes)
+                    if self.nickname is not None
+                    else NO_NICKNAME_LENGTH
+                ),
+            )
+            + sequence_bytes
+            + nickname_bytes
+        )
+
+    @classmethod
+    def from_binary(cls, header_bytes: bytes) -> "TumultHeader":
+        """Creates a header instance from binary header bytes."""
+        _magic, request_type, flags, timestamp, content_length, nickname_length = (
+            BINARY_HEADER_STRUCT.unpack_from(header_bytes)
+        )
+        nickname_start: int = BINARY_HEADER_STRUCT.size
+        sequence: Optional[int] = None
+        if flags & SEQUENCE_FLAG:
+            (sequence,) = SEQUENCE_STRUCT.unpack_from(header_bytes, nickname_start)
+            nickname_start += SEQUENCE_STRUCT.size
+        nickname: Optional[str] = (
+            header_bytes[nickname_start:].decode(ENCODING_FORMAT)
+            if nickname_length != NO_NICKNAME_LENGTH
+            else None
+        )
+        return cls(
+            version=PROTOCOL_VERSION,
+            timestamp=timestamp,
+            request_type=RequestType(request_type),
+            nickname=nickname,
+            content_length=content_length,
+            sequence=sequence,
+        )
+
+    def encode(self, version: str) -> bytes:
+        """Encodes a header in the format of the provided protocol version."""
+        if version == LEGACY_PROTOCOL_VERSION:
+            return self.to_bytes()
+        return self.to_binary()
+
+
+# The size is the number of bytes the request took up on the wire
+Request = namedtuple("Request", ["header", "contents", "size"], defaults=[0])
+
+
+class FrameBuffer:
+    """
+    Receive buffer that splits a byte stream into complete Tumult requests,
+    refusing frames with more than max_content_length bytes of contents if set.
+    """
+
+    def __init__(self, max_content_length: Optional[int] = None) -> None:
+        self.max_content_length: Optional[int] = max_content_length
+        self.__buffer: bytearray = bytearray()
+        self.__scan_start: int = 0
+        self.__header: Optional[TumultHeader] = None
+        self.__header_length: int = 0
+
+    def __len__(self) -> int:
+        """Returns the number of buffered bytes not yet consumed by a request."""
+        return len(self.__buffer)
+
+    def feed(self, data: bytes | bytearray | memoryview) -> None:
+        """Appends received bytes to the end of the buffer."""
+        self.__buffer += data
+
+    def next_request(self) -> Optional[Request]:
+        """Removes and returns the next complete request, or None if more bytes are needed."""
+        if self.__header is None and not self.__parse_header():
+            return None
+        if (
+            self.max_content_length is not None
+            and self.__header.content_length > self.max_content_length
+        ):
+            raise FrameTooLargeError(
+                f"Frame of {self.__header.content_length} bytes is over the limit "
+                f"of {self.max_content_length} bytes"
+            )
+
+        frame_length: int = self.__header_length + self.__header.content_length
+        if len(self.__buffer) < frame_length:
+            return None
 
-class TumultSocket:
+        contents: bytes = bytes(self.__buffer[self.__header_length : frame_length])
+        request: Request = Request(self.__header, contents, frame_length)
+        del self.__buffer[:frame_length]
+        self.__scan_start = 0
+        self.__header = None
+        self.__header_length = 0
+        return request
+
+    def requests(self) -> Iterator[Request]:
+        """Yields every complete request currently held in the buffer."""
+        while (request := self.next_request()) is not None:
+            yield request
+
+    def drain(self) -> bytes:
+        """Removes and returns every buffered byte not yet consumed by a request."""
+        buffered: bytes = bytes(self.__buffer)
+        self.__buffer.clear()
+        self.__scan_start = 0
+        self.__header = None
+        self.__header_length = 0
+        return buffered
+
+    def __parse_header(self) -> bool:
+        """Parses the header at the start of the buffer, returning whether it was complete."""
+        if not self.__buffer:
+            return False
+
+        if self.__buffer[0] == BINARY_HEADER_MAGIC:
+            if len(self.__buffer) < BINARY_HEADER_STRUCT.size:
+                return False
+            fields: tuple = BINARY_HEADER_STRUCT.unpack_from(self.__buffer)
+            flags: int = fields[2]
+            nickname_length: int = fields[-1]
+            header_length: int = BINARY_HEADER_STRUCT.size + (
+                nickname_length if nickname_length != NO_NICKNAME_LENGTH else 0
+            )
+            if flags & SEQUENCE_FLAG:
+                header_length += SEQUENCE_STRUCT.size
+            if len(self.__buffer) < header_length:
+                return False
+            self.__header_length = header_length
+            self.__header = TumultHeader.from_binary(
+                bytes(self.__buffer[:header_length])
+            )
+            return True
+
+        terminator_index: int = self.__buffer.find(HEADER_TERMINATOR, self.__scan_start)
+        if terminator_index == -1:
+            if (
+                self.max_content_length is not None
+                and len(self.__buffer) > MAX_JSON_HEADER_LENGTH
+            ):
+                raise FrameTooLargeError("Header is over the length limit")
+            # Only the last byte could start a terminator split across reads
+            self.__scan_start = max(len(self.__buffer) - 1, 0)
+            return False
+        self.__header_length = terminator_index + len(HEADER_TERMINATOR)
+        self.__header = TumultHeader.from_bytes(
+            bytes(self.__buffer[: self.__header_length])
+        )
+        return True
+
+
+def batch_requests(contents: bytes) -> Iterator[Request]:
+    """Yields the requests carried in the contents of a batch request."""
+    frame_buffer: FrameBuffer = FrameBuffer()
+    frame_buffer.feed(contents)
+    yield from frame_buffer.requests()
+
+
+def transfer_chunk(contents: bytes) -> tuple[int, int, memoryview]:
+    """
+    Returns the transfer id, the offset of the chunk in the transfer's payload and
+    a view of the bytes carried by a transfer chunk.
+    """
+    transfer_id, offset = TRANSFER_CHUNK_STRUCT.unpack_from(contents)
+    return transfer_id, offset, memoryview(contents)[TRANSFER_CHUNK_STRUCT.size :]
+
+
+def federated_message(contents: bytes) -> tuple[int, int, memoryview]:
+    """
+    Returns the origin incarnation, sequence number and a view of the frames carried
+    by a federated message.
+    """
+    incarnation, sequence = FEDERATION_ID_STRUCT.unpack_from(contents)
+    return incarnation, sequence, memoryview(contents)[FEDERATION_ID_STRUCT.size :]
+
+
+def decompress_requests(contents: bytes, decompressor: Any) -> Iterator[Request]:
+    """Yields the requests carried in a compressed request using the connection's inflate stream."""
+    yield from batch_requests(decompressor.decompress(contents))
+
+
+@dataclass(frozen=True)
+class TumultFrame:
+    """Encoded request kept as separate header and contents buffers."""
+
+    header: bytes | memoryview
+    contents: bytes | memoryview = b""
+
+    def __len__(self) -> int:
+        """Returns the total number of bytes in the frame."""
+        return len(self.header) + len(self.contents)
+
+    @classmethod
+    def encode(
+        cls,
+        request_type: RequestType,
+        nickname: Optional[str] = None,
+        contents: bytes = b"",
+        version: str = LEGACY_PROTOCOL_VERSION,
+        timestamp: Optional[float] = None,
+        sequence: Optional[int] = None,
+    ) -> "TumultFrame":
+        """Encodes a request with the provided type, nickname and contents."""
+        header: TumultHeader = TumultHeader(
+            request_type=request_type,
+            nickname=nickname,
+            content_length=len(contents),
+            sequence=sequence,
+        )
+        if timestamp is not None:
+            header.timestamp = timestamp
+        return cls(header.encode(version), contents)
+
+    @classmethod
+    def message(
+        cls,
+        nickname: Optional[str],
+        message: str,
+        version: str = LEGACY_PROTOCOL_VERSION,
+    ) -> "TumultFrame":
+        """Encodes a message with the provided user's nickname."""
+        return cls.encode(
+            RequestType.MESSAGE, nickname, message.encode(ENCODING_FORMAT), version
+        )
+
+    @classmethod
+    def join_message(
+        cls, nickname: Optional[str], version: str = LEGACY_PROTOCOL_VERSION
+    ) -> "TumultFrame":
+        """Encodes a join message with the provided user's nickname."""
+        return cls.encode(RequestType.JOIN_MESSAGE, nickname, version=version)
+
+    @classmethod
+    def leave_message(
+        cls, nickname: Optional[str], version: str = LEGACY_PROTOCOL_VERSION
+    ) -> "TumultFrame":
+        """Encodes a leave message with the provided user's nickname."""
+        return cls.encode(RequestType.LEAVE_MESSAGE, nickname, version=version)
+
+    @classmethod
+    def nickname(
+        cls,
+        nickname: Optional[str],
+        version: str = LEGACY_PROTOCOL_VERSION,
+        options: Optional[dict[str, Any]] = None,
+    ) -> "TumultFrame":
+        """Encodes a nickname request or response with optional handshake options."""
+        contents: bytes = encode_json_body(options) if options else b""
+        return cls.encode(RequestType.NICKNAME, nickname, contents, version)
+
+    @classmethod
+    def batch(
+        cls, frames: list["TumultFrame"], version: str = LEGACY_PROTOCOL_VERSION
+    ) -> list["TumultFrame"]:
+        """
+        Encodes frames as the contents of one batch request, returned as the batch
+        header followed by the unchanged frames so that nothing is copied.
+        """
+        header: TumultHeader = TumultHeader(
+            request_type=RequestType.BATCH,
+            content_length=sum(len(frame) for frame in frames),
+        )
+        return [cls(header.encode(version)), *frames]
+
+    @classmethod
+    def room(
+        cls,
+        room: str,
+        frames: list["TumultFrame"],
+        version: str = LEGACY_PROTOCOL_VERSION,
+    ) -> list["TumultFrame"]:
+        """
+        Encodes frames as the contents of one room request, which carries the room's
+        name in the nickname field, returned as the room header followed by the
+        unchanged frames so that nothing is copied.
+        """
+        header: TumultHeader = TumultHeader(
+            request_type=RequestType.ROOM,
+            nickname=room,
+            content_length=sum(len(frame) for frame in frames),
+        )
+        return [cls(header.encode(version)), *frames]
+
+    @classmethod
+    def compressed(
+        cls,
+        frames: list["TumultFrame"],
+        compressor: Any,
+        version: str = LEGACY_PROTOCOL_VERSION,
+    ) -> "TumultFrame":
+        """
+        Encodes frames as one compressed request with the connection's deflate stream,
+        flushed so that the contents decompress to whole frames.
+        """
+        chunks: list[bytes] = [
+            compressor.compress(buffer)
+            for frame in frames
+            for buffer in (frame.header, frame.contents)
+        ]
+        chunks.append(compressor.flush(zlib.Z_SYNC_FLUSH))
+        return cls.encode(
+            RequestType.COMPRESSED, contents=b"".join(chunks), version=version
+        )
+
+    @classmethod
+    def history_request(
+        cls,
+        before: Optional[int],
+        limit: int,
+        version: str = LEGACY_PROTOCOL_VERSION,
+    ) -> "TumultFrame":
+        """Encodes a request for a page of at most limit messages before an index."""
+        contents: bytes = encode_json_body({"before": before, "limit": limit})
+        return cls.encode(RequestType.HISTORY, contents=contents, version=version)
+
+    @classmethod
+    def history_page(
+        cls,
+        start: int,
+        stop: int,
+        version: str = LEGACY_PROTOCOL_VERSION,
+        gap: bool = False,
+        epoch: Optional[int] = None,
+    ) -> "TumultFrame":
+        """
+        Encodes the announcement of the history messages from start to stop that follow,
+        with the epoch of their history, flagging a resume whose missed messages were
+        too many to send them all or came from another history.
+        """
+        fields: dict[str, Any] = {"start": start, "stop": stop}
+        if epoch is not None:
+            fields[EPOCH_OPTION] = epoch
+        if gap:
+            fields["gap"] = True
+        contents: bytes = encode_json_body(fields)
+        return cls.encode(RequestType.HISTORY, contents=contents, version=version)
+
+    @classmethod
+    def search_request(
+        cls,
+        query: str,
+        limit: int,
+        before: Optional[int] = None,
+        version: str = LEGACY_PROTOCOL_VERSION,
+    ) -> "TumultFrame":
+        """
+        Encodes a request for at most limit messages before an index that contain
+        every word of a query.
+        """
+        contents: bytes = encode_json_body(
+            {"query": query, "limit": limit, "before": before}
+        )
+        return cls.encode(RequestType.SEARCH, contents=contents, version=version)
+
+    @classmethod
+    def search_results(
+        cls,
+        query: str,
+        hits: list[int],
+        next_before: Optional[int],
+        version: str = LEGACY_PROTOCOL_VERSION,
+    ) -> "TumultFrame":
+        """
+        Encodes the announcement of the history indexes of the search hits that follow,
+        newest first, and of the index to search before for the next page, if any.
+        """
+        contents: bytes = encode_json_body(
+            {"query": query, "hits": hits, "next": next_before}
+        )
+        return cls.encode(RequestType.SEARCH, contents=contents, version=version)
+
+    @classmethod
+    def ping(cls, version: str = LEGACY_PROTOCOL_VERSION) -> "TumultFrame":
+        """Encodes a ping asking the peer to show it is still connected."""
+        return cls.encode(RequestType.PING, version=version)
+
+    @classmethod
+    def pong(cls, version: str = LEGACY_PROTOCOL_VERSION) -> "TumultFrame":
+        """Encodes the answer to a ping."""
+        return cls.encode(RequestType.PONG, version=version)
+
+    @classmethod
+    def transfer_start(
+        cls,
+        nickname: Optional[str],
+        transfer_id: int,
+        name: str,
+        size: Optional[int] = None,
+        version: str = LEGACY_PROTOCOL_VERSION,
+    ) -> "TumultFrame":
+        """Encodes the start of a transfer of a named payload, with its size if known."""
+        contents: bytes = encode_json_body(
+            {"transfer": transfer_id, "name": name, "size": size}
+        )
+        return cls.encode(RequestType.TRANSFER_START, nickname, contents, version)
+
+    @classmethod
+    def transfer_chunk(
+        cls,
+        transfer_id: int,
+        offset: int,
+        data: bytes | memoryview,
+        version: str = LEGACY_PROTOCOL_VERSION,
+    ) -> "TumultFrame":
+        """
+        Encodes a chunk of a transfer's payload starting at an offset. The transfer id
+        and offset are appended to the header's buffer so that the chunk's bytes are
+        sent without being copied.
+        """
+        header: TumultHeader = TumultHeader(
+            request_type=RequestType.TRANSFER_CHUNK,
+            content_length=TRANSFER_CHUNK_STRUCT.size + len(data),
+        )
+        return cls(
+            header.encode(version) + TRANSFER_CHUNK_STRUCT.pack(transfer_id, offset),
+            data,
+        )
+
+    @classmethod
+    def transfer_end(
+        cls,
+        nickname: Optional[str],
+        transfer_id: int,
+        aborted: bool = False,
+        version: str = LEGACY_PROTOCOL_VERSION,
+    ) -> "TumultFrame":
+        """Encodes the end of a transfer, which is aborted if it ends incomplete."""
+        contents: bytes = encode_json_body({"transfer": transfer_id, "aborted": aborted})
+        return cls.encode(RequestType.TRANSFER_END, nickname, contents, version)
+
+    @classmethod
+    def transfer_refused(
+        cls, transfer_id: int, reason: str, version: str = LEGACY_PROTOCOL_VERSION
+    ) -> "TumultFrame":
+        """Encodes the server's refusal of a transfer its sender numbered with an id."""
+        contents: bytes = encode_json_body(
+            {"transfer": transfer_id, "aborted": True, "refused": reason}
+        )
+        return cls.encode(RequestType.TRANSFER_END, None, contents, version)
+
+    @classmethod
+    def federation_hello(
+        cls, node_id: str, version: str = LEGACY_PROTOCOL_VERSION
+    ) -> "TumultFrame":
+        """Encodes the greeting that opens a federation link, naming the sending node."""
+        return cls.encode(RequestType.FEDERATION, node_id, version=version)
+
+    @classmethod
+    def federated(
+        cls,
+        origin: str,
+        incarnation: int,
+        sequence: int,
+        frames: list["TumultFrame"],
+        version: str = LEGACY_PROTOCOL_VERSION,
+    ) -> list["TumultFrame"]:
+        """
+        Encodes frames as a message federated from an origin node, which carries the
+        origin in the nickname field and its incarnation and sequence number before
+        the unchanged frames, so that nothing is copied.
+        """
+        header: TumultHeader = TumultHeader(
+            request_type=RequestType.FEDERATION,
+            nickname=origin,
+            content_length=FEDERATION_ID_STRUCT.size
+            + sum(len(frame) for frame in frames),
+        )
+        federation_id: bytes = FEDERATION_ID_STRUCT.pack(incarnation, sequence)
+        return [cls(header.encode(version) + federation_id), *frames]
+
+    @classmethod
+    def join_room(
+        cls,
+        room: str,
+        history_limit: Optional[int] = None,
+        version: str = LEGACY_PROTOCOL_VERSION,
+        resume: Optional[int] = None,
+        epoch: Optional[int] = None,
+    ) -> "TumultFrame":
+        """
+        Encodes a request to join a room and receive a page of its recent history,
+        or the messages after a sequence number of the history with an epoch.
+        """
+        fields: dict[str, Any] = {"room": room}
+        if history_limit is not None:
+            fields["history_limit"] = history_limit
+        if resume is not None:
+            fields[RESUME_OPTION] = resume
+            fields[EPOCH_OPTION] = epoch
+        return cls.encode(
+            RequestType.JOIN_ROOM, contents=encode_json_body(fields), version=version
+        )
+
+    @classmethod
+    def leave_room(
+        cls, room: str, version: str = LEGACY_PROTOCOL_VERSION
+    ) -> "TumultFrame":
+        """Encodes a request to leave a room."""
+        contents: bytes = encode_json_body({"room": room})
+        return cls.encode(RequestType.LEAVE_ROOM, contents=contents, version=version)
+
+    @classmethod
+    def room_refused(
+        cls, room: str, reason: str, version: str = LEGACY_PROTOCOL_VERSION
+    ) -> "TumultFrame":
+        """Encodes the server's refusal of a client's request to join a room."""
+        contents: bytes = encode_json_body({"room": room, "refused": reason})
+        return cls.encode(RequestType.LEAVE_ROOM, contents=contents, version=version)
+
+
+class TumultWriter(ABC):
+    """Base for connections that send Tumult requests as encoded frames."""
+
+    # Header format used for writing, upgraded once the handshake negotiates it
+    protocol_version: str = LEGACY_PROTOCOL_VERSION
+
+    @abstractmethod
+    def write_frame(self, frame: TumultFrame) -> None:
+        """Sends an encoded frame over the underlying connection."""
+
+    def write_frames(self, frames: list[TumultFrame]) -> None:
+        """Sends several encoded frames in order."""
+        for frame in frames:
+            self.write_frame(frame)
+
+    @abstractmethod
+    def close(self) -> None:
+        """Closes the underlying connection."""
+
+    @abstractmethod
+    def abort(self) -> None:
+        """Drops the underlying connection immediately."""
+
+    def write_message(
+        self, nickname: Optional[str], message: str, room: Optional[str] = None
+    ) -> None:
+        """
+        Writes a message to the socket with the provided user's nickname and message,
+        sent to a room if one is provided.
+        """
+        self.__write_in_room(
+            TumultFrame.message(nickname, message, self.protocol_version), room
+        )
+
+    def write_join_message(self, nickname: Optional[str]) -> None:
+        """Writes a join message to the socket with the provided user's nickname."""
+        self.write_frame(TumultFrame.join_message(nickname, self.protocol_version))
+
+    def write_leave_message(self, nickname: Optional[str]) -> None:
+        """Writes a join message to the socket with the provided user's nickname."""
+        self.write_frame(TumultFrame.leave_message(nickname, self.protocol_version))
+
+    def write_nickname(
+        self, nickname: Optional[str], options: Optional[dict[str, Any]] = None
+    ) -> None:
+        """Writes a nickname to the socket with optional handshake options."""
+        self.write_frame(TumultFrame.nickname(nickname, self.protocol_version, options))
+
+    def write_history_request(
+        self, before: Optional[int], limit: int, room: Optional[str] = None
+    ) -> None:
+        """
+        Writes a request for a page of at most limit messages before an index,
+        in a room's history if one is provided.
+        """
+        self.__write_in_room(
+            TumultFrame.history_request(before, limit, self.protocol_version), room
+        )
+
+    def write_search_request(
+        self,
+        query: str,
+        limit: int,
+        before: Optional[int] = None,
+        room: Optional[str] = None,
+    ) -> None:
+        """
+        Writes a request for at most limit messages before an index that contain
+        every word of a query, in a room's history if one is provided.
+        """
+        self.__write_in_room(
+            TumultFrame.search_request(query, limit, before, self.protocol_version),
+            room,
+        )
+
+    def write_ping(self) -> None:
+        """Writes a ping asking the peer to show it is still connected."""
+        self.write_frame(TumultFrame.ping(self.protocol_version))
+
+    def write_pong(self) -> None:
+        """Writes the answer to a ping."""
+        self.write_frame(TumultFrame.pong(self.protocol_version))
+
+    def write_transfer_start(
+        self,
+        nickname: Optional[str],
+        transfer_id: int,
+        name: str,
+        size: Optional[int] = None,
+        room: Optional[str] = None,
+    ) -> None:
+        """Writes the start of a transfer of a named payload, sent to a room if provided."""
+        self.__write_in_room(
+            TumultFrame.transfer_start(
+                nickname, transfer_id, name, size, self.protocol_version
+            ),
+            room,
+        )
+
+    def write_transfer_chunk(
+        self, transfer_id: int, offset: int, data: bytes | memoryview
+    ) -> None:
+        """Writes a chunk of a started transfer's payload starting at an offset."""
+        self.write_frame(
+            TumultFrame.transfer_chunk(transfer_id, offset, data, self.protocol_version)
+        )
+
+    def write_transfer_end(
+        self, nickname: Optional[str], transfer_id: int, aborted: bool = False
+    ) -> None:
+        """Writes the end of a started transfer."""
+        self.write_frame(
+            TumultFrame.transfer_end(
+                nickname, transfer_id, aborted, self.protocol_version
+            )
+        )
+
+    def write_join_room(
+        self,
+        room: str,
+        history_limit: Optional[int] = None,
+        resume: Optional[int] = None,
+        epoch: Optional[int] = None,
+    ) -> None:
+        """
+        Writes a request to join a room with an optional number of recent messages,
+        or the sequence number of the last message received from it, and the epoch
+        of its history, to resume after.
+        """
+        self.write_frame(
+            TumultFrame.join_room(
+                room, history_limit, self.protocol_version, resume, epoch
+            )
+        )
+
+    def write_leave_room(self, room: str) -> None:
+        """Writes a request to leave a room."""
+        self.write_frame(TumultFrame.leave_room(room, self.protocol_version))
+
+    def __write_in_room(self, frame: TumultFrame, room: Optional[str]) -> None:
+        """Writes a frame, wrapped in a room request if a room is provided."""
+        if room is None:
+            self.write_frame(frame)
+        else:
+            self.write_frames(TumultFrame.room(room, [frame], self.protocol_version))
+
+
+class TumultSocket(TumultWriter):
     """Socket wrapper implementing the Tumult protocol."""
 
-    Request = namedtuple("Request", ["header", "contents"])
+    Request = Request
 
     @classmethod
     def valid_socket_address(cls, socket_address: tuple[str, int]) -> bool:
@@ -100,12 +892,23 @@ class TumultSocket:
         logging.info("Socket address is valid")
         return True
 
-    def __init__(self, raw_socket: Optional[socket.socket] = None) -> None:
+    def __init__(
+        self,
+        raw_socket: Optional[socket.socket] = None,
+        max_content_length: Optional[int] = None,
+    ) -> None:
         self.__raw_socket = (
             raw_socket
             if raw_socket is not None
             else socket.socket(socket.AF_INET, socket.SOCK_STREAM)
         )
+        self.__frame_buffer: FrameBuffer = FrameBuffer(max_content_length)
+        self.__receive_view: memoryview = memoryview(bytearray(RECEIVE_BUFFER_SIZE))
+
+    @property
+    def raw_socket(self) -> socket.socket:
+        """Returns the underlying socket."""
+        return self.__raw_socket
 
     def bind(self, socket_address: tuple[str, int]) -> None:
         """Binds the socket to the socket address"""
@@ -127,57 +930,57 @@ class TumultSocket:
         """Closes the current connection"""
         self.__raw_socket.close()
 
-    def write_message(self, nickname: Optional[str], message: str) -> None:
-        """Writes a message to the socket with the provided user's nickname and message."""
-        message_bytes = message.encode(ENCODING_FORMAT)
-        header_bytes = TumultHeader(
-            request_type=RequestType.MESSAGE,
-            nickname=nickname,
-            content_length=len(message_bytes),
-        ).to_bytes()
-        self.__raw_socket.send(header_bytes + message_bytes)
+    def write_frame(self, frame: TumultFrame) -> None:
+        """Sends the whole frame, gathering header and contents without joining them."""
+        if not frame.contents:
+            self.__raw_socket.sendall(frame.header)
+        elif hasattr(self.__raw_socket, "sendmsg"):
+            self.__sendmsg_all([frame.header, frame.contents])
+        else:
+            self.__raw_socket.sendall(frame.header + frame.contents)
 
-    def write_join_message(self, nickname: Optional[str]) -> None:
-        """Writes a join message to the socket with the provided user's nickname."""
-        header_bytes = TumultHeader(
-            request_type=RequestType.JOIN_MESSAGE, nickname=nickname
-        ).to_bytes()
-        self.__raw_socket.send(header_bytes)
+    def write_frames(self, frames: list[TumultFrame]) -> None:
+        """Sends several frames in order, gathering their buffers into as few writes as possible."""
+        if not hasattr(self.__raw_socket, "sendmsg"):
+            for frame in frames:
+                self.write_frame(frame)
+            return
 
-    def write_leave_message(self, nickname: Optional[str]) -> None:
-        """Writes a join message to the socket with the provided user's nickname."""
-        header_bytes = TumultHeader(
-            request_type=RequestType.LEAVE_MESSAGE, nickname=nickname
-        ).to_bytes()
-        self.__raw_socket.send(header_bytes)
-
-    def write_nickname(self, nickname: Optional[str]) -> None:
-        """Writes a nickname to the socket."""
-        header_bytes = TumultHeader(
-            request_type=RequestType.NICKNAME,
-            nickname=nickname,
-        ).to_bytes()
-        self.__raw_socket.send(header_bytes)
+        buffers: list[bytes] = [
+            buffer
+            for frame in frames
+            for buffer in (frame.header, frame.contents)
+            if buffer
+        ]
+        for start in range(0, len(buffers), SENDMSG_MAX_BUFFERS):
+            self.__sendmsg_all(buffers[start : start + SENDMSG_MAX_BUFFERS])
+
+    def abort(self) -> None:
+        """Shuts down the connection in both directions, waking any blocked reads or writes."""
+        try:
+            self.__raw_socket.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+
+    def __sendmsg_all(self, buffers: list[bytes]) -> None:
+        """Sends every buffer with scatter-gather writes, resuming after partial sends."""
+        views: list[memoryview] = [memoryview(buffer) for buffer in buffers]
+        while views:
+            sent: int = self.__raw_socket.sendmsg(views)
+            while views and sent >= len(views[0]):
+                sent -= len(views[0])
+                views.pop(0)
+            if views and sent:
+                views[0] = views[0][sent:]
 
     def read_request(self) -> Request:
-        """Reads and parses the next request from the socket."""
-        header_bytes: bytes = b""
-        reading_bytes: bool = True
-        while reading_bytes:
-            byte: bytes = self.__raw_socket.recv(1)
-            if not byte:
+        """Reads and parses the next request, only receiving from the socket when needed."""
+        while (request := self.__frame_buffer.next_request()) is None:
+            received: int = self.__raw_socket.recv_into(self.__receive_view)
+            if not received:
                 raise ConnectionError
-            header_bytes += byte
-            if header_bytes.endswith(b"\r\n"):
-                reading_bytes = False
-
-        header: TumultHeader = TumultHeader.from_bytes(header_bytes)
-        contents: bytes = (
-            self.__raw_socket.recv(header.content_length)
-            if header.content_length > 0
-            else b""
-        )
-        return TumultSocket.Request(header, contents)
+            self.__frame_buffer.feed(self.__receive_view[:received])
+        return request
 
     def wait_for_request(self, request_type: RequestType) -> Request:
         """Blocks the socket until a request of the provided type is received."""